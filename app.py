@@ -1,31 +1,427 @@
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for, send_from_directory
+from flask import Flask, request, jsonify, session, redirect, url_for, send_from_directory, g, Response, stream_with_context
 import sqlite3
 import os
-from datetime import datetime
+import hashlib
+import base64
+import json
+import csv
+import io
+import zlib
+import gzip
+import unicodedata
+import re
+import html
+import threading
+import time
+import calendar
+import queue
+from collections import OrderedDict, deque, namedtuple
+from datetime import date, datetime, timedelta, timezone
 import smtplib
 from email.message import EmailMessage
+from email.utils import formatdate
 import ssl
 from dotenv import load_dotenv
+import socket
 import urllib.request
 import certifi
+import click
+from werkzeug.exceptions import NotFound
+from concurrent.futures import ThreadPoolExecutor
+
+# Pillow é opcional: sem ele as imagens funcionam, só não há miniaturas
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+# brotli também: sem ele os arquivos estáticos saem só em gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Carregar variáveis de ambiente
 load_dotenv()
 
-app = Flask(__name__, template_folder='.')
+app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'sua_chave_secreta_aqui_123456')
 
 # Configurações do banco de dados
-DATABASE = 'banco.db'
+DATABASE = os.getenv('DATABASE', 'banco.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+
+# Cache de respostas do dashboard (por usuário)
+CACHE_MAX_ITENS = int(os.getenv('CACHE_MAX_ITENS', '1000'))
+CACHE_TTL_SEGUNDOS = int(os.getenv('CACHE_TTL_SEGUNDOS', '300'))
+
+# Fila de emails (outbox) processada em segundo plano
+EMAIL_WORKERS = int(os.getenv('EMAIL_WORKERS', '2'))
+EMAIL_MAX_TENTATIVAS = int(os.getenv('EMAIL_MAX_TENTATIVAS', '5'))
+EMAIL_BACKOFF_SEGUNDOS = int(os.getenv('EMAIL_BACKOFF_SEGUNDOS', '30'))
+EMAIL_INTERVALO_SEGUNDOS = float(os.getenv('EMAIL_INTERVALO_SEGUNDOS', '5'))
+
+# Conta do Gmail e sessões SMTP reaproveitadas
+EMAIL_REMETENTE = os.getenv('EMAIL_REMETENTE', 'agendamentomais.suporte1@gmail.com')
+EMAIL_SENHA_APP = os.getenv('EMAIL_SENHA_APP', 'dvno ipft lbds dpzg')
+SMTP_MAX_SESSOES = int(os.getenv('SMTP_MAX_SESSOES', str(max(EMAIL_WORKERS, 1))))
+SMTP_VERIFICAR_APOS_SEGUNDOS = float(os.getenv('SMTP_VERIFICAR_APOS_SEGUNDOS', '10'))
+# starttls (Gmail na 587), ssl (SSL direto, porta padrão 465) ou nenhuma
+# (servidor SMTP local de testes, ex.: python -m aiosmtpd -n -l localhost:1025)
+SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+SMTP_SEGURANCA = os.getenv('SMTP_SEGURANCA', 'starttls').lower()
+SMTP_PORTA = int(os.getenv('SMTP_PORTA', '465' if SMTP_SEGURANCA == 'ssl' else '587'))
+# Timeouts (segundos) e disjuntor que suspende os envios após falhas seguidas
+SMTP_TIMEOUT_CONEXAO = float(os.getenv('SMTP_TIMEOUT_CONEXAO', '10'))
+SMTP_TIMEOUT_ENVIO = float(os.getenv('SMTP_TIMEOUT_ENVIO', '30'))
+SMTP_DISJUNTOR_FALHAS = int(os.getenv('SMTP_DISJUNTOR_FALHAS', '5'))
+SMTP_DISJUNTOR_ABERTO_SEGUNDOS = float(os.getenv('SMTP_DISJUNTOR_ABERTO_SEGUNDOS', '60'))
+
+# Lembretes do dia anterior (intervalo 0 desliga o agendador)
+LEMBRETES_INTERVALO_SEGUNDOS = float(os.getenv('LEMBRETES_INTERVALO_SEGUNDOS', '3600'))
+LEMBRETES_LOTE = int(os.getenv('LEMBRETES_LOTE', '200'))
+
+# Imagens dos serviços, gravadas em disco pelo hash do conteúdo
+IMAGENS_DIR = os.getenv('IMAGENS_DIR', 'imagens')
+IMAGEM_MAX_BYTES = int(os.getenv('IMAGEM_MAX_BYTES', str(10 * 1024 * 1024)))
+# Miniaturas WebP geradas em segundo plano (precisa do Pillow)
+IMAGENS_LARGURAS = [int(largura) for largura in os.getenv('IMAGENS_LARGURAS', '160,320,640,1280').split(',')]
+IMAGENS_WORKERS = int(os.getenv('IMAGENS_WORKERS', '2'))
+
+# Arquivos estáticos pré-comprimidos na partida (verificação 0 = nunca recarrega)
+ESTATICOS_VERIFICAR_SEGUNDOS = float(os.getenv('ESTATICOS_VERIFICAR_SEGUNDOS', '2'))
+ESTATICOS_NIVEL_GZIP = int(os.getenv('ESTATICOS_NIVEL_GZIP', '9'))
+ESTATICOS_QUALIDADE_BROTLI = int(os.getenv('ESTATICOS_QUALIDADE_BROTLI', '11'))
+
+# Compressão das respostas da API (nível 0 desliga)
+COMPRESSAO_MIN_BYTES = int(os.getenv('COMPRESSAO_MIN_BYTES', '1024'))
+COMPRESSAO_NIVEL = int(os.getenv('COMPRESSAO_NIVEL', '6'))
+COMPRESSAO_QUALIDADE_BROTLI = int(os.getenv('COMPRESSAO_QUALIDADE_BROTLI', '5'))
+
+# Eventos em tempo real (SSE) no lugar do polling do dashboard
+EVENTOS_HEARTBEAT_SEGUNDOS = float(os.getenv('EVENTOS_HEARTBEAT_SEGUNDOS', '15'))
+EVENTOS_DURACAO_MAXIMA_SEGUNDOS = float(os.getenv('EVENTOS_DURACAO_MAXIMA_SEGUNDOS', '300'))
+EVENTOS_MAX_CONEXOES = int(os.getenv('EVENTOS_MAX_CONEXOES', '100'))
+EVENTOS_FILA_MAX = int(os.getenv('EVENTOS_FILA_MAX', '100'))
+EVENTOS_HISTORICO = int(os.getenv('EVENTOS_HISTORICO', '200'))
+EVENTOS_RETENCAO_SEGUNDOS = float(os.getenv('EVENTOS_RETENCAO_SEGUNDOS', '300'))
+
+# Importação de clientes em lote (linhas por transação e limites do relatório)
+IMPORTACAO_LOTE = int(os.getenv('IMPORTACAO_LOTE', '500'))
+IMPORTACAO_MAX_LINHAS = int(os.getenv('IMPORTACAO_MAX_LINHAS', '100000'))
+IMPORTACAO_MAX_ERROS = int(os.getenv('IMPORTACAO_MAX_ERROS', '100'))
+
+# Duração máxima de um serviço; também limita a faixa lida na checagem de conflitos
+AGENDAMENTO_DURACAO_MAXIMA_MINUTOS = int(os.getenv('AGENDAMENTO_DURACAO_MAXIMA_MINUTOS', '480'))
+
+# Séries de agendamentos: até onde as sem data final aparecem na listagem
+SERIES_HORIZONTE_DIAS = int(os.getenv('SERIES_HORIZONTE_DIAS', '90'))
+
+# Perfil de armazenamento do SQLite (PRAGMAs), ajustável pelo .env
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL').upper(),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL').upper(),
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000')),
+    'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', '-16000')),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(64 * 1024 * 1024))),
+    'temp_store': os.getenv('SQLITE_TEMP_STORE', 'MEMORY').upper()
+}
+
+# Valores aceitos para os PRAGMAs textuais (e como o SQLite os devolve)
+JOURNAL_MODES = ['DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF']
+SYNCHRONOUS_MODES = {'OFF': 0, 'NORMAL': 1, 'FULL': 2, 'EXTRA': 3}
+TEMP_STORE_MODES = {'DEFAULT': 0, 'FILE': 1, 'MEMORY': 2}
+
+def aplicar_pragmas(conn):
+    """
+    Aplica os PRAGMAs de conexão do perfil de armazenamento.
+
+    O journal_mode é persistente no arquivo e por isso é definido só uma
+    vez, em configurar_armazenamento().
+    """
+    conn.execute(f"PRAGMA synchronous = {SQLITE_PRAGMAS['synchronous']}")
+    conn.execute(f"PRAGMA busy_timeout = {SQLITE_PRAGMAS['busy_timeout']}")
+    conn.execute(f"PRAGMA cache_size = {SQLITE_PRAGMAS['cache_size']}")
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_PRAGMAS['mmap_size']}")
+    conn.execute(f"PRAGMA temp_store = {SQLITE_PRAGMAS['temp_store']}")
+
+def ler_perfil_armazenamento(conn):
+    """Compara o perfil configurado com os valores efetivos na conexão"""
+    esperado = {
+        'journal_mode': SQLITE_PRAGMAS['journal_mode'].lower(),
+        'synchronous': SYNCHRONOUS_MODES[SQLITE_PRAGMAS['synchronous']],
+        'busy_timeout': SQLITE_PRAGMAS['busy_timeout'],
+        'cache_size': SQLITE_PRAGMAS['cache_size'],
+        'mmap_size': SQLITE_PRAGMAS['mmap_size'],
+        'temp_store': TEMP_STORE_MODES[SQLITE_PRAGMAS['temp_store']]
+    }
+
+    perfil = {}
+    for nome, valor_esperado in esperado.items():
+        valor_atual = conn.execute(f"PRAGMA {nome}").fetchone()[0]
+        perfil[nome] = {
+            'configurado': SQLITE_PRAGMAS[nome],
+            'atual': valor_atual,
+            'ok': valor_atual == valor_esperado
+        }
+    return perfil
+
+def configurar_armazenamento():
+    """
+    Valida o perfil de armazenamento, ativa o journal_mode no banco e
+    confere se cada PRAGMA foi realmente aplicado.
+    """
+    if SQLITE_PRAGMAS['journal_mode'] not in JOURNAL_MODES:
+        raise ValueError(f"SQLITE_JOURNAL_MODE inválido: {SQLITE_PRAGMAS['journal_mode']}")
+    if SQLITE_PRAGMAS['synchronous'] not in SYNCHRONOUS_MODES:
+        raise ValueError(f"SQLITE_SYNCHRONOUS inválido: {SQLITE_PRAGMAS['synchronous']}")
+    if SQLITE_PRAGMAS['temp_store'] not in TEMP_STORE_MODES:
+        raise ValueError(f"SQLITE_TEMP_STORE inválido: {SQLITE_PRAGMAS['temp_store']}")
 
-def get_db_connection():
-    """Conecta ao banco de dados existente"""
     if not os.path.exists(DATABASE):
-        raise FileNotFoundError(f"Banco de dados '{DATABASE}' não encontrado!")
-    
+        print("⚠️ Perfil de armazenamento não aplicado: banco de dados ausente")
+        return {}
+
     conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    try:
+        conn.execute(f"PRAGMA journal_mode = {SQLITE_PRAGMAS['journal_mode']}")
+        aplicar_pragmas(conn)
+        perfil = ler_perfil_armazenamento(conn)
+    finally:
+        conn.close()
+
+    print("💾 Perfil de armazenamento do SQLite:")
+    for nome, info in perfil.items():
+        marcador = "✅" if info['ok'] else "⚠️"
+        print(f"   {marcador} {nome} = {info['atual']} (configurado: {info['configurado']})")
+
+    return perfil
+
+# =====================
+# POOL DE CONEXÕES
+# =====================
+
+class PoolConexoes:
+    """
+    Pool de conexões SQLite reaproveitadas entre requisições.
+
+    Cada thread tenta primeiro reaproveitar a última conexão que usou;
+    se ela estiver ocupada, pega qualquer conexão livre. Só abre uma
+    conexão nova (e só então verifica se o arquivo existe) quando o
+    pool está vazio. No máximo `tamanho` conexões ficam guardadas.
+    """
+
+    def __init__(self, banco, tamanho=5):
+        self.banco = banco
+        self.tamanho = tamanho
+        self._livres = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.descartadas = 0
+
+    def _conectar(self):
+        if not os.path.exists(self.banco):
+            raise FileNotFoundError(f"Banco de dados '{self.banco}' não encontrado!")
+
+        conn = sqlite3.connect(self.banco, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        aplicar_pragmas(conn)
+        return conn
+
+    def obter(self):
+        """Retira uma conexão do pool (ou abre uma nova)"""
+        ultima = getattr(self._local, 'conn', None)
+        conn = None
+
+        with self._lock:
+            if ultima is not None and ultima in self._livres:
+                self._livres.remove(ultima)
+                conn = ultima
+            elif self._livres:
+                conn = self._livres.pop()
+
+            if conn is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if conn is None:
+            conn = self._conectar()
+
+        self._local.conn = conn
+        return conn
+
+    def devolver(self, conn):
+        """Devolve a conexão ao pool, desfazendo transações abertas"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+
+        with self._lock:
+            if len(self._livres) < self.tamanho:
+                self._livres.append(conn)
+                return
+            self.descartadas += 1
+
+        conn.close()
+
+    def fechar_todas(self):
+        """Fecha todas as conexões livres (usado ao recriar o banco)"""
+        with self._lock:
+            livres, self._livres = self._livres, []
+        for conn in livres:
+            conn.close()
+
+    def estatisticas(self):
+        with self._lock:
+            livres = len(self._livres)
+        total = self.hits + self.misses
+        return {
+            'tamanho': self.tamanho,
+            'livres': livres,
+            'hits': self.hits,
+            'misses': self.misses,
+            'descartadas': self.descartadas,
+            'taxa_acerto': round(self.hits / total, 4) if total else 0.0
+        }
+
+pool_conexoes = PoolConexoes(DATABASE, DB_POOL_SIZE)
+
+def get_db_connection():
+    """
+    Retorna a conexão da requisição atual.
+
+    A conexão vem do pool e fica guardada em `g` até o fim da requisição,
+    quando é devolvida automaticamente (mesmo se a rota lançar exceção).
+    """
+    if 'db_conn' not in g:
+        g.db_conn = pool_conexoes.obter()
+    return g.db_conn
+
+@app.teardown_appcontext
+def devolver_conexao(exc):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        pool_conexoes.devolver(conn)
+
+# =====================
+# CACHE DE RESPOSTAS (POR GERAÇÃO)
+# =====================
+
+class CacheRespostas:
+    """
+    Cache LRU em memória das respostas calculadas por usuário.
+
+    Cada usuário tem um contador de geração, incrementado pelas rotas de
+    escrita. Uma entrada só vale enquanto a geração do usuário (e a época
+    global) for a mesma de quando foi calculada, então uma consulta sem
+    escritas no meio nunca toca o banco.
+
+    Escritas feitas por outros processos (outros workers do gunicorn) são
+    detectadas pelo PRAGMA data_version de uma conexão observadora: quando
+    ele muda sem que este processo tenha escrito, a época global avança e
+    todo o cache é invalidado. O TTL é só uma rede de segurança.
+    """
+
+    def __init__(self, banco, max_itens=1000, ttl=300):
+        self.banco = banco
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._geracoes = {}
+        self._epoca = 0
+        self._lock = threading.Lock()
+        self._observador = None
+        self._data_version = None
+        self.hits = 0
+        self.misses = 0
+        self.expulsos = 0
+        self.invalidacoes = 0
+        self.invalidacoes_externas = 0
+
+    def _ler_data_version(self):
+        # Chamado com self._lock adquirido
+        if self._observador is None:
+            if not os.path.exists(self.banco):
+                return None
+            self._observador = sqlite3.connect(self.banco, check_same_thread=False)
+        return self._observador.execute('PRAGMA data_version').fetchone()[0]
+
+    def _verificar_escritas_externas(self):
+        # Chamado com self._lock adquirido
+        versao = self._ler_data_version()
+        if versao is not None and versao != self._data_version:
+            if self._data_version is not None:
+                self._epoca += 1
+                self.invalidacoes_externas += 1
+            self._data_version = versao
+
+    def obter(self, nome, usuario_id):
+        """
+        Procura uma resposta no cache.
+
+        Retorna (valor, token): valor é None quando não há entrada válida,
+        e o token deve ser passado para guardar() depois de recalcular.
+        """
+        chave = (nome, usuario_id)
+        with self._lock:
+            self._verificar_escritas_externas()
+            token = (self._epoca, self._geracoes.get(usuario_id, 0))
+
+            item = self._itens.get(chave)
+            if item is not None and item[0] == token and time.monotonic() - item[1] < self.ttl:
+                self._itens.move_to_end(chave)
+                self.hits += 1
+                return item[2], token
+
+            self.misses += 1
+            return None, token
+
+    def guardar(self, nome, usuario_id, token, valor):
+        """Guarda uma resposta calculada com a geração indicada pelo token"""
+        chave = (nome, usuario_id)
+        with self._lock:
+            self._itens[chave] = (token, time.monotonic(), valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+                self.expulsos += 1
+
+    def invalidar(self, usuario_id):
+        """
+        Marca os dados do usuário como alterados (chamar após o commit).
+
+        O data_version atual é absorvido para que a escrita deste próprio
+        processo não seja confundida com uma escrita externa.
+        """
+        with self._lock:
+            self._geracoes[usuario_id] = self._geracoes.get(usuario_id, 0) + 1
+            self.invalidacoes += 1
+            versao = self._ler_data_version()
+            if versao is not None:
+                self._data_version = versao
+
+    def estatisticas(self):
+        with self._lock:
+            itens = len(self._itens)
+        total = self.hits + self.misses
+        return {
+            'itens': itens,
+            'max_itens': self.max_itens,
+            'hits': self.hits,
+            'misses': self.misses,
+            'expulsos': self.expulsos,
+            'invalidacoes': self.invalidacoes,
+            'invalidacoes_externas': self.invalidacoes_externas,
+            'taxa_acerto': round(self.hits / total, 4) if total else 0.0
+        }
+
+cache_respostas = CacheRespostas(DATABASE, CACHE_MAX_ITENS, CACHE_TTL_SEGUNDOS)
 
 def verificar_banco_dados():
     """
@@ -181,100 +577,1331 @@ def criar_banco_vazio():
     except Exception as e:
         print(f"❌ Erro ao criar banco de dados: {str(e)}")
 
-# Verificar banco de dados ao iniciar
-verificar_banco_dados()
-
 # =====================
-# FUNÇÃO DE ENVIO DE EMAIL COM CREDENCIAIS CORRETAS
+# ARMAZENAMENTO DE IMAGENS (POR HASH)
 # =====================
 
-def enviar_email_gmail(cliente_email, cliente_nome, servico_nome, data_agendamento, hora_agendamento, status):
+# O tipo vem dos primeiros bytes do arquivo, não do que o navegador declarou
+ASSINATURAS_IMAGEM = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+MIME_IMAGENS = {'jpg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif', 'webp': 'image/webp'}
+PADRAO_DATA_URL = re.compile(r'data:image/[\w.+-]+;base64,', re.IGNORECASE)
+# <hash>.<ext> para a original e <hash>-<largura>.webp para as miniaturas
+PADRAO_NOME_IMAGEM = re.compile(r'([0-9a-f]{64})(?:-(\d{2,4}))?\.(jpg|png|gif|webp)')
+BLOCO_IMAGEM = 64 * 1024
+
+class ImagemInvalida(ValueError):
+    """Imagem recusada pelo armazenamento (formato, tamanho ou base64)"""
+
+def extensao_imagem(dados):
+    if dados[:4] == b'RIFF' and dados[8:12] == b'WEBP':
+        return 'webp'
+    for assinatura, extensao in ASSINATURAS_IMAGEM:
+        if dados.startswith(assinatura):
+            return extensao
+    return None
+
+def caminho_imagem(nome):
+    """imagens/ab/abcdef....jpg: subpastas pelos dois primeiros caracteres do hash"""
+    return os.path.join(IMAGENS_DIR, nome[:2], nome)
+
+class PipelineMiniaturas:
+    """
+    Gera, fora da requisição, uma variante WebP de cada imagem do
+    armazenamento para cada largura de IMAGENS_LARGURAS (<hash>-<largura>.webp).
+
+    O trabalho roda num pool de threads: o Pillow libera o GIL ao decodificar,
+    redimensionar e codificar. Sem o Pillow instalado nada é gerado e as
+    páginas usam a imagem original.
+    """
+
+    def __init__(self, larguras, workers=2, qualidade=80):
+        self.larguras = tuple(sorted(larguras))
+        self.qualidade = qualidade
+        self.ativo = Image is not None
+        self._executor = None
+        if self.ativo and workers > 0:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='miniaturas')
+        self._lock = threading.Lock()
+        self._pendentes = set()
+        self.geradas = 0
+        self.falhas = 0
+
+    def validar(self, caminho):
+        """Confere com o Pillow (se houver) que o arquivo é uma imagem legível"""
+        if not self.ativo:
+            return True
+        try:
+            with Image.open(caminho) as imagem:
+                imagem.verify()
+            return True
+        except Exception:
+            return False
+
+    def agendar(self, nome):
+        """Coloca a imagem `nome` (<hash>.<ext>) na fila de miniaturas"""
+        if not self.ativo:
+            return
+        with self._lock:
+            if nome in self._pendentes:
+                return
+            self._pendentes.add(nome)
+        if self._executor:
+            self._executor.submit(self._gerar, nome)
+        else:
+            self._gerar(nome)
+
+    def _gerar(self, nome):
+        hash_imagem = nome.split('.', 1)[0]
+        try:
+            with Image.open(caminho_imagem(nome)) as original:
+                maior = self.larguras[-1]
+                if original.width > maior:
+                    # JPEG: decodifica já numa escala menor (bem mais rápido)
+                    original.draft('RGB', (maior, original.height * maior // original.width))
+                imagem = ImageOps.exif_transpose(original)
+                if imagem.mode not in ('RGB', 'RGBA'):
+                    imagem = imagem.convert('RGBA' if 'transparency' in imagem.info else 'RGB')
+                
+                # Da maior para a menor, cada variante sai da anterior
+                for largura in reversed(self.larguras):
+                    destino = caminho_imagem(f'{hash_imagem}-{largura}.webp')
+                    # Nunca amplia: larguras maiores que a original ficam no tamanho dela
+                    if imagem.width > largura:
+                        altura = max(1, round(imagem.height * largura / imagem.width))
+                        imagem = imagem.resize((largura, altura), Image.Resampling.LANCZOS)
+                    if os.path.exists(destino):
+                        continue
+                    temporario = f'{destino}.{os.getpid()}-{threading.get_ident()}.tmp'
+                    imagem.save(temporario, 'WEBP', quality=self.qualidade, method=4)
+                    os.replace(temporario, destino)
+                    with self._lock:
+                        self.geradas += 1
+        except Exception as e:
+            with self._lock:
+                self.falhas += 1
+            print(f"❌ Erro ao gerar miniaturas de {nome}: {str(e)}")
+        finally:
+            with self._lock:
+                self._pendentes.discard(nome)
+
+    def variantes(self, url):
+        """{largura: url} das miniaturas de uma imagem do armazenamento ({} se não houver)"""
+        if not self.ativo or not isinstance(url, str) or not url.startswith('/imagens/'):
+            return {}
+        arquivo = PADRAO_NOME_IMAGEM.fullmatch(url[len('/imagens/'):])
+        if not arquivo or arquivo.group(2):
+            return {}
+        return {largura: f'/imagens/{arquivo.group(1)}-{largura}.webp' for largura in self.larguras}
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'pillow': self.ativo,
+                'larguras': list(self.larguras),
+                'pendentes': len(self._pendentes),
+                'geradas': self.geradas,
+                'falhas': self.falhas
+            }
+
+miniaturas = PipelineMiniaturas(IMAGENS_LARGURAS, IMAGENS_WORKERS)
+
+def guardar_arquivo_imagem(origem):
     """
-    Envia email de notificação de agendamento usando Gmail
+    Copia a imagem de um arquivo/stream para o armazenamento em blocos,
+    calculando o SHA-256 no caminho, e retorna o nome final (<hash>.<ext>).
+
+    Conteúdo igual gera o mesmo arquivo (sem duplicatas), e um arquivo nunca
+    é alterado depois de gravado, o que permite cache imutável no navegador.
+    Imagens novas entram na fila de miniaturas.
     """
+    os.makedirs(IMAGENS_DIR, exist_ok=True)
+    # Grava num temporário e renomeia: ninguém lê um arquivo pela metade
+    temporario = os.path.join(IMAGENS_DIR, f'.upload-{os.getpid()}-{threading.get_ident()}.tmp')
+    conteudo = hashlib.sha256()
+    tamanho, extensao = 0, None
     try:
-        # CONFIGURAÇÃO DO EMAIL - CREDENCIAIS INSERIDAS DIRETAMENTE
-        SEU_EMAIL = 'agendamentomais.suporte1@gmail.com'
-        SENHA_APP = 'dvno ipft lbds dpzg'
-        
-        print(f"🔧 Configuração de email:")
-        print(f"   Email: {SEU_EMAIL}")
-        print(f"   Senha de app: {SENHA_APP}")
-        
-        if not cliente_email:
-            print(f"⚠️ Cliente {cliente_nome} não tem email cadastrado")
-            return False, "Cliente sem email"
-        
-        if "@" not in cliente_email or "." not in cliente_email:
-            print(f"⚠️ Email inválido: {cliente_email}")
-            return False, "Email inválido"
-        
-        # Converter data para formato brasileiro
+        with open(temporario, 'wb') as destino:
+            while True:
+                bloco = origem.read(BLOCO_IMAGEM)
+                if not bloco:
+                    break
+                if extensao is None:
+                    extensao = extensao_imagem(bloco)
+                    if not extensao:
+                        raise ImagemInvalida('Formato de imagem não suportado (use JPG, PNG, WebP ou GIF)')
+                tamanho += len(bloco)
+                if tamanho > IMAGEM_MAX_BYTES:
+                    raise ImagemInvalida(f'Imagem maior que {IMAGEM_MAX_BYTES // (1024 * 1024)} MB')
+                conteudo.update(bloco)
+                destino.write(bloco)
+        if extensao is None:
+            raise ImagemInvalida('Arquivo de imagem vazio')
+        
+        nome = f'{conteudo.hexdigest()}.{extensao}'
+        caminho = caminho_imagem(nome)
+        if os.path.exists(caminho):
+            return nome
+        if not miniaturas.validar(temporario):
+            raise ImagemInvalida('Imagem corrompida ou ilegível')
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        os.replace(temporario, caminho)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+    
+    miniaturas.agendar(nome)
+    return nome
+
+def guardar_imagem(dados):
+    """Grava a imagem (bytes) no armazenamento e retorna a URL"""
+    return f'/imagens/{guardar_arquivo_imagem(io.BytesIO(dados))}'
+
+def normalizar_imagem(valor):
+    """
+    Converte o campo imagem recebido pela API no valor gravado no banco:
+    data: URLs (como as geradas pelo canvas em serviços.html) vão para o
+    armazenamento e são trocadas pela URL; os demais valores ficam como estão.
+    """
+    if not valor:
+        return None
+    if not isinstance(valor, str):
+        return valor
+    inicio = PADRAO_DATA_URL.match(valor)
+    if not inicio:
+        return valor
+    if len(valor) - inicio.end() > IMAGEM_MAX_BYTES * 4 // 3 + 4:
+        raise ImagemInvalida(f'Imagem maior que {IMAGEM_MAX_BYTES // (1024 * 1024)} MB')
+    try:
+        dados = base64.b64decode(valor[inicio.end():], validate=True)
+    except ValueError:
+        raise ImagemInvalida('Imagem em base64 inválida')
+    return guardar_imagem(dados)
+
+@app.cli.command('limpar-imagens')
+@click.option('--idade-minima', default=3600, help='Só apaga arquivos sem uso mais antigos que isso (segundos).')
+def comando_limpar_imagens(idade_minima):
+    """Apaga do armazenamento as imagens que nenhum serviço usa mais"""
+    conn = pool_conexoes.obter()
+    try:
+        # Pelo hash: as miniaturas de uma imagem em uso também ficam
+        em_uso = {
+            linha[0].rsplit('/', 1)[-1][:64]
+            for linha in conn.execute("SELECT DISTINCT imagem FROM servicos WHERE imagem LIKE '/imagens/%'")
+        }
+    finally:
+        pool_conexoes.devolver(conn)
+    
+    # A idade mínima protege imagens recém-gravadas cujo serviço ainda não foi salvo
+    limite = time.time() - idade_minima
+    removidas = 0
+    for pasta, _, arquivos in os.walk(IMAGENS_DIR):
+        for nome in arquivos:
+            caminho = os.path.join(pasta, nome)
+            if nome[:64] not in em_uso and os.path.getmtime(caminho) < limite:
+                os.remove(caminho)
+                removidas += 1
+    print(f"🧹 {removidas} imagem(ns) sem uso removida(s); {len(em_uso)} em uso")
+
+# =====================
+# ARQUIVOS ESTÁTICOS (PRÉ-COMPRIMIDOS)
+# =====================
+
+# Só estes tipos saem da raiz do projeto: banco.db, app.py, .env e o resto
+# nunca entram no índice e respondem 404
+TIPOS_ESTATICOS = {
+    '.html': 'text/html; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'text/javascript; charset=utf-8',
+    '.json': 'application/json',
+    '.svg': 'image/svg+xml',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.ico': 'image/x-icon',
+    '.woff2': 'font/woff2'
+}
+# Texto comprime bem; imagens e fontes já vêm comprimidas
+EXTENSOES_COMPRIMIVEIS = {'.html', '.css', '.js', '.json', '.svg'}
+# header.css -> header.3f9a0c1b2d4e.css
+PADRAO_NOME_VERSIONADO = re.compile(r'(.+)\.([0-9a-f]{12})(\.[a-z0-9]+)')
+# Referências locais das páginas (href="header.css", src="header.js")
+PADRAO_REFERENCIA_HTML = re.compile(rb'((?:href|src)=")([^"/:?#$]+)(")')
+
+ArquivoEstatico = namedtuple('ArquivoEstatico', 'nome tipo hash versionado modificado_em corpos')
+
+class ArquivosEstaticos:
+    """
+    Índice dos arquivos servíveis da raiz do projeto, montado na partida.
+
+    Os de texto ficam em memória já comprimidos (gzip e, com o módulo brotli,
+    br); imagens continuam sendo lidas do disco. CSS, JS e afins ganham um
+    nome com o hash do conteúdo, que as páginas passam a referenciar, e podem
+    ficar um ano no cache do navegador. As páginas são revalidadas a cada
+    visita e recebem 304 quando nada mudou.
+    """
+    
+    def __init__(self, diretorio, verificar_apos=2, nivel_gzip=9, qualidade_brotli=11):
+        self.diretorio = diretorio
+        self.verificar_apos = verificar_apos
+        self.nivel_gzip = nivel_gzip
+        self.qualidade_brotli = qualidade_brotli
+        self._lock = threading.Lock()
+        self._indice = ({}, {})
+        self._assinatura = None
+        self._verificado_em = 0
+        self.recargas = 0
+    
+    def _escanear(self):
+        """Nome, mtime e tamanho dos arquivos servíveis (muda se algum mudar)"""
+        encontrados = []
+        with os.scandir(self.diretorio) as entradas:
+            for entrada in entradas:
+                extensao = os.path.splitext(entrada.name)[1].lower()
+                if entrada.name.startswith('.') or extensao not in TIPOS_ESTATICOS:
+                    continue
+                if not entrada.is_file():
+                    continue
+                info = entrada.stat()
+                encontrados.append((entrada.name, info.st_mtime_ns, info.st_size))
+        return tuple(sorted(encontrados))
+    
+    def _comprimir(self, conteudo):
+        """Variantes do conteúdo por Content-Encoding (só as que ficam menores)"""
+        corpos = {'identity': conteudo}
+        variantes = {'gzip': gzip.compress(conteudo, self.nivel_gzip, mtime=0)}
+        if brotli is not None:
+            variantes['br'] = brotli.compress(conteudo, quality=self.qualidade_brotli)
+        for codificacao, corpo in variantes.items():
+            if len(corpo) < len(conteudo):
+                corpos[codificacao] = corpo
+        return corpos
+    
+    def _montar(self, assinatura):
+        """Lê, versiona e comprime tudo; as páginas por último, já com as referências novas"""
+        arquivos = {}
+        versionados = {}
+        for nome, mtime_ns, _ in sorted(assinatura, key=lambda item: item[0].lower().endswith('.html')):
+            extensao = os.path.splitext(nome)[1].lower()
+            with open(os.path.join(self.diretorio, nome), 'rb') as arquivo:
+                conteudo = arquivo.read()
+            modificado_em = datetime.fromtimestamp(mtime_ns // 1_000_000_000, timezone.utc)
+            versionado = None
+            
+            if extensao == '.html':
+                referencias = []
+                
+                def versionar(ref):
+                    alvo = arquivos.get(unicodedata.normalize('NFC', ref.group(2).decode('utf-8', 'replace')))
+                    if alvo is None or alvo.versionado is None:
+                        return ref.group(0)
+                    referencias.append(alvo.modificado_em)
+                    return ref.group(1) + alvo.versionado.encode('utf-8') + ref.group(3)
+                
+                conteudo = PADRAO_REFERENCIA_HTML.sub(versionar, conteudo)
+                # A página muda quando um CSS/JS que ela usa muda
+                modificado_em = max([modificado_em] + referencias)
+            
+            hash_conteudo = hashlib.sha256(conteudo).hexdigest()[:12]
+            if extensao != '.html':
+                base = nome[:-len(extensao)]
+                versionado = f'{base}.{hash_conteudo}{extensao}'
+                versionados[versionado] = unicodedata.normalize('NFC', nome)
+            
+            arquivos[unicodedata.normalize('NFC', nome)] = ArquivoEstatico(
+                nome=nome,
+                tipo=TIPOS_ESTATICOS[extensao],
+                hash=hash_conteudo,
+                versionado=versionado,
+                modificado_em=modificado_em,
+                corpos=self._comprimir(conteudo) if extensao in EXTENSOES_COMPRIMIVEIS else None
+            )
+        return arquivos, versionados
+    
+    def atualizar(self, forcar=False):
+        """Remonta o índice se algum arquivo mudou (no máximo a cada verificar_apos segundos)"""
+        if not forcar and (not self.verificar_apos or time.monotonic() - self._verificado_em < self.verificar_apos):
+            return
+        # Outra thread já está verificando: segue com o índice atual
+        if not self._lock.acquire(blocking=forcar):
+            return
         try:
-            data_obj = datetime.strptime(data_agendamento, '%Y-%m-%d')
-            data_formatada = data_obj.strftime('%d/%m/%Y')
-        except:
-            data_formatada = data_agendamento
-        
-        print(f"📧 Preparando email para: {cliente_email}")
-        print(f"📤 Status: {status}")
-        
-        # Criar mensagem
-        msg = EmailMessage()
-        
-        # Definir assunto baseado no status
-        if status == 'pendente':
-            msg['Subject'] = f'Confirmação de Agendamento - {servico_nome}'
+            self._verificado_em = time.monotonic()
+            assinatura = self._escanear()
+            if assinatura != self._assinatura:
+                self._indice = self._montar(assinatura)
+                self._assinatura = assinatura
+                self.recargas += 1
+        finally:
+            self._lock.release()
+    
+    def responder(self, nome):
+        """Resposta para o arquivo pedido, negociando Accept-Encoding e cache"""
+        self.atualizar()
+        arquivos, versionados = self._indice
+        nome = unicodedata.normalize('NFC', nome)
+        
+        imutavel = False
+        arquivo = arquivos.get(nome)
+        if arquivo is None and nome in versionados:
+            arquivo = arquivos[versionados[nome]]
+            imutavel = True
+        elif arquivo is None:
+            # Versão anterior (página antiga em cache): entrega a atual, sem cache longo
+            anterior = PADRAO_NOME_VERSIONADO.fullmatch(nome)
+            if anterior:
+                arquivo = arquivos.get(anterior.group(1) + anterior.group(3))
+        if arquivo is None:
+            return "Arquivo não encontrado", 404
+        
+        codificacao = 'identity'
+        if arquivo.corpos:
+            aceitas = request.accept_encodings
+            opcoes = [c for c in ('br', 'gzip') if c in arquivo.corpos and aceitas[c]]
+            if opcoes:
+                # Empate na qualidade: br, que é menor
+                codificacao = max(opcoes, key=lambda c: aceitas[c])
+        etag = arquivo.hash if codificacao == 'identity' else f'{arquivo.hash}-{codificacao}'
+        
+        if request.if_none_match:
+            nao_modificado = request.if_none_match.contains_weak(etag)
         else:
-            msg['Subject'] = f'Atualização do Agendamento - {servico_nome}'
+            nao_modificado = request.if_modified_since is not None and request.if_modified_since >= arquivo.modificado_em
         
-        msg['From'] = f'Agendamento+ <{SEU_EMAIL}>'
-        msg['To'] = cliente_email
+        if nao_modificado:
+            resposta = Response(status=304)
+        elif arquivo.corpos is None:
+            try:
+                resposta = send_from_directory(
+                    self.diretorio, arquivo.nome, mimetype=arquivo.tipo, etag=False, conditional=False
+                )
+            except NotFound:
+                return "Arquivo não encontrado", 404
+        else:
+            resposta = Response(arquivo.corpos[codificacao], content_type=arquivo.tipo)
+            if codificacao != 'identity':
+                resposta.headers['Content-Encoding'] = codificacao
+        
+        if arquivo.corpos and len(arquivo.corpos) > 1:
+            resposta.vary.add('Accept-Encoding')
+        resposta.set_etag(etag)
+        resposta.last_modified = arquivo.modificado_em
+        resposta.headers['Cache-Control'] = 'public, max-age=31536000, immutable' if imutavel else 'no-cache'
+        resposta.headers['X-Content-Type-Options'] = 'nosniff'
+        return resposta
+    
+    def estatisticas(self):
+        arquivos = self._indice[0].values()
+        comprimidos = [arquivo.corpos for arquivo in arquivos if arquivo.corpos]
+        return {
+            'arquivos': len(arquivos),
+            'versionados': len(self._indice[1]),
+            'comprimidos': len(comprimidos),
+            'bytes_originais': sum(len(corpos['identity']) for corpos in comprimidos),
+            'bytes_gzip': sum(len(corpos.get('gzip', corpos['identity'])) for corpos in comprimidos),
+            'bytes_brotli': sum(len(corpos.get('br', corpos['identity'])) for corpos in comprimidos) if brotli else None,
+            'recargas': self.recargas
+        }
+
+estaticos = ArquivosEstaticos(
+    app.root_path,
+    verificar_apos=ESTATICOS_VERIFICAR_SEGUNDOS,
+    nivel_gzip=ESTATICOS_NIVEL_GZIP,
+    qualidade_brotli=ESTATICOS_QUALIDADE_BROTLI
+)
+estaticos.atualizar(forcar=True)
+
+# =====================
+# MIGRAÇÕES DO BANCO
+# =====================
+
+def migracao_001_indices_por_usuario(conn):
+    """Índices compostos para as consultas filtradas por usuario_id e JOINs"""
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_agendamentos_usuario_data
+        ON agendamentos (usuario_id, data_agendamento, hora_agendamento)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_agendamentos_usuario_status
+        ON agendamentos (usuario_id, status)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_agendamentos_usuario_criacao
+        ON agendamentos (usuario_id, data_criacao)
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_agendamentos_cliente ON agendamentos (cliente_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_agendamentos_servico ON agendamentos (servico_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_clientes_usuario_nome ON clientes (usuario_id, nome)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_clientes_usuario_criacao ON clientes (usuario_id, data_criacao)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_servicos_usuario_nome ON servicos (usuario_id, nome)')
+    conn.execute('ANALYZE')
+
+def migracao_002_versoes_tabela(conn):
+    """Versão por usuário e por tabela, mantida por triggers (usada nos ETags)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS versoes_tabela (
+            usuario_id INTEGER NOT NULL,
+            tabela TEXT NOT NULL,
+            versao INTEGER NOT NULL DEFAULT 0,
+            atualizado_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (usuario_id, tabela)
+        ) WITHOUT ROWID
+    ''')
+    
+    for tabela in ('servicos', 'clientes', 'agendamentos'):
+        for evento, linha in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_versao_{tabela}_{evento.lower()}
+                AFTER {evento} ON {tabela}
+                BEGIN
+                    INSERT INTO versoes_tabela (usuario_id, tabela, versao, atualizado_em)
+                    VALUES ({linha}.usuario_id, '{tabela}', 1, CURRENT_TIMESTAMP)
+                    ON CONFLICT (usuario_id, tabela) DO UPDATE
+                    SET versao = versao + 1, atualizado_em = excluded.atualizado_em;
+                END
+            ''')
+        
+        # Usuários com dados anteriores à migração começam na versão 1
+        conn.execute(f'''
+            INSERT OR IGNORE INTO versoes_tabela (usuario_id, tabela, versao)
+            SELECT DISTINCT usuario_id, '{tabela}', 1 FROM {tabela} WHERE usuario_id IS NOT NULL
+        ''')
+
+def migracao_003_indice_status_data(conn):
+    """Índice para listar agendamentos filtrados por status já na ordem de data"""
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_agendamentos_usuario_status_data
+        ON agendamentos (usuario_id, status, data_agendamento, hora_agendamento)
+    ''')
+    # O índice novo tem (usuario_id, status) como prefixo e substitui o antigo
+    conn.execute('DROP INDEX IF EXISTS idx_agendamentos_usuario_status')
+    conn.execute('ANALYZE')
+
+# Texto indexado na busca para cada tipo de registro ({r} é NEW ou OLD/alias)
+TEXTO_BUSCA = {
+    'cliente': "COALESCE({r}.nome, '') || ' ' || COALESCE({r}.email, '') || ' ' || COALESCE({r}.telefone, '')",
+    'servico': "COALESCE({r}.nome, '')",
+    'agendamento': (
+        "COALESCE((SELECT nome FROM clientes WHERE id = {r}.cliente_id), '') || ' ' || "
+        "COALESCE((SELECT nome FROM servicos WHERE id = {r}.servico_id), '') || ' ' || "
+        "COALESCE({r}.data_agendamento, '')"
+    )
+}
+
+# rowid na busca_fts = id * 3 + deslocamento do tipo
+DESLOCAMENTO_BUSCA = {'cliente': 0, 'servico': 1, 'agendamento': 2}
+
+def fts5_disponivel(conn):
+    try:
+        conn.execute('CREATE VIRTUAL TABLE temp.teste_fts5 USING fts5(x)')
+        conn.execute('DROP TABLE temp.teste_fts5')
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def migracao_004_busca_fts(conn):
+    """
+    Índice de busca FTS5 (sem acentos, com prefixos) mantido por triggers.
+
+    A coluna chave guarda um único token com usuário e tipo (ex.: u7cliente),
+    para que a busca de um usuário não precise filtrar os resultados de
+    todos os outros.
+    """
+    if not fts5_disponivel(conn):
+        print("⚠️ SQLite sem FTS5: a busca continuará usando LIKE")
+        return
+    
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS busca_fts USING fts5(
+            chave, texto,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+    
+    for tabela, tipo in (('clientes', 'cliente'), ('servicos', 'servico'), ('agendamentos', 'agendamento')):
+        deslocamento = DESLOCAMENTO_BUSCA[tipo]
+        inserir = f'''
+            INSERT INTO busca_fts (rowid, chave, texto)
+            VALUES (NEW.id * 3 + {deslocamento}, 'u' || NEW.usuario_id || '{tipo}', {TEXTO_BUSCA[tipo].format(r='NEW')});
+        '''
+        remover = f"DELETE FROM busca_fts WHERE rowid = OLD.id * 3 + {deslocamento};"
+        
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_busca_{tabela}_insert AFTER INSERT ON {tabela}
+            BEGIN {inserir} END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_busca_{tabela}_update AFTER UPDATE ON {tabela}
+            BEGIN {remover} {inserir} END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_busca_{tabela}_delete AFTER DELETE ON {tabela}
+            BEGIN {remover} END
+        ''')
         
-        # Mensagens personalizadas por status
-        if status == 'pendente':
-            mensagem_titulo = "Aguardando Confirmação"
-            mensagem_corpo = f"""
-            <p>Seu agendamento está <strong>PENDENTE</strong>. Entre em contato conosco para confirmar.</p>
-            <p><strong>Urgente:</strong> Precisamos da sua confirmação para garantir seu horário.</p>
-            """
-            cor_status = '#ffc107'
-            cor_texto = '#212529'
-            
-        elif status == 'confirmado':
-            mensagem_titulo = "Agendamento Confirmado!"
-            mensagem_corpo = f"""
-            <p>Seu agendamento foi <strong>CONFIRMADO</strong>. Estamos esperando por você!</p>
-            <p><strong>Importante:</strong> Chegue com 10 minutos de antecedência.</p>
-            """
-            cor_status = '#17a2b8'
-            cor_texto = 'white'
+        # Backfill dos registros existentes
+        conn.execute(f'''
+            INSERT INTO busca_fts (rowid, chave, texto)
+            SELECT t.id * 3 + {deslocamento}, 'u' || t.usuario_id || '{tipo}', {TEXTO_BUSCA[tipo].format(r='t')}
+            FROM {tabela} t
+            WHERE t.usuario_id IS NOT NULL
+            AND t.id * 3 + {deslocamento} NOT IN (SELECT rowid FROM busca_fts)
+        ''')
+    
+    # O texto dos agendamentos inclui os nomes de cliente e serviço
+    for tabela, coluna in (('clientes', 'cliente_id'), ('servicos', 'servico_id')):
+        for evento, linha in (('UPDATE OF nome', 'NEW'), ('DELETE', 'OLD')):
+            sufixo = 'nome' if evento.startswith('UPDATE') else 'delete'
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_busca_{tabela}_{sufixo}_agendamentos
+                AFTER {evento} ON {tabela}
+                BEGIN
+                    DELETE FROM busca_fts WHERE rowid IN (
+                        SELECT id * 3 + 2 FROM agendamentos WHERE {coluna} = {linha}.id
+                    );
+                    INSERT INTO busca_fts (rowid, chave, texto)
+                    SELECT a.id * 3 + 2, 'u' || a.usuario_id || 'agendamento', {TEXTO_BUSCA['agendamento'].format(r='a')}
+                    FROM agendamentos a
+                    WHERE a.{coluna} = {linha}.id AND a.usuario_id IS NOT NULL;
+                END
+            ''')
+
+def migracao_005_email_outbox(conn):
+    """Fila persistente de emails, gravada na mesma transação do agendamento"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL,
+            agendamento_id INTEGER,
+            destinatario TEXT NOT NULL,
+            cliente_nome TEXT,
+            servico_nome TEXT,
+            data_agendamento TEXT,
+            hora_agendamento TEXT,
+            status_agendamento TEXT,
+            estado TEXT NOT NULL DEFAULT 'pendente',
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            proxima_tentativa TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            ultimo_erro TEXT,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            enviado_em TIMESTAMP,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_email_outbox_fila
+        ON email_outbox (estado, proxima_tentativa)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_email_outbox_agendamento
+        ON email_outbox (usuario_id, agendamento_id)
+    ''')
+
+def migracao_006_lembretes(conn):
+    """Registro dos lembretes do dia anterior e índice por data (todos os usuários)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS lembretes_enviados (
+            agendamento_id INTEGER NOT NULL,
+            data_agendamento TEXT NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            destinatario TEXT,
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            reservado_em TIMESTAMP,
+            enviado_em TIMESTAMP,
+            ultimo_erro TEXT,
+            PRIMARY KEY (agendamento_id, data_agendamento)
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_agendamentos_data
+        ON agendamentos (data_agendamento)
+    ''')
+
+def migracao_007_imagens_em_arquivo(conn):
+    """
+    Move as imagens em data: URL de servicos.imagem para o armazenamento por
+    hash. Retorna True para pedir um VACUUM, que devolve as páginas liberadas.
+    """
+    servicos = conn.execute("SELECT id, imagem FROM servicos WHERE imagem LIKE 'data:%'").fetchall()
+    movidas = 0
+    for servico_id, imagem in servicos:
+        try:
+            url = normalizar_imagem(imagem)
+        except ImagemInvalida as e:
+            # Mantém o valor antigo em vez de perder a imagem
+            print(f"⚠️ Imagem do serviço {servico_id} mantida no banco: {e}")
+            continue
+        conn.execute('UPDATE servicos SET imagem = ? WHERE id = ?', (url, servico_id))
+        movidas += 1
+    if movidas:
+        print(f"🖼️ {movidas} imagem(ns) movida(s) para {IMAGENS_DIR}/")
+    return movidas > 0
+
+def migracao_008_configuracao_agenda(conn):
+    """Expediente e duração dos horários de cada usuário (usados em /api/disponibilidade)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS configuracao_agenda (
+            usuario_id INTEGER PRIMARY KEY,
+            duracao_slot_minutos INTEGER NOT NULL DEFAULT 30,
+            horarios TEXT NOT NULL,
+            atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def migracao_009_duracao_e_conflitos(conn):
+    """
+    Duração dos serviços, duração e profissional de cada agendamento e o
+    índice usado na checagem de horários sobrepostos.
+    """
+    colunas_servicos = {linha[1] for linha in conn.execute('PRAGMA table_info(servicos)')}
+    if 'duracao_minutos' not in colunas_servicos:
+        conn.execute('ALTER TABLE servicos ADD COLUMN duracao_minutos INTEGER')
+    
+    colunas_agendamentos = {linha[1] for linha in conn.execute('PRAGMA table_info(agendamentos)')}
+    if 'duracao_minutos' not in colunas_agendamentos:
+        conn.execute('ALTER TABLE agendamentos ADD COLUMN duracao_minutos INTEGER')
+    if 'profissional' not in colunas_agendamentos:
+        conn.execute('ALTER TABLE agendamentos ADD COLUMN profissional TEXT')
+    
+    # Parcial: os cancelados não ocupam a agenda e ficam fora do índice
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_agendamentos_agenda
+        ON agendamentos (usuario_id, data_agendamento, profissional, hora_agendamento)
+        WHERE status != 'cancelado'
+    ''')
+
+def migracao_010_series_agendamento(conn):
+    """
+    Séries de agendamentos recorrentes (uma linha por série) e as exceções:
+    datas que saíram da série, removidas ou gravadas como agendamento comum.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS series_agendamento (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cliente_id INTEGER NOT NULL,
+            servico_id INTEGER NOT NULL,
+            hora_agendamento TEXT NOT NULL,
+            duracao_minutos INTEGER,
+            profissional TEXT,
+            status TEXT NOT NULL DEFAULT 'pendente',
+            frequencia TEXT NOT NULL,
+            intervalo INTEGER NOT NULL DEFAULT 1,
+            data_inicio TEXT NOT NULL,
+            data_fim TEXT,
+            ocorrencias INTEGER,
+            data_limite TEXT NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    ''')
+    # data_limite é a última data possível ('9999-12-31' sem fim): a janela
+    # consultada vira uma faixa no índice
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_series_agendamento_janela
+        ON series_agendamento (usuario_id, data_limite, data_inicio)
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS excecoes_serie (
+            serie_id INTEGER NOT NULL,
+            data_ocorrencia TEXT NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            agendamento_id INTEGER,
+            PRIMARY KEY (serie_id, data_ocorrencia)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_excecoes_serie_usuario_data
+        ON excecoes_serie (usuario_id, data_ocorrencia)
+    ''')
+    
+    colunas = {linha[1] for linha in conn.execute('PRAGMA table_info(agendamentos)')}
+    if 'serie_id' not in colunas:
+        conn.execute('ALTER TABLE agendamentos ADD COLUMN serie_id INTEGER')
+    
+    # As duas tabelas contam como 'series_agendamento' nos ETags
+    for tabela in ('series_agendamento', 'excecoes_serie'):
+        for evento, linha in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_versao_{tabela}_{evento.lower()}
+                AFTER {evento} ON {tabela}
+                BEGIN
+                    INSERT INTO versoes_tabela (usuario_id, tabela, versao, atualizado_em)
+                    VALUES ({linha}.usuario_id, 'series_agendamento', 1, CURRENT_TIMESTAMP)
+                    ON CONFLICT (usuario_id, tabela) DO UPDATE
+                    SET versao = versao + 1, atualizado_em = excluded.atualizado_em;
+                END
+            ''')
+
+def migracao_011_dia_e_minuto_inteiros(conn):
+    """
+    Dia (dias desde 1970-01-01) e minuto do dia de cada agendamento como
+    colunas inteiras geradas a partir do texto, e os índices de agenda
+    refeitos sobre elas.
+
+    Por serem GENERATED, INSERT/UPDATE continuam gravando só o texto e as
+    colunas nunca ficam fora de sincronia; as antigas também ganham os
+    valores. Data ou hora fora do formato ficam NULL.
+    """
+    colunas = {linha[1] for linha in conn.execute('PRAGMA table_xinfo(agendamentos)')}
+    if 'dia_agendamento' not in colunas:
+        conn.execute('''
+            ALTER TABLE agendamentos ADD COLUMN dia_agendamento INTEGER
+            GENERATED ALWAYS AS (CAST(julianday(data_agendamento) - 2440587.5 AS INTEGER)) VIRTUAL
+        ''')
+    if 'minuto_agendamento' not in colunas:
+        conn.execute('''
+            ALTER TABLE agendamentos ADD COLUMN minuto_agendamento INTEGER
+            GENERATED ALWAYS AS (
+                CASE WHEN hora_agendamento GLOB '[0-2][0-9]:[0-5][0-9]*'
+                     THEN CAST(substr(hora_agendamento, 1, 2) AS INTEGER) * 60
+                          + CAST(substr(hora_agendamento, 4, 2) AS INTEGER)
+                END
+            ) VIRTUAL
+        ''')
+    
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_agendamentos_usuario_dia
+        ON agendamentos (usuario_id, dia_agendamento, minuto_agendamento)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_agendamentos_usuario_status_dia
+        ON agendamentos (usuario_id, status, dia_agendamento, minuto_agendamento)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_agendamentos_agenda_dia
+        ON agendamentos (usuario_id, dia_agendamento, profissional, minuto_agendamento)
+        WHERE status != 'cancelado'
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_agendamentos_dia ON agendamentos (dia_agendamento)')
+    
+    # Os equivalentes em texto deixam de ser usados
+    for indice in ('idx_agendamentos_usuario_data', 'idx_agendamentos_usuario_status_data',
+                   'idx_agendamentos_agenda', 'idx_agendamentos_data'):
+        conn.execute(f'DROP INDEX IF EXISTS {indice}')
+
+FORMATOS_DATA_ANTIGOS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d', '%d.%m.%Y')
+PADRAO_HORA_ANTIGA = re.compile(r'(\d{1,2})(?:\s*[:hH.]\s*(\d{2})?)?(?::\d{2})?\s*(?:h|hs|hrs)?', re.IGNORECASE)
+
+def normalizar_data_texto(valor):
+    """'02/11/2026', '2026/11/02', '2026-11-02 10:00' -> '2026-11-02'; None se não der"""
+    texto = str(valor or '').strip().replace('T', ' ').split(' ')[0]
+    for formato in FORMATOS_DATA_ANTIGOS:
+        try:
+            return datetime.strptime(texto, formato).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+def normalizar_hora_texto(valor):
+    """'9:30', '09h30', '14h', '10:00:00' -> 'HH:MM'; None se não der"""
+    correspondencia = PADRAO_HORA_ANTIGA.fullmatch(str(valor or '').strip())
+    if not correspondencia:
+        return None
+    horas, minutos = int(correspondencia.group(1)), int(correspondencia.group(2) or 0)
+    if horas > 23 or minutos > 59:
+        return None
+    return f'{horas:02d}:{minutos:02d}'
+
+def migracao_012_normalizar_data_hora(conn):
+    """
+    Reescreve em AAAA-MM-DD e HH:MM as datas e horas gravadas em outros
+    formatos: com dia_agendamento/minuto_agendamento NULL elas ficavam
+    fora dos filtros, do cursor, das estatísticas e da checagem de
+    conflitos. As que não dá para converter são listadas no log.
+    """
+    linhas = conn.execute('''
+        SELECT id, data_agendamento, hora_agendamento FROM agendamentos
+        WHERE dia_agendamento IS NULL OR minuto_agendamento IS NULL
+           OR data_agendamento IS NOT date(data_agendamento)
+    ''').fetchall()
+    
+    sem_conversao = []
+    for agendamento_id, data_agendamento, hora_agendamento in linhas:
+        data_nova = normalizar_data_texto(data_agendamento)
+        hora_nova = (hora_agendamento if re.fullmatch(r'[0-2]\d:[0-5]\d(:[0-5]\d)?', str(hora_agendamento or ''))
+                     else normalizar_hora_texto(hora_agendamento))
+        if not data_nova or not hora_nova:
+            sem_conversao.append(agendamento_id)
+            continue
+        conn.execute(
+            'UPDATE agendamentos SET data_agendamento = ?, hora_agendamento = ? WHERE id = ?',
+            (data_nova, hora_nova, agendamento_id)
+        )
+    
+    if sem_conversao:
+        print(f"⚠️ {len(sem_conversao)} agendamento(s) com data/hora que não pôde ser convertida "
+              f"(ficam fora da agenda até serem corrigidos): ids {', '.join(map(str, sem_conversao))}")
+
+def migracao_013_indice_series_vigentes(conn):
+    """
+    Índice das séries por vigência sem usuario_id na frente: a rodada de
+    lembretes (materializar_ocorrencias_do_dia) procura as séries de todos
+    os usuários que cobrem um dia. data_limite vem primeiro porque as
+    séries encerradas se acumulam com o tempo e as que ainda vão começar
+    são poucas.
+    """
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_series_agendamento_vigencia
+        ON series_agendamento (data_limite, data_inicio)
+    ''')
+
+def migracao_014_indice_sem_data(conn):
+    """
+    Índice parcial dos agendamentos que a migração 12 não conseguiu
+    converter (dia_agendamento/minuto_agendamento NULL): a listagem e o
+    dashboard os mostram num bloco à parte, depois dos datados, sem
+    percorrer a agenda inteira para achá-los.
+    """
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_agendamentos_sem_data
+        ON agendamentos (usuario_id, id)
+        WHERE dia_agendamento IS NULL OR minuto_agendamento IS NULL
+    ''')
+
+# Lista ordenada de migrações: (versão, descrição, função).
+# Nunca altere uma migração já publicada; crie uma nova versão.
+MIGRACOES = [
+    (1, 'Índices compostos por usuario_id', migracao_001_indices_por_usuario),
+    (2, 'Versões por usuário e tabela (ETag)', migracao_002_versoes_tabela),
+    (3, 'Índice de agendamentos por status e data', migracao_003_indice_status_data),
+    (4, 'Índice de busca FTS5', migracao_004_busca_fts),
+    (5, 'Fila de emails (outbox)', migracao_005_email_outbox),
+    (6, 'Lembretes do dia anterior', migracao_006_lembretes),
+    (7, 'Imagens dos serviços em arquivos', migracao_007_imagens_em_arquivo),
+    (8, 'Configuração de expediente da agenda', migracao_008_configuracao_agenda),
+    (9, 'Duração dos serviços e conflitos de horário', migracao_009_duracao_e_conflitos),
+    (10, 'Séries de agendamentos recorrentes', migracao_010_series_agendamento),
+    (11, 'Dia e minuto inteiros dos agendamentos', migracao_011_dia_e_minuto_inteiros),
+    (12, 'Datas e horas dos agendamentos em AAAA-MM-DD e HH:MM', migracao_012_normalizar_data_hora),
+    (13, 'Índice das séries por vigência (todos os usuários)', migracao_013_indice_series_vigentes),
+    (14, 'Índice dos agendamentos sem data/hora válida', migracao_014_indice_sem_data),
+]
+
+def versao_schema(conn):
+    """Retorna a versão atual do schema (0 se nunca foi migrado)"""
+    tabela = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name='schema_version'"
+    ).fetchone()
+    if not tabela:
+        return 0
+    return conn.execute('SELECT COALESCE(MAX(versao), 0) FROM schema_version').fetchone()[0]
+
+def aplicar_migracoes():
+    """
+    Aplica, em ordem, as migrações ainda não registradas em schema_version.
+
+    Cada migração roda em sua própria transação (BEGIN IMMEDIATE), e a
+    versão é conferida de novo dentro dela, então vários workers podem
+    subir ao mesmo tempo sem aplicar a mesma migração duas vezes.
+    """
+    if not os.path.exists(DATABASE):
+        print("⚠️ Migrações não aplicadas: banco de dados ausente")
+        return 0
+
+    conn = sqlite3.connect(DATABASE, isolation_level=None)
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                versao INTEGER PRIMARY KEY,
+                descricao TEXT NOT NULL,
+                aplicada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        compactar = False
+        for versao, descricao, migracao in MIGRACOES:
+            if versao <= versao_schema(conn):
+                continue
+
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if versao <= versao_schema(conn):
+                    conn.execute('ROLLBACK')
+                    continue
+
+                if migracao(conn):
+                    compactar = True
+                conn.execute(
+                    'INSERT INTO schema_version (versao, descricao) VALUES (?, ?)',
+                    (versao, descricao)
+                )
+                conn.execute('COMMIT')
+                print(f"✅ Migração {versao:03d} aplicada: {descricao}")
+            except Exception:
+                conn.execute('ROLLBACK')
+                print(f"❌ Falha na migração {versao:03d}: {descricao}")
+                raise
+
+        if compactar:
+            # VACUUM não roda dentro de transação, por isso fica para o fim
+            try:
+                conn.execute('VACUUM')
+                print("🧹 Banco compactado (VACUUM)")
+            except sqlite3.OperationalError as e:
+                print(f"⚠️ VACUUM adiado: {str(e)}")
+
+        versao = versao_schema(conn)
+        print(f"🗂️ Schema do banco na versão {versao}")
+        return versao
+    finally:
+        conn.close()
+
+# Verificar banco de dados ao iniciar
+verificar_banco_dados()
+configurar_armazenamento()
+aplicar_migracoes()
+
+# =====================
+# SESSÕES SMTP REAPROVEITADAS
+# =====================
+
+# Erros que indicam que a sessão SMTP caiu (e não que a mensagem foi recusada)
+ERROS_CONEXAO_SMTP = (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout, ssl.SSLError)
+
+# Recusas de uma mensagem específica: o servidor respondeu, então não
+# contam como falha do transporte para o disjuntor
+ERROS_MENSAGEM_SMTP = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                       smtplib.SMTPDataError, smtplib.SMTPNotSupportedError)
+
+def servidor_encerrou_sessao(erro):
+    """Resposta 421: o servidor recusou e vai fechar a conexão (RFC 5321)"""
+    if isinstance(erro, smtplib.SMTPRecipientsRefused):
+        return any(codigo == 421 for codigo, _ in erro.recipients.values())
+    return getattr(erro, 'smtp_code', None) == 421
+
+class SMTPIndisponivel(Exception):
+    """O disjuntor do SMTP está aberto: o envio nem chega a ser tentado"""
+
+class DisjuntorSMTP:
+    """
+    Circuit breaker do transporte SMTP.
+
+    fechado: envios normais; `limite_falhas` falhas seguidas de conexão,
+    autenticação ou timeout abrem o disjuntor.
+    aberto: os envios falham na hora com SMTPIndisponivel durante
+    `aberto_segundos`, sem prender threads esperando a rede.
+    meio-aberto: passado esse tempo, um único envio de teste é liberado; se
+    funcionar o disjuntor fecha, se falhar abre de novo.
+    """
+
+    def __init__(self, limite_falhas=5, aberto_segundos=60):
+        self.limite_falhas = limite_falhas
+        self.aberto_segundos = aberto_segundos
+        self._lock = threading.Lock()
+        self.estado = 'fechado'
+        self.falhas_seguidas = 0
+        self.aberto_ate = 0.0
+        self._teste_liberado = False
+        self.aberturas = 0
+        self.rejeitados = 0
+        self.ultimo_erro = None
+
+    def _liberado(self):
+        if self.estado == 'fechado':
+            return True
+        if self.estado == 'aberto':
+            return time.monotonic() >= self.aberto_ate
+        return not self._teste_liberado
+
+    def disponivel(self):
+        """Consulta sem efeitos: um envio agora seria tentado?"""
+        with self._lock:
+            return self._liberado()
+
+    def permitir(self):
+        """Reserva a passagem de um envio (no meio-aberto, só um por vez)"""
+        with self._lock:
+            if not self._liberado():
+                self.rejeitados += 1
+                return False
+            if self.estado == 'aberto':
+                self.estado = 'meio-aberto'
+            if self.estado == 'meio-aberto':
+                self._teste_liberado = True
+            return True
+
+    def registrar_sucesso(self):
+        with self._lock:
+            if self.estado != 'fechado':
+                print("✅ Disjuntor do SMTP fechado: envios normalizados")
+            self.estado = 'fechado'
+            self.falhas_seguidas = 0
+            self._teste_liberado = False
+
+    def registrar_falha(self, erro):
+        with self._lock:
+            self.falhas_seguidas += 1
+            self.ultimo_erro = str(erro)
+            if self.estado == 'meio-aberto' or self.falhas_seguidas >= self.limite_falhas:
+                if self.estado != 'aberto':
+                    self.aberturas += 1
+                    print(f"⚡ Disjuntor do SMTP aberto por {self.aberto_segundos:.0f}s: {self.ultimo_erro}")
+                self.estado = 'aberto'
+                self.aberto_ate = time.monotonic() + self.aberto_segundos
+                self._teste_liberado = False
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'estado': self.estado,
+                'falhas_seguidas': self.falhas_seguidas,
+                'limite_falhas': self.limite_falhas,
+                'aberturas': self.aberturas,
+                'rejeitados': self.rejeitados,
+                'reabre_em_segundos': (
+                    round(max(self.aberto_ate - time.monotonic(), 0), 1)
+                    if self.estado == 'aberto' else None
+                ),
+                'ultimo_erro': self.ultimo_erro
+            }
+
+class ConexoesSMTP:
+    """
+    Mantém sessões SMTP autenticadas no Gmail abertas entre os envios.
+
+    Cada envio pega uma sessão livre (no máximo `max_sessoes` ao mesmo
+    tempo). Sessões paradas há mais de `verificar_apos` segundos são
+    testadas com NOOP antes do uso; se a sessão cair no meio do envio, ela
+    é descartada e o envio é refeito uma vez numa conexão nova.
+
+    Conexão e envio têm timeouts próprios, e o `disjuntor` corta os envios
+    enquanto o servidor estiver falhando.
+    """
+
+    def __init__(self, usuario, senha, max_sessoes=2, verificar_apos=10,
+                 host='smtp.gmail.com', porta=587, seguranca='starttls',
+                 timeout_conexao=10, timeout_envio=30, disjuntor=None):
+        self.usuario = usuario
+        self.senha = senha
+        self.host = host
+        self.porta = porta
+        self.seguranca = seguranca
+        self.timeout_conexao = timeout_conexao
+        self.timeout_envio = timeout_envio
+        self.disjuntor = disjuntor or DisjuntorSMTP()
+        self.max_sessoes = max_sessoes
+        self.verificar_apos = verificar_apos
+        self._livres = []
+        self._lock = threading.Lock()
+        self._semaforo = threading.BoundedSemaphore(max_sessoes)
+        self._latencias = []
+        self.conexoes_abertas = 0
+        self.reutilizadas = 0
+        self.reconexoes = 0
+        self.envios = 0
+        self.falhas = 0
+
+    def _conectar(self):
+        """
+        Abre e autentica uma sessão no modo de `seguranca` configurado.
+
+        Não há troca automática de modo (STARTTLS -> SSL na 465): com o
+        servidor fora do ar ela só dobraria a espera pelo timeout antes de
+        o disjuntor ver a falha.
+        """
+        if self.seguranca == 'nenhuma':
+            # Servidor local sem TLS nem autenticação (testes)
+            server = smtplib.SMTP(self.host, self.porta, timeout=self.timeout_conexao)
+            server.ehlo()
+        elif self.seguranca == 'ssl':
+            server = self._conectar_ssl()
+        else:
+            server = self._conectar_starttls()
+        
+        # Daqui em diante vale o timeout de envio (comandos e DATA)
+        server.sock.settimeout(self.timeout_envio)
+        with self._lock:
+            self.conexoes_abertas += 1
+        print(f"🔌 Nova sessão SMTP autenticada como {self.usuario}")
+        return server
+
+    def _contexto_tls(self):
+        # Verificação padrão: certificado válido e emitido para o host
+        return ssl.create_default_context(cafile=certifi.where())
+
+    def _conectar_ssl(self):
+        server = smtplib.SMTP_SSL(self.host, self.porta, context=self._contexto_tls(),
+                                  timeout=self.timeout_conexao)
+        try:
+            server.login(self.usuario, self.senha)
+        except Exception:
+            self._fechar(server)
+            raise
+        return server
+
+    def _conectar_starttls(self):
+        server = smtplib.SMTP(self.host, self.porta, timeout=self.timeout_conexao)
+        try:
+            server.ehlo()  # Identifica-se com o servidor
+            server.starttls(context=self._contexto_tls())  # Habilita criptografia TLS
+            server.ehlo()  # Re-identifica-se após TLS
+            server.login(self.usuario, self.senha)
+        except Exception:
+            self._fechar(server)
+            raise
+        return server
+
+    def _fechar(self, server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _sessao_valida(self, server, ultimo_uso):
+        if time.monotonic() - ultimo_uso < self.verificar_apos:
+            return True
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _obter(self):
+        """Retorna (sessão, reutilizada)"""
+        while True:
+            with self._lock:
+                if not self._livres:
+                    break
+                server, ultimo_uso = self._livres.pop()
             
-        elif status == 'realizado':
-            mensagem_titulo = "Agendamento Realizado"
-            mensagem_corpo = f"""
-            <p>Seu agendamento foi <strong>REALIZADO</strong> com sucesso!</p>
-            <p><strong>Obrigado por confiar em nós!</strong> Esperamos ter atendido suas expectativas.</p>
-            """
-            cor_status = '#28a745'
-            cor_texto = 'white'
+            if self._sessao_valida(server, ultimo_uso):
+                with self._lock:
+                    self.reutilizadas += 1
+                return server, True
             
-        elif status == 'cancelado':
-            mensagem_titulo = "Agendamento Cancelado"
-            mensagem_corpo = f"""
-            <p>Seu agendamento foi <strong>CANCELADO</strong>.</p>
-            <p>Entre em contato conosco para mais informações ou para reagendar.</p>
-            """
-            cor_status = '#dc3545'
-            cor_texto = 'white'
-        else:
-            mensagem_titulo = "Atualização do Agendamento"
-            mensagem_corpo = f"<p>Seu agendamento foi atualizado para: <strong>{status.upper()}</strong></p>"
-            cor_status = '#6c757d'
-            cor_texto = 'white'
+            self._fechar(server)
+            with self._lock:
+                self.reconexoes += 1
         
-        # HTML do email
-        html = f"""
+        return self._conectar(), False
+
+    def _devolver(self, server):
+        with self._lock:
+            self._livres.append((server, time.monotonic()))
+
+    def _enviar_na_sessao(self, server, msg):
+        try:
+            if isinstance(msg, MensagemEmail):
+                server.sendmail(msg.remetente, [msg.destinatario], msg.dados)
+            else:
+                server.send_message(msg)
+        except ERROS_MENSAGEM_SMTP as e:
+            if servidor_encerrou_sessao(e):
+                server.close()
+            else:
+                # Mensagem recusada: a sessão continua boa
+                self._devolver(server)
+            raise
+        except Exception:
+            # Sem QUIT: numa conexão travada ele esperaria o timeout de novo.
+            # Qualquer outro erro deixa a sessão em estado desconhecido
+            server.close()
+            raise
+        self._devolver(server)
+
+    def enviar(self, msg):
+        """
+        Envia uma mensagem reaproveitando uma sessão autenticada.
+
+        Levanta SMTPIndisponivel, sem tocar na rede, se o disjuntor estiver aberto.
+        """
+        if not self.disjuntor.permitir():
+            raise SMTPIndisponivel(
+                f"Servidor de email indisponível ({self.disjuntor.ultimo_erro}); envio adiado"
+            )
+        with self._semaforo:
+            inicio = time.perf_counter()
+            queda_registrada = None
+            try:
+                server, reutilizada = self._obter()
+                try:
+                    self._enviar_na_sessao(server, msg)
+                except ERROS_CONEXAO_SMTP as e:
+                    # Timeout não é sessão velha: repetir só dobraria a espera
+                    if not reutilizada or isinstance(e, socket.timeout):
+                        raise
+                    # A sessão caiu entre a verificação e o envio. A queda já
+                    # conta para o disjuntor; se ele abrir, não há nova conexão
+                    self.disjuntor.registrar_falha(e)
+                    queda_registrada = e
+                    if not self.disjuntor.disponivel():
+                        raise
+                    with self._lock:
+                        self.reconexoes += 1
+                    self._enviar_na_sessao(self._conectar(), msg)
+            except ERROS_MENSAGEM_SMTP as e:
+                with self._lock:
+                    self.falhas += 1
+                if servidor_encerrou_sessao(e):
+                    self.disjuntor.registrar_falha(e)
+                else:
+                    self.disjuntor.registrar_sucesso()
+                raise
+            except Exception as e:
+                with self._lock:
+                    self.falhas += 1
+                if e is not queda_registrada:
+                    self.disjuntor.registrar_falha(e)
+                raise
+            
+            self.disjuntor.registrar_sucesso()
+            with self._lock:
+                self.envios += 1
+                self._latencias.append(time.perf_counter() - inicio)
+                del self._latencias[:-200]
+
+    def fechar_todas(self):
+        with self._lock:
+            livres, self._livres = self._livres, []
+        for server, _ in livres:
+            self._fechar(server)
+
+    def estatisticas(self):
+        with self._lock:
+            latencias = sorted(self._latencias)
+            livres = len(self._livres)
+            dados = {
+                'sessoes_livres': livres,
+                'max_sessoes': self.max_sessoes,
+                'conexoes_abertas': self.conexoes_abertas,
+                'reutilizadas': self.reutilizadas,
+                'reconexoes': self.reconexoes,
+                'envios': self.envios,
+                'falhas': self.falhas,
+                'timeout_conexao': self.timeout_conexao,
+                'timeout_envio': self.timeout_envio
+            }
+        dados['disjuntor'] = self.disjuntor.estatisticas()
+        if latencias:
+            dados['latencia_media_ms'] = round(sum(latencias) / len(latencias) * 1000, 1)
+            dados['latencia_p95_ms'] = round(latencias[int(len(latencias) * 0.95)] * 1000, 1)
+        return dados
+
+conexoes_smtp = ConexoesSMTP(
+    EMAIL_REMETENTE, EMAIL_SENHA_APP, SMTP_MAX_SESSOES, SMTP_VERIFICAR_APOS_SEGUNDOS,
+    SMTP_HOST, SMTP_PORTA, SMTP_SEGURANCA, SMTP_TIMEOUT_CONEXAO, SMTP_TIMEOUT_ENVIO,
+    DisjuntorSMTP(SMTP_DISJUNTOR_FALHAS, SMTP_DISJUNTOR_ABERTO_SEGUNDOS)
+)
+
+# =====================
+# TEMPLATES DE EMAIL PRÉ-COMPILADOS
+# =====================
+
+# Aplica o CSS do <style> direto nos elementos (style="...") ao compilar
+# os templates; alguns clientes de email ignoram o bloco <style>
+EMAIL_CSS_INLINE = os.getenv('EMAIL_CSS_INLINE', '0') == '1'
+
+HTML_EMAIL = '''
 <!DOCTYPE html>
 <html>
 <head>
@@ -282,111 +1909,111 @@ def enviar_email_gmail(cliente_email, cliente_nome, servico_nome, data_agendamen
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Agendamento+ - Atualização</title>
     <style>
-        body {{
+        body {
             font-family: 'Segoe UI', Arial, sans-serif;
             line-height: 1.6;
             color: #333;
             margin: 0;
             padding: 20px;
             background: linear-gradient(135deg, #f5f7fa 0%, #e4e8f0 100%);
-        }}
+        }
         
-        .container {{
+        .container {
             max-width: 600px;
             margin: 0 auto;
             background: white;
             border-radius: 12px;
             overflow: hidden;
             box-shadow: 0 10px 30px rgba(0, 0, 0, 0.1);
-        }}
+        }
         
-        .header {{
+        .header {
             background: linear-gradient(135deg, #007bff 0%, #0056b3 100%);
             color: white;
             padding: 30px;
             text-align: center;
-        }}
+        }
         
-        .logo {{
+        .logo {
             font-size: 28px;
             font-weight: 700;
             margin: 0;
-        }}
+        }
         
-        .logo span {{
+        .logo span {
             color: #ffd700;
-        }}
+        }
         
-        .tagline {{
+        .tagline {
             font-size: 14px;
             opacity: 0.9;
             margin-top: 5px;
-        }}
+        }
         
-        .content {{
+        .content {
             padding: 30px;
-        }}
+        }
         
-        .status-badge {{
-            background: {cor_status};
-            color: {cor_texto};
+        .status-badge {
+            background: {{cor_status}};
+            color: {{cor_texto}};
             padding: 8px 20px;
             border-radius: 25px;
             font-weight: 600;
             display: inline-block;
             font-size: 14px;
             margin-bottom: 20px;
-        }}
+        }
         
-        .info-card {{
+        .info-card {
             background: #f8f9fa;
             border-radius: 10px;
             padding: 20px;
             margin: 20px 0;
             border-left: 5px solid #007bff;
-        }}
+        }
         
-        .info-item {{
+        .info-item {
             display: flex;
             margin: 10px 0;
             padding: 5px 0;
             border-bottom: 1px solid rgba(0,0,0,0.05);
-        }}
+        }
         
-        .info-label {{
+        .info-label {
             font-weight: 600;
             min-width: 120px;
             color: #343a40;
-        }}
+        }
         
-        .info-value {{
+        .info-value {
             color: #555;
-        }}
+        }
         
-        .message-box {{
+        .message-box {
             background: rgba(0, 123, 255, 0.05);
             padding: 20px;
             border-radius: 10px;
             margin: 20px 0;
             border: 2px solid #007bff;
-        }}
+        }
         
-        .contact-section {{
+        .contact-section {
             text-align: center;
             margin: 30px 0;
             padding: 20px;
             background: linear-gradient(135deg, #f8f9fa 0%, #e9ecef 100%);
             border-radius: 10px;
-        }}
+        }
         
-        .contact-buttons {{
+        .contact-buttons {
             display: flex;
             justify-content: center;
             gap: 15px;
             margin-top: 20px;
-        }}
+        }
         
-        .contact-btn {{
+        .contact-btn {
             display: inline-flex;
             align-items: center;
             gap: 8px;
@@ -397,42 +2024,42 @@ def enviar_email_gmail(cliente_email, cliente_nome, servico_nome, data_agendamen
             color: #343a40;
             font-weight: 600;
             box-shadow: 0 4px 15px rgba(0,0,0,0.1);
-        }}
+        }
         
-        .contact-btn.instagram {{
+        .contact-btn.instagram {
             border: 2px solid #E4405F;
             color: #E4405F;
-        }}
+        }
         
-        .contact-btn.whatsapp {{
+        .contact-btn.whatsapp {
             border: 2px solid #25D366;
             color: #25D366;
-        }}
+        }
         
-        .footer {{
+        .footer {
             text-align: center;
             padding: 20px;
             color: #666;
             font-size: 12px;
             border-top: 1px solid #eee;
             background: #f8f9fa;
-        }}
+        }
         
-        @media (max-width: 600px) {{
-            .container {{
+        @media (max-width: 600px) {
+            .container {
                 margin: 10px;
-            }}
+            }
             
-            .contact-buttons {{
+            .contact-buttons {
                 flex-direction: column;
                 align-items: center;
-            }}
+            }
             
-            .contact-btn {{
+            .contact-btn {
                 width: 100%;
                 max-width: 250px;
-            }}
-        }}
+            }
+        }
     </style>
 </head>
 <body>
@@ -444,33 +2071,33 @@ def enviar_email_gmail(cliente_email, cliente_nome, servico_nome, data_agendamen
         
         <div class="content">
             <div class="status-badge">
-                {status.upper()}
+                {{status_rotulo}}
             </div>
             
-            <h2 style="color: #343a40; margin-top: 0;">Olá, {cliente_nome}!</h2>
-            <p style="color: #666;">Seu agendamento foi atualizado:</p>
+            <h2 style="color: #343a40; margin-top: 0;">Olá, {{cliente_nome}}!</h2>
+            <p style="color: #666;">{{subtitulo}}</p>
             
             <div class="message-box">
-                <h3 style="margin-top: 0; color: #007bff;">{mensagem_titulo}</h3>
-                {mensagem_corpo}
+                <h3 style="margin-top: 0; color: #007bff;">{{mensagem_titulo}}</h3>
+                {{mensagem_corpo}}
             </div>
             
             <div class="info-card">
                 <div class="info-item">
                     <span class="info-label">Serviço:</span>
-                    <span class="info-value">{servico_nome}</span>
+                    <span class="info-value">{{servico_nome}}</span>
                 </div>
                 <div class="info-item">
                     <span class="info-label">Data:</span>
-                    <span class="info-value">{data_formatada}</span>
+                    <span class="info-value">{{data}}</span>
                 </div>
                 <div class="info-item">
                     <span class="info-label">Hora:</span>
-                    <span class="info-value">{hora_agendamento}</span>
+                    <span class="info-value">{{hora}}</span>
                 </div>
                 <div class="info-item">
                     <span class="info-label">Status:</span>
-                    <span class="info-value" style="color: {cor_status}; font-weight: 600;">{status.upper()}</span>
+                    <span class="info-value" style="color: {{cor_status}}; font-weight: 600;">{{status_rotulo}}</span>
                 </div>
             </div>
             
@@ -499,152 +2126,359 @@ def enviar_email_gmail(cliente_email, cliente_nome, servico_nome, data_agendamen
     </div>
 </body>
 </html>
-        """
-        
-        # Versão texto simples
-        if status == 'pendente':
-            mensagem_texto = f"""Olá {cliente_nome},
+'''
 
-Seu agendamento está PENDENTE de confirmação.
+TEXTO_EMAIL = '''Olá {{cliente_nome}},
+
+{{abertura}}
 
 Detalhes:
-Serviço: {servico_nome}
-Data: {data_formatada}
-Hora: {hora_agendamento}
+Serviço: {{servico_nome}}
+Data: {{data}}
+Hora: {{hora}}{{detalhe_extra}}
 
-URGENTE: Entre em contato conosco para confirmar seu horário.
+{{fechamento}}Instagram: @agendamentomais
+WhatsApp: (61) 98582-5956'''
 
-Instagram: @agendamentomais
-WhatsApp: (61) 98582-5956"""
-        
-        elif status == 'confirmado':
-            mensagem_texto = f"""Olá {cliente_nome},
+# Partes de cada status (e do lembrete do dia anterior); o status None é o
+# modelo genérico usado para qualquer outro valor (o próprio status entra
+# como campo na renderização)
+STATUS_EMAIL = {
+    'pendente': {
+        'assunto': 'Confirmação de Agendamento',
+        'mensagem_titulo': 'Aguardando Confirmação',
+        'mensagem_corpo': '''
+            <p>Seu agendamento está <strong>PENDENTE</strong>. Entre em contato conosco para confirmar.</p>
+            <p><strong>Urgente:</strong> Precisamos da sua confirmação para garantir seu horário.</p>
+            ''',
+        'cor_status': '#ffc107',
+        'cor_texto': '#212529',
+        'abertura': 'Seu agendamento está PENDENTE de confirmação.',
+        'fechamento': 'URGENTE: Entre em contato conosco para confirmar seu horário.'
+    },
+    'confirmado': {
+        'assunto': 'Atualização do Agendamento',
+        'mensagem_titulo': 'Agendamento Confirmado!',
+        'mensagem_corpo': '''
+            <p>Seu agendamento foi <strong>CONFIRMADO</strong>. Estamos esperando por você!</p>
+            <p><strong>Importante:</strong> Chegue com 10 minutos de antecedência.</p>
+            ''',
+        'cor_status': '#17a2b8',
+        'cor_texto': 'white',
+        'abertura': 'Seu agendamento foi CONFIRMADO!',
+        'fechamento': 'Importante: Chegue com 10 minutos de antecedência.\n\nEstamos esperando por você!'
+    },
+    'realizado': {
+        'assunto': 'Atualização do Agendamento',
+        'mensagem_titulo': 'Agendamento Realizado',
+        'mensagem_corpo': '''
+            <p>Seu agendamento foi <strong>REALIZADO</strong> com sucesso!</p>
+            <p><strong>Obrigado por confiar em nós!</strong> Esperamos ter atendido suas expectativas.</p>
+            ''',
+        'cor_status': '#28a745',
+        'cor_texto': 'white',
+        'abertura': 'Seu agendamento foi marcado como REALIZADO!',
+        'fechamento': 'Obrigado por confiar em nós!'
+    },
+    'cancelado': {
+        'assunto': 'Atualização do Agendamento',
+        'mensagem_titulo': 'Agendamento Cancelado',
+        'mensagem_corpo': '''
+            <p>Seu agendamento foi <strong>CANCELADO</strong>.</p>
+            <p>Entre em contato conosco para mais informações ou para reagendar.</p>
+            ''',
+        'cor_status': '#dc3545',
+        'cor_texto': 'white',
+        'abertura': 'Seu agendamento foi CANCELADO.',
+        'fechamento': 'Entre em contato conosco para mais informações.'
+    },
+    'lembrete': {
+        'assunto': 'Lembrete de Agendamento',
+        'subtitulo': 'Seu horário é amanhã:',
+        'mensagem_titulo': 'Lembrete do seu Agendamento',
+        'mensagem_corpo': '''
+            <p>Passando para lembrar que seu agendamento é <strong>AMANHÃ</strong>.</p>
+            <p><strong>Importante:</strong> Chegue com 10 minutos de antecedência. Se não puder vir, fale conosco para reagendar.</p>
+            ''',
+        'cor_status': '#007bff',
+        'cor_texto': 'white',
+        'abertura': 'Lembrete: seu agendamento é AMANHÃ.',
+        'fechamento': 'Importante: Chegue com 10 minutos de antecedência. Se não puder vir, fale conosco para reagendar.'
+    },
+    None: {
+        'assunto': 'Atualização do Agendamento',
+        'mensagem_titulo': 'Atualização do Agendamento',
+        'mensagem_corpo': '<p>Seu agendamento foi atualizado para: <strong>{{status_rotulo}}</strong></p>',
+        'cor_status': '#6c757d',
+        'cor_texto': 'white',
+        'abertura': 'Seu agendamento foi atualizado.',
+        'detalhe_extra': '\nStatus: {{status_rotulo}}',
+        'fechamento': ''
+    }
+}
 
-Seu agendamento foi CONFIRMADO!
+# Nenhuma linha em base64 contém "=_", então o separador pode ser fixo
+SEPARADOR_MIME = '=_agendamento_mais'
 
-Detalhes:
-Serviço: {servico_nome}
-Data: {data_formatada}
-Hora: {hora_agendamento}
+MIME_EMAIL = (
+    'Subject: {{assunto}}\r\n'
+    'From: Agendamento+ <{{remetente}}>\r\n'
+    'To: {{destinatario}}\r\n'
+    'Date: {{data_envio}}\r\n'
+    'MIME-Version: 1.0\r\n'
+    f'Content-Type: multipart/alternative; boundary="{SEPARADOR_MIME}"\r\n'
+    '\r\n'
+    f'--{SEPARADOR_MIME}\r\n'
+    'Content-Type: text/plain; charset="utf-8"\r\n'
+    'Content-Transfer-Encoding: base64\r\n'
+    '\r\n'
+    '{{texto}}'
+    f'--{SEPARADOR_MIME}\r\n'
+    'Content-Type: text/html; charset="utf-8"\r\n'
+    'Content-Transfer-Encoding: base64\r\n'
+    '\r\n'
+    '{{html}}'
+    f'--{SEPARADOR_MIME}--\r\n'
+)
 
-Importante: Chegue com 10 minutos de antecedência.
+MensagemEmail = namedtuple('MensagemEmail', ['remetente', 'destinatario', 'dados'])
 
-Estamos esperando por você!
+class TemplateEmail:
+    """
+    Template com campos {{nome}}, quebrado uma única vez em partes fixas e
+    nomes de campos. Renderizar é só um ''.join, sem reprocessar o texto.
+    """
 
-Instagram: @agendamentomais
-WhatsApp: (61) 98582-5956"""
-        
-        elif status == 'realizado':
-            mensagem_texto = f"""Olá {cliente_nome},
+    PADRAO_CAMPO = re.compile(r'\{\{(\w+)\}\}')
 
-Seu agendamento foi marcado como REALIZADO!
+    def __init__(self, texto):
+        self.partes = self.PADRAO_CAMPO.split(texto)
+        self.campos = self.partes[1::2]
 
-Detalhes:
-Serviço: {servico_nome}
-Data: {data_formatada}
-Hora: {hora_agendamento}
+    def renderizar(self, valores):
+        partes = self.partes[:]
+        partes[1::2] = [valores[campo] for campo in self.campos]
+        return ''.join(partes)
 
-Obrigado por confiar em nós!
+def preencher_campos(texto, valores):
+    """Substitui só os campos conhecidos, deixando os demais para depois"""
+    return TemplateEmail.PADRAO_CAMPO.sub(
+        lambda m: valores.get(m.group(1), m.group(0)), texto
+    )
 
-Instagram: @agendamentomais
-WhatsApp: (61) 98582-5956"""
-        
-        elif status == 'cancelado':
-            mensagem_texto = f"""Olá {cliente_nome},
+PADRAO_REGRA_CSS = re.compile(r'([^{}@]+)\{([^{}]*)\}')
+PADRAO_SELETOR_SIMPLES = re.compile(r'^([a-z]+)?((?:\.[\w-]+)*)$')
+PADRAO_TAG_HTML = re.compile(r'<([a-z][a-z0-9]*)((?:\s[^<>]*)?)>')
+PADRAO_ATRIBUTO_CLASS = re.compile(r'\sclass="([^"]*)"')
+PADRAO_ATRIBUTO_STYLE = re.compile(r'\sstyle="([^"]*)"')
 
-Seu agendamento foi CANCELADO.
+def aplicar_css_inline(documento):
+    """
+    Copia as regras simples do <style> (tag, .classe e .classe.outra) para o
+    atributo style de cada elemento. Seletores compostos e @media continuam
+    no <style>. Roda só na compilação dos templates.
+    """
+    inicio = documento.find('<style>')
+    fim = documento.find('</style>', inicio)
+    if inicio < 0 or fim < 0:
+        return documento
+    css = documento[inicio + len('<style>'):fim]
 
-Detalhes:
-Serviço: {servico_nome}
-Data: {data_formatada}
-Hora: {hora_agendamento}
+    # Separa os blocos @media (com chaves aninhadas), que ficam no <style>
+    restante, blocos_media, pos = [], [], 0
+    while True:
+        arroba = css.find('@', pos)
+        if arroba < 0:
+            restante.append(css[pos:])
+            break
+        restante.append(css[pos:arroba])
+        nivel, i = 0, css.index('{', arroba)
+        while True:
+            if css[i] == '{':
+                nivel += 1
+            elif css[i] == '}':
+                nivel -= 1
+                if nivel == 0:
+                    break
+            i += 1
+        blocos_media.append(css[arroba:i + 1])
+        pos = i + 1
 
-Entre em contato conosco para mais informações.
+    regras, nao_aplicadas = [], []
+    for seletores, declaracoes in PADRAO_REGRA_CSS.findall(''.join(restante)):
+        declaracoes = '; '.join(
+            ' '.join(d.split()) for d in declaracoes.split(';') if d.strip()
+        )
+        for seletor in seletores.split(','):
+            seletor = seletor.strip()
+            simples = PADRAO_SELETOR_SIMPLES.match(seletor)
+            if simples and seletor:
+                classes = set(simples.group(2).split('.')[1:])
+                regras.append((len(classes), len(regras), simples.group(1), classes, declaracoes))
+            else:
+                nao_aplicadas.append(f'{seletor} {{ {declaracoes}; }}')
+    # Ordem da cascata: especificidade e depois a ordem no CSS
+    regras.sort(key=lambda regra: regra[:2])
 
-Instagram: @agendamentomais
-WhatsApp: (61) 98582-5956"""
-        else:
-            mensagem_texto = f"""Olá {cliente_nome},
+    def aplicar(m):
+        tag, atributos = m.group(1), m.group(2)
+        classe = PADRAO_ATRIBUTO_CLASS.search(atributos)
+        classes = set(classe.group(1).split()) if classe else set()
+        estilos = [
+            declaracoes for _, _, tag_regra, classes_regra, declaracoes in regras
+            if (tag_regra is None or tag_regra == tag) and classes_regra <= classes
+        ]
+        if not estilos:
+            return m.group(0)
+        existente = PADRAO_ATRIBUTO_STYLE.search(atributos)
+        if existente:
+            # O style escrito no elemento continua valendo por último
+            estilos.append(existente.group(1).rstrip('; '))
+            atributos = PADRAO_ATRIBUTO_STYLE.sub('', atributos)
+        return f'<{tag}{atributos} style="{"; ".join(estilos)};">'
 
-Seu agendamento foi atualizado.
+    cabecalho, corpo = documento[:inicio], documento[fim + len('</style>'):]
+    estilo = '\n'.join(nao_aplicadas + blocos_media)
+    estilo = f'<style>\n{estilo}\n    </style>' if estilo else ''
+    return cabecalho + estilo + PADRAO_TAG_HTML.sub(aplicar, corpo)
 
-Detalhes:
-Serviço: {servico_nome}
-Data: {data_formatada}
-Hora: {hora_agendamento}
-Status: {status.upper()}
+def compilar_templates_email(css_inline=EMAIL_CSS_INLINE):
+    """
+    Gera, uma vez só, o HTML e o texto de cada status com as partes fixas já
+    preenchidas (e o CSS já aplicado, se configurado). No envio só entram os
+    campos do agendamento.
+    """
+    templates = {}
+    for status, partes in STATUS_EMAIL.items():
+        valores = {
+            'subtitulo': 'Seu agendamento foi atualizado:',
+            'detalhe_extra': '',
+            'status_rotulo': status.upper() if status else '{{status_rotulo}}'
+        }
+        valores.update(partes)
+        if valores['fechamento']:
+            valores['fechamento'] += '\n\n'
+        html_status = preencher_campos(preencher_campos(HTML_EMAIL, valores), valores)
+        if css_inline:
+            html_status = aplicar_css_inline(html_status)
+        templates[status] = {
+            'assunto': partes['assunto'],
+            'html': TemplateEmail(html_status),
+            'texto': TemplateEmail(preencher_campos(preencher_campos(TEXTO_EMAIL, valores), valores))
+        }
+    return templates
+
+TEMPLATES_EMAIL = compilar_templates_email()
+TEMPLATE_MIME = TemplateEmail(MIME_EMAIL)
+
+def formatar_data_br(data_agendamento):
+    """'2025-06-15' -> '15/06/2025'; qualquer outro valor volta como veio"""
+    try:
+        data_obj = date.fromisoformat(data_agendamento)
+    except (TypeError, ValueError):
+        return data_agendamento
+    return f'{data_obj.day:02d}/{data_obj.month:02d}/{data_obj.year:04d}'
 
-Instagram: @agendamentomais
-WhatsApp: (61) 98582-5956"""
+def codificar_cabecalho(valor):
+    """Codifica um cabeçalho com acentos em encoded-words (RFC 2047)"""
+    # Quebras de linha num cabeçalho permitiriam injetar outros cabeçalhos
+    valor = ' '.join(valor.split())
+    if valor.isascii():
+        return valor
+    # Cada encoded-word cabe em 75 caracteres: no máximo 45 bytes de UTF-8,
+    # ou seja 15 caracteres de até 3 bytes (11 se houver emoji)
+    passo = 15 if max(valor) < '\U00010000' else 11
+    return '\r\n '.join(
+        f"=?utf-8?b?{base64.b64encode(valor[i:i + passo].encode('utf-8')).decode('ascii')}?="
+        for i in range(0, len(valor), passo)
+    )
+
+PADRAO_LINHA_BASE64 = re.compile(r'.{1,76}')
+
+def codificar_corpo(texto):
+    """Base64 em linhas de 76 caracteres terminadas em CRLF"""
+    codificado = base64.b64encode(texto.encode('utf-8')).decode('ascii')
+    return '\r\n'.join(PADRAO_LINHA_BASE64.findall(codificado)) + '\r\n'
+
+def renderizar_email(cliente_nome, servico_nome, data_agendamento, hora_agendamento, status):
+    """Retorna (assunto, texto, html) usando o template já compilado do status"""
+    template = TEMPLATES_EMAIL.get(status) or TEMPLATES_EMAIL[None]
+    status_rotulo = str(status).upper()
+    data_formatada = formatar_data_br(data_agendamento)
+    texto = template['texto'].renderizar({
+        'cliente_nome': cliente_nome,
+        'servico_nome': servico_nome,
+        'data': data_formatada,
+        'hora': hora_agendamento,
+        'status_rotulo': status_rotulo
+    })
+    html_email = template['html'].renderizar({
+        'cliente_nome': html.escape(str(cliente_nome)),
+        'servico_nome': html.escape(str(servico_nome)),
+        'data': html.escape(str(data_formatada)),
+        'hora': html.escape(str(hora_agendamento)),
+        'status_rotulo': html.escape(status_rotulo)
+    })
+    return f"{template['assunto']} - {servico_nome}", texto, html_email
+
+def email_valido(endereco):
+    """Validação simples, que também barra quebras de linha no cabeçalho To"""
+    return ("@" in endereco and "." in endereco
+            and endereco.isascii() and len(endereco.split()) == 1)
+
+def montar_email(cliente_email, cliente_nome, servico_nome, data_agendamento, hora_agendamento, status):
+    """Monta a mensagem MIME (texto + HTML) pronta para o SMTP"""
+    assunto, texto, html_email = renderizar_email(
+        cliente_nome, servico_nome, data_agendamento, hora_agendamento, status
+    )
+    dados = TEMPLATE_MIME.renderizar({
+        'assunto': codificar_cabecalho(assunto),
+        'remetente': EMAIL_REMETENTE,
+        'destinatario': cliente_email,
+        'data_envio': formatdate(localtime=True),
+        'texto': codificar_corpo(texto),
+        'html': codificar_corpo(html_email)
+    })
+    return MensagemEmail(EMAIL_REMETENTE, cliente_email, dados.encode('ascii'))
+
+# =====================
+# FUNÇÃO DE ENVIO DE EMAIL COM CREDENCIAIS CORRETAS
+# =====================
+
+def enviar_email_gmail(cliente_email, cliente_nome, servico_nome, data_agendamento, hora_agendamento, status):
+    """
+    Envia email de notificação de agendamento usando Gmail.
+
+    Retorna (True, mensagem) se enviou, (False, erro) se falhou e
+    (None, motivo) se o envio nem foi tentado porque o disjuntor do SMTP
+    está aberto.
+    """
+    try:
+        if not cliente_email:
+            print(f"⚠️ Cliente {cliente_nome} não tem email cadastrado")
+            return False, "Cliente sem email"
         
-        # Adicionar conteúdo
-        msg.set_content(mensagem_texto)
-        msg.add_alternative(html, subtype='html')
+        if not email_valido(cliente_email):
+            print(f"⚠️ Email inválido: {cliente_email}")
+            return False, "Email inválido"
         
-        # TENTATIVA 1: Usar SMTP com TLS (porta 587) - Método mais confiável
-        try:
-            print("🔄 Tentando conexão SMTP com TLS (porta 587)...")
-            server = smtplib.SMTP('smtp.gmail.com', 587)
-            server.ehlo()  # Identifica-se com o servidor
-            server.starttls()  # Habilita criptografia TLS
-            server.ehlo()  # Re-identifica-se após TLS
-            
-            print(f"📤 Conectando como: {SEU_EMAIL}")
-            server.login(SEU_EMAIL, SENHA_APP)
-            print("✅ Login bem-sucedido!")
-            
-            server.send_message(msg)
-            server.quit()
-            
-            print(f"✅ Email enviado com sucesso para {cliente_email}")
-            return True, "Email enviado com sucesso"
-            
-        except Exception as e1:
-            print(f"❌ Tentativa 1 (TLS) falhou: {str(e1)}")
-            
-            # TENTATIVA 2: Usar SMTP_SSL (porta 465)
-            try:
-                print("🔄 Tentando conexão SMTP_SSL (porta 465)...")
-                # Criar contexto SSL com certificados do sistema
-                context = ssl.create_default_context(cafile=certifi.where())
-                context.check_hostname = False
-                context.verify_mode = ssl.CERT_NONE
-                
-                with smtplib.SMTP_SSL('smtp.gmail.com', 465, context=context) as server:
-                    server.login(SEU_EMAIL, SENHA_APP)
-                    server.send_message(msg)
-                
-                print(f"✅ Email enviado com sucesso (SSL) para {cliente_email}")
-                return True, "Email enviado com sucesso via SSL"
-                
-            except Exception as e2:
-                print(f"❌ Tentativa 2 (SSL) falhou: {str(e2)}")
-                
-                # Resumo dos erros
-                mensagem_erro = f"""
-                ⚠️ FALHA NO ENVIO DE EMAIL ⚠️
-                
-                Erros encontrados:
-                1. TLS (587): {str(e1)}
-                2. SSL (465): {str(e2)}
-                
-                SOLUÇÕES:
-                1. Verifique se as credenciais estão corretas:
-                   - Email: {SEU_EMAIL}
-                
-                2. Verifique se a senha de app está correta
-                
-                3. Ative o acesso de apps menos seguros (apenas para testes):
-                   Acesse: https://myaccount.google.com/lesssecureapps
-                
-                Dados da mensagem:
-                - Para: {cliente_email}
-                - Cliente: {cliente_nome}
-                - Serviço: {servico_nome}
-                - Status: {status}
-                """
-                print(mensagem_erro)
-                return False, f"Erro no envio de email. Verifique suas credenciais do Gmail."
+        print(f"📧 Preparando email para: {cliente_email}")
+        print(f"📤 Status: {status}")
+        
+        # Só os campos do agendamento são preenchidos: o resto vem pronto
+        # dos templates compilados por status
+        msg = montar_email(cliente_email, cliente_nome, servico_nome,
+                           data_agendamento, hora_agendamento, status)
+        
+        # Envio numa sessão SMTP já autenticada (reaproveitada entre emails)
+        conexoes_smtp.enviar(msg)
+        
+        print(f"✅ Email enviado com sucesso para {cliente_email}")
+        return True, "Email enviado com sucesso"
+        
+    except SMTPIndisponivel as e:
+        print(f"⚡ {str(e)}")
+        return None, str(e)
         
     except smtplib.SMTPAuthenticationError as e:
         erro_msg = str(e)
@@ -665,47 +2499,634 @@ WhatsApp: (61) 98582-5956"""
         print(f"❌ Erro geral ao enviar email: {str(e)}")
         return False, f"Erro: {str(e)}"
 
+# =====================
+# FILA DE EMAILS (OUTBOX)
+# =====================
+
+def enfileirar_email(conn, usuario_id, agendamento_id, destinatario, cliente_nome,
+                     servico_nome, data_agendamento, hora_agendamento, status):
+    """
+    Grava o email na outbox usando a transação da rota (sem commit).
+
+    Assim o email só existe se o agendamento for gravado, e a requisição
+    não espera pelo SMTP. Retorna o id do email na fila.
+    """
+    cursor = conn.execute('''
+        INSERT INTO email_outbox (usuario_id, agendamento_id, destinatario, cliente_nome,
+                                  servico_nome, data_agendamento, hora_agendamento, status_agendamento)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (usuario_id, agendamento_id, destinatario, cliente_nome,
+          servico_nome, data_agendamento, hora_agendamento, status))
+    return cursor.lastrowid
+
+class FilaEmails:
+    """
+    Threads em segundo plano que enviam os emails da email_outbox.
+
+    Cada email é reservado com um UPDATE ... RETURNING atômico, que também
+    adia a próxima tentativa (um "aluguel"): se o processo morrer no meio do
+    envio, o email volta a ficar disponível depois desse prazo. Falhas são
+    repetidas com backoff exponencial até EMAIL_MAX_TENTATIVAS.
+    """
+
+    ALUGUEL_SEGUNDOS = 300
+
+    def __init__(self, workers=2, max_tentativas=5, backoff=30, intervalo=5):
+        self.workers = workers
+        self.max_tentativas = max_tentativas
+        self.backoff = backoff
+        self.intervalo = intervalo
+        self._acordar = threading.Event()
+        self._threads = []
+        self.enviados = 0
+        self.falhas = 0
+
+    def iniciar(self):
+        if self._threads or self.workers <= 0:
+            return
+        for numero in range(self.workers):
+            thread = threading.Thread(target=self._executar, name=f'fila-emails-{numero}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"📬 Fila de emails iniciada com {self.workers} worker(s)")
+
+    def acordar(self):
+        """Avisa os workers que há email novo (chamar após o commit)"""
+        self._acordar.set()
+
+    def _reservar(self, conn):
+        linhas = conn.execute('''
+            UPDATE email_outbox
+            SET estado = 'enviando',
+                tentativas = tentativas + 1,
+                proxima_tentativa = datetime('now', ?)
+            WHERE id = (
+                SELECT id FROM email_outbox
+                WHERE estado IN ('pendente', 'enviando')
+                AND proxima_tentativa <= datetime('now')
+                ORDER BY proxima_tentativa
+                LIMIT 1
+            )
+            RETURNING *
+        ''', (f'+{self.ALUGUEL_SEGUNDOS} seconds',)).fetchall()
+        return linhas[0] if linhas else None
+
+    def _registrar_resultado(self, conn, email, enviado, mensagem):
+        if enviado is None:
+            # Disjuntor abriu entre a consulta e o envio: nada foi tentado,
+            # então o email volta para a fila com a tentativa devolvida
+            conn.execute('''
+                UPDATE email_outbox
+                SET estado = 'pendente', tentativas = ?, proxima_tentativa = datetime('now')
+                WHERE id = ?
+            ''', (email['tentativas'] - 1, email['id']))
+        elif enviado:
+            conn.execute('''
+                UPDATE email_outbox
+                SET estado = 'enviado', enviado_em = CURRENT_TIMESTAMP, ultimo_erro = NULL
+                WHERE id = ?
+            ''', (email['id'],))
+            self.enviados += 1
+        elif email['tentativas'] >= self.max_tentativas:
+            conn.execute('''
+                UPDATE email_outbox SET estado = 'falhou', ultimo_erro = ? WHERE id = ?
+            ''', (mensagem, email['id']))
+            self.falhas += 1
+        else:
+            espera = self.backoff * 2 ** (email['tentativas'] - 1)
+            conn.execute('''
+                UPDATE email_outbox
+                SET estado = 'pendente', ultimo_erro = ?, proxima_tentativa = datetime('now', ?)
+                WHERE id = ?
+            ''', (mensagem, f'+{espera} seconds', email['id']))
+        conn.commit()
+
+    def processar_proximo(self, conn):
+        """Envia um email da fila; retorna False se não havia nada a enviar"""
+        if not conexoes_smtp.disjuntor.disponivel():
+            # SMTP fora do ar: os emails ficam na fila, sem gastar tentativas
+            return False
+        email = self._reservar(conn)
+        conn.commit()
+        if email is None:
+            return False
+
+        try:
+            enviado, mensagem = enviar_email_gmail(
+                email['destinatario'],
+                email['cliente_nome'],
+                email['servico_nome'],
+                email['data_agendamento'],
+                email['hora_agendamento'],
+                email['status_agendamento']
+            )
+        except Exception as e:
+            enviado, mensagem = False, str(e)
+
+        self._registrar_resultado(conn, email, enviado, mensagem)
+        # Adiado pelo disjuntor: para aqui em vez de reservar o próximo
+        return enviado is not None
+
+    def _executar(self):
+        while True:
+            try:
+                conn = pool_conexoes.obter()
+                try:
+                    while self.processar_proximo(conn):
+                        pass
+                finally:
+                    pool_conexoes.devolver(conn)
+            except Exception as e:
+                print(f"❌ Erro na fila de emails: {str(e)}")
+
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+
+    def estatisticas(self, conn):
+        contagens = {
+            linha['estado']: linha['total']
+            for linha in conn.execute('SELECT estado, COUNT(*) as total FROM email_outbox GROUP BY estado')
+        }
+        return {
+            'workers': len(self._threads),
+            'enviados': self.enviados,
+            'falhas': self.falhas,
+            'fila': contagens
+        }
+
+fila_emails = FilaEmails(EMAIL_WORKERS, EMAIL_MAX_TENTATIVAS, EMAIL_BACKOFF_SEGUNDOS, EMAIL_INTERVALO_SEGUNDOS)
+fila_emails.iniciar()
+
+def descrever_email(email_id):
+    """Mensagem e campos de resposta para um email recém-enfileirado"""
+    if email_id is None:
+        return "Cliente não tem email cadastrado", {'email_enviado': False, 'email_status': None}
+    return "Email na fila de envio.", {
+        'email_enviado': False,
+        'email_status': 'pendente',
+        'email_id': email_id
+    }
+
+# =====================
+# LEMBRETES DO DIA ANTERIOR
+# =====================
+
+class ErroLembretes(Exception):
+    """Interrompe a rodada (autenticação, disjuntor aberto) guardando o que já foi feito"""
+
+    def __init__(self, enviados, falhas):
+        super().__init__('Rodada de lembretes interrompida')
+        self.enviados = enviados
+        self.falhas = falhas
+
+class LembretesDiaAnterior:
+    """
+    Envia, uma única vez por agendamento, o lembrete do dia anterior.
+
+    Cada rodada percorre os agendamentos de amanhã de todos os usuários pelo
+    índice de data, em lotes buscados com uma só consulta (JOIN com clientes
+    e serviços), e envia o lote pelas sessões SMTP reaproveitadas. Antes do
+    envio o lote é reservado em lembretes_enviados, então rodadas repetidas
+    ou simultâneas (vários processos) não mandam o mesmo lembrete duas
+    vezes. Reservas de um processo que morreu expiram após ALUGUEL_SEGUNDOS.
+    """
+
+    ALUGUEL_SEGUNDOS = 300
+    STATUS_LEMBRETE = ('pendente', 'confirmado')
+
+    def __init__(self, intervalo=3600, lote=200, max_tentativas=5):
+        self.intervalo = intervalo
+        self.lote = lote
+        self.max_tentativas = max_tentativas
+        self._thread = None
+        self._lock = threading.Lock()
+        self.rodadas = 0
+        self.ultima_rodada = None
+
+    def iniciar(self):
+        if self._thread or self.intervalo <= 0:
+            return
+        self._thread = threading.Thread(target=self._executar, name='lembretes', daemon=True)
+        self._thread.start()
+        print(f"⏰ Lembretes do dia anterior a cada {self.intervalo:.0f}s")
+
+    def _executar(self):
+        # A primeira rodada espera um pouco para não disputar a inicialização
+        time.sleep(min(self.intervalo, 60))
+        while True:
+            try:
+                conn = pool_conexoes.obter()
+                try:
+                    self.executar_rodada(conn)
+                finally:
+                    pool_conexoes.devolver(conn)
+            except Exception as e:
+                print(f"❌ Erro nos lembretes: {str(e)}")
+            time.sleep(self.intervalo)
+
+    def _reservar_lote(self, conn, dia, ultimo_id):
+        """Seleciona e reserva o próximo lote numa única transação de escrita"""
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            lote = conn.execute('''
+                SELECT a.id, a.usuario_id, a.data_agendamento, a.hora_agendamento,
+                       c.nome as cliente_nome, c.email as cliente_email, s.nome as servico_nome
+                FROM agendamentos a
+                JOIN clientes c ON c.id = a.cliente_id
+                JOIN servicos s ON s.id = a.servico_id
+                LEFT JOIN lembretes_enviados l
+                    ON l.agendamento_id = a.id AND l.data_agendamento = a.data_agendamento
+                WHERE a.dia_agendamento = CAST(julianday(?) - 2440587.5 AS INTEGER) AND a.id > ?
+                AND a.status IN (?, ?)
+                AND c.email IS NOT NULL AND c.email != ''
+                AND (l.agendamento_id IS NULL OR (
+                    l.enviado_em IS NULL AND l.tentativas < ?
+                    AND (l.reservado_em IS NULL OR l.reservado_em <= datetime('now', ?))
+                ))
+                ORDER BY a.id
+                LIMIT ?
+            ''', (dia, ultimo_id, *self.STATUS_LEMBRETE, self.max_tentativas,
+                  f'-{self.ALUGUEL_SEGUNDOS} seconds', self.lote)).fetchall()
+            conn.executemany('''
+                INSERT INTO lembretes_enviados
+                    (agendamento_id, data_agendamento, usuario_id, destinatario, tentativas, reservado_em)
+                VALUES (?, ?, ?, ?, 1, CURRENT_TIMESTAMP)
+                ON CONFLICT (agendamento_id, data_agendamento) DO UPDATE SET
+                    tentativas = tentativas + 1,
+                    destinatario = excluded.destinatario,
+                    reservado_em = CURRENT_TIMESTAMP
+            ''', [
+                (linha['id'], linha['data_agendamento'], linha['usuario_id'], linha['cliente_email'])
+                for linha in lote
+            ])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return lote
+
+    def _enviar_lote(self, lote, conexoes):
+        """Envia o lote; retorna (ids enviados, [(erro, id)] das falhas)"""
+        enviados, falhas = [], []
+        for posicao, linha in enumerate(lote):
+            if not email_valido(linha['cliente_email']):
+                falhas.append(("Email inválido", linha['id']))
+                continue
+            try:
+                conexoes.enviar(montar_email(
+                    linha['cliente_email'], linha['cliente_nome'], linha['servico_nome'],
+                    linha['data_agendamento'], linha['hora_agendamento'], 'lembrete'
+                ))
+                enviados.append(linha['id'])
+            except (smtplib.SMTPAuthenticationError, SMTPIndisponivel) as e:
+                # Sem autenticação ou com o disjuntor aberto nada mais vai
+                # sair: devolve o resto do lote
+                falhas.extend((str(e), restante['id']) for restante in lote[posicao:])
+                raise ErroLembretes(enviados, falhas) from e
+            except Exception as e:
+                falhas.append((str(e), linha['id']))
+        return enviados, falhas
+
+    def _registrar_lote(self, conn, dia, enviados, falhas):
+        conn.executemany('''
+            UPDATE lembretes_enviados
+            SET enviado_em = CURRENT_TIMESTAMP, reservado_em = NULL, ultimo_erro = NULL
+            WHERE agendamento_id = ? AND data_agendamento = ?
+        ''', [(agendamento_id, dia) for agendamento_id in enviados])
+        conn.executemany('''
+            UPDATE lembretes_enviados
+            SET reservado_em = NULL, ultimo_erro = ?
+            WHERE agendamento_id = ? AND data_agendamento = ?
+        ''', [(erro, agendamento_id, dia) for erro, agendamento_id in falhas])
+        conn.commit()
+
+    def executar_rodada(self, conn, dia=None, conexoes=None):
+        """
+        Envia os lembretes pendentes de `dia` (padrão: amanhã) e retorna um
+        resumo da rodada. `conexoes` permite usar outro servidor SMTP.
+        """
+        dia = dia or (date.today() + timedelta(days=1)).isoformat()
+        conexoes = conexoes or conexoes_smtp
+        inicio = time.perf_counter()
+        resumo = {'dia': dia, 'lotes': 0, 'enviados': 0, 'falhas': 0, 'erro': None}
+
+        # Ocorrências de séries do dia viram agendamentos: o lembrete é por linha
+        resumo['ocorrencias_gravadas'] = materializar_ocorrencias_do_dia(conn, dia, self.STATUS_LEMBRETE)
+        
+        ultimo_id = 0
+        while conexoes.disjuntor.disponivel():
+            lote = self._reservar_lote(conn, dia, ultimo_id)
+            if not lote:
+                break
+            ultimo_id = lote[-1]['id']
+            try:
+                enviados, falhas = self._enviar_lote(lote, conexoes)
+            except ErroLembretes as e:
+                self._registrar_lote(conn, dia, e.enviados, e.falhas)
+                resumo['enviados'] += len(e.enviados)
+                resumo['falhas'] += len(e.falhas)
+                resumo['erro'] = str(e.__cause__)
+                break
+            self._registrar_lote(conn, dia, enviados, falhas)
+            resumo['lotes'] += 1
+            resumo['enviados'] += len(enviados)
+            resumo['falhas'] += len(falhas)
+
+        if resumo['erro'] is None and not conexoes.disjuntor.disponivel():
+            resumo['erro'] = 'SMTP indisponível (disjuntor aberto)'
+
+        # Registros antigos não servem mais para evitar reenvios
+        conn.execute("DELETE FROM lembretes_enviados WHERE data_agendamento < date('now', '-30 days')")
+        conn.commit()
+
+        resumo['duracao_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+        with self._lock:
+            self.rodadas += 1
+            self.ultima_rodada = resumo
+        if resumo['enviados'] or resumo['falhas']:
+            print(f"⏰ Lembretes de {dia}: {resumo['enviados']} enviado(s), {resumo['falhas']} falha(s)")
+        return resumo
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'ativo': self._thread is not None,
+                'intervalo_segundos': self.intervalo,
+                'rodadas': self.rodadas,
+                'ultima_rodada': self.ultima_rodada
+            }
+
+lembretes = LembretesDiaAnterior(LEMBRETES_INTERVALO_SEGUNDOS, LEMBRETES_LOTE, EMAIL_MAX_TENTATIVAS)
+lembretes.iniciar()
+
+@app.cli.command('lembretes')
+@click.option('--dia', default=None, help='Data dos agendamentos (AAAA-MM-DD). Padrão: amanhã.')
+def comando_lembretes(dia):
+    """Executa uma rodada de lembretes do dia anterior agora"""
+    conn = pool_conexoes.obter()
+    try:
+        resumo = lembretes.executar_rodada(conn, dia)
+    finally:
+        pool_conexoes.devolver(conn)
+    print(json.dumps(resumo, ensure_ascii=False))
+
+# =====================
+# ETAG / VALIDAÇÃO CONDICIONAL
+# =====================
+
+def versao_dados(conn, usuario_id, tabelas, variante=''):
+    """
+    Calcula o ETag e a data da última alteração dos dados do usuário.
+
+    Usa apenas a tabela versoes_tabela (uma busca pela chave primária por
+    tabela), então é barato mesmo quando a resposta completa é grande. A
+    query string entra no ETag porque filtros geram respostas diferentes;
+    `variante` cobre o que muda a resposta sem estar no banco (a data de hoje).
+    """
+    marcadores = ', '.join('?' for _ in tabelas)
+    versoes = conn.execute(f'''
+        SELECT tabela, versao, atualizado_em
+        FROM versoes_tabela
+        WHERE usuario_id = ? AND tabela IN ({marcadores})
+    ''', (usuario_id, *tabelas)).fetchall()
+    
+    por_tabela = {linha['tabela']: linha['versao'] for linha in versoes}
+    base = f"{usuario_id}|" + '|'.join(f"{t}={por_tabela.get(t, 0)}" for t in tabelas)
+    base += '|' + request.query_string.decode('utf-8', 'replace') + '|' + variante
+    etag = hashlib.sha1(base.encode()).hexdigest()
+    
+    ultima_alteracao = None
+    if versoes:
+        ultima_alteracao = datetime.strptime(
+            max(linha['atualizado_em'] for linha in versoes), '%Y-%m-%d %H:%M:%S'
+        ).replace(tzinfo=timezone.utc)
+    
+    return etag, ultima_alteracao
+
+def com_validadores(resposta, etag, ultima_alteracao):
+    """
+    Adiciona ETag, Last-Modified e Cache-Control (sempre revalidar).
+
+    O ETag é sempre fraco: a mesma versão dos dados sai comprimida ou não
+    conforme o Accept-Encoding, e o 304 precisa devolver o mesmo validador
+    que o 200 de qualquer uma dessas representações.
+    """
+    resposta.set_etag(etag, weak=True)
+    if ultima_alteracao:
+        resposta.last_modified = ultima_alteracao
+    resposta.headers['Cache-Control'] = 'private, no-cache'
+    return resposta
+
+def resposta_nao_modificada(etag, ultima_alteracao):
+    """
+    Retorna uma resposta 304 se o cliente já tem a versão atual, ou None.
+
+    If-None-Match tem prioridade; If-Modified-Since só é usado sem ele.
+    """
+    if request.if_none_match:
+        nao_modificado = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and ultima_alteracao:
+        nao_modificado = ultima_alteracao <= request.if_modified_since
+    else:
+        nao_modificado = False
+    
+    if not nao_modificado:
+        return None
+    return com_validadores(app.response_class(status=304), etag, ultima_alteracao)
+
+# =====================
+# COMPRESSÃO DAS RESPOSTAS (GZIP / BROTLI)
+# =====================
+
+# Respostas de dados; páginas e CSS/JS já saem comprimidos de ArquivosEstaticos
+TIPOS_COMPRIMIVEIS = {'application/json', 'application/x-ndjson', 'text/csv', 'text/plain'}
+
+def escolher_codificacao():
+    """br ou gzip conforme o Accept-Encoding (br no empate), ou None"""
+    aceitas = request.accept_encodings
+    opcoes = [c for c in ('br', 'gzip') if aceitas[c] and (c != 'br' or brotli is not None)]
+    if not opcoes:
+        return None
+    return max(opcoes, key=lambda c: aceitas[c])
+
+def novo_compressor(codificacao):
+    """Compressor incremental com a interface (comprimir, descarregar, finalizar)"""
+    if codificacao == 'br':
+        compressor = brotli.Compressor(quality=COMPRESSAO_QUALIDADE_BROTLI)
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(COMPRESSAO_NIVEL, zlib.DEFLATED, 31)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+def comprimir_pedacos(pedacos, codificacao):
+    """
+    Comprime uma resposta em streaming pedaço por pedaço.
+
+    Cada pedaço é descarregado (sync flush) assim que chega, então o cliente
+    recebe os dados no mesmo ritmo de antes e nada é acumulado na memória.
+    """
+    comprimir, descarregar, finalizar = novo_compressor(codificacao)
+    try:
+        for pedaco in pedacos:
+            if isinstance(pedaco, str):
+                pedaco = pedaco.encode('utf-8')
+            if pedaco:
+                yield comprimir(pedaco) + descarregar()
+        yield finalizar()
+    finally:
+        if hasattr(pedacos, 'close'):
+            pedacos.close()
+
+@app.after_request
+def comprimir_resposta(resposta):
+    """
+    Comprime as respostas JSON/NDJSON/CSV quando o cliente aceita.
+
+    Corpos menores que COMPRESSAO_MIN_BYTES saem como estão (o cabeçalho
+    gzip custaria mais do que economiza). Respostas em streaming, como as
+    exportações, são comprimidas pedaço por pedaço.
+    """
+    if (not COMPRESSAO_NIVEL or resposta.mimetype not in TIPOS_COMPRIMIVEIS
+            or resposta.status_code < 200 or resposta.status_code in (204, 304)
+            or resposta.direct_passthrough or 'Content-Encoding' in resposta.headers):
+        return resposta
+    
+    # A resposta depende do Accept-Encoding mesmo quando sai sem comprimir
+    resposta.vary.add('Accept-Encoding')
+    codificacao = escolher_codificacao()
+    if codificacao is None:
+        return resposta
+    
+    if resposta.is_streamed:
+        resposta.response = comprimir_pedacos(resposta.response, codificacao)
+        resposta.headers.pop('Content-Length', None)
+    else:
+        dados = resposta.get_data()
+        if len(dados) < COMPRESSAO_MIN_BYTES:
+            return resposta
+        comprimir, _, finalizar = novo_compressor(codificacao)
+        resposta.set_data(comprimir(dados) + finalizar())
+    
+    resposta.headers['Content-Encoding'] = codificacao
+    # Outra representação do mesmo conteúdo: o ETag passa a ser fraco
+    # (com_validadores já os emite fracos, inclusive no 304)
+    etag, fraco = resposta.get_etag()
+    if etag and not fraco:
+        resposta.set_etag(etag, weak=True)
+    return resposta
+
+# =====================
+# PAGINAÇÃO (KEYSET / CURSOR)
+# =====================
+
+PAGINACAO_LIMITE_PADRAO = 50
+PAGINACAO_LIMITE_MAXIMO = 500
+
+def codificar_cursor(valores):
+    """Transforma a chave de ordenação da última linha em um cursor opaco"""
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode().rstrip('=')
+
+def decodificar_cursor(cursor, tamanho):
+    """Lê um cursor gerado por codificar_cursor(); lança ValueError se inválido"""
+    try:
+        preenchimento = '=' * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + preenchimento))
+    except Exception:
+        raise ValueError('Cursor inválido')
+    
+    if not isinstance(valores, list) or len(valores) != tamanho:
+        raise ValueError('Cursor inválido')
+    return valores
+
+def parametros_paginacao(tamanho_chave):
+    """
+    Lê ?limit= e ?cursor= da requisição.
+
+    Retorna (limite, chave); limite é None quando a paginação não foi
+    pedida (mantém a resposta completa para os clientes antigos).
+    """
+    limite = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    
+    if limite is None and cursor is None:
+        return None, None
+    
+    try:
+        limite = int(limite) if limite is not None else PAGINACAO_LIMITE_PADRAO
+    except ValueError:
+        raise ValueError('limit deve ser um número inteiro')
+    if limite < 1:
+        raise ValueError('limit deve ser maior que zero')
+    
+    chave = decodificar_cursor(cursor, tamanho_chave) if cursor else None
+    return min(limite, PAGINACAO_LIMITE_MAXIMO), chave
+
+# Datas além disso não são agenda de verdade e estouram a aritmética de
+# datas (janelas das séries, véspera/dia seguinte) perto de 9999-12-31
+ANO_MAXIMO = 2999
+
+def validar_data_filtro(nome):
+    """Lê um filtro de data (AAAA-MM-DD, até ANO_MAXIMO) da query string"""
+    valor = request.args.get(nome)
+    if valor is None:
+        return None
+    try:
+        data = datetime.strptime(valor, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f'{nome} deve estar no formato AAAA-MM-DD')
+    if data.year > ANO_MAXIMO:
+        raise ValueError(f'{nome} deve ser até {ANO_MAXIMO}-12-31')
+    return valor
+
+def com_proxima_pagina(resposta, proximo_cursor):
+    """Informa o cursor da próxima página nos cabeçalhos (o corpo continua sendo a lista)"""
+    if proximo_cursor:
+        args = request.args.to_dict()
+        args['cursor'] = proximo_cursor
+        resposta.headers['X-Proximo-Cursor'] = proximo_cursor
+        resposta.headers['Link'] = f'<{url_for(request.endpoint, **args)}>; rel="next"'
+    return resposta
+
 # =====================
 # ROTAS PRINCIPAIS
 # =====================
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return estaticos.responder('index.html')
 
 @app.route('/cadastro')
 def cadastro_page():
-    return render_template('cadastro.html')
+    return estaticos.responder('cadastro.html')
 
 @app.route('/dashboard')
 def dashboard():
     if 'usuario_id' not in session:
         return redirect(url_for('index'))
-    return render_template('dashboard.html')
+    return estaticos.responder('dashboard.html')
 
 @app.route('/servicos')
 def servicos():
     if 'usuario_id' not in session:
         return redirect(url_for('index'))
-    return render_template('servicos.html')
+    return estaticos.responder('serviços.html')
 
 @app.route('/clientes')
 def clientes():
     if 'usuario_id' not in session:
         return redirect(url_for('index'))
-    return render_template('clientes.html')
+    return estaticos.responder('clientes.html')
 
 @app.route('/agendamentos')
 def agendamentos():
     if 'usuario_id' not in session:
         return redirect(url_for('index'))
-    return render_template('agendamentos.html')
+    return estaticos.responder('agendamento.html')
 
 @app.route('/perfil')
 def perfil():
     if 'usuario_id' not in session:
         return redirect(url_for('index'))
-    return render_template('perfil.html')
+    return estaticos.responder('perfil.html')
 
 # =====================
 # API - AUTENTICAÇÃO (COM DEBUG)
@@ -714,10 +3135,6 @@ def perfil():
 @app.route('/api/cadastro', methods=['POST'])
 def cadastro():
     try:
-        # Verificar se o banco existe antes de tentar usar
-        if not os.path.exists(DATABASE):
-            return jsonify({'success': False, 'message': 'Banco de dados não encontrado! Coloque o arquivo banco.db na pasta do sistema.'})
-        
         data = request.get_json()
         nome = data.get('nome')
         email = data.get('email')
@@ -734,7 +3151,6 @@ def cadastro():
         ).fetchone()
         
         if usuario_existente:
-            conn.close()
             print(f"⚠️ Tentativa de cadastro com email já existente: {email}")
             print(f"   ID: {usuario_existente['id']}, Nome: {usuario_existente['nome']}")
             return jsonify({'success': False, 'message': 'Email já cadastrado'})
@@ -745,7 +3161,6 @@ def cadastro():
             (nome, email, senha)
         )
         conn.commit()
-        conn.close()
         
         print(f"✅ Novo usuário cadastrado: {nome} ({email})")
         return jsonify({'success': True, 'message': 'Cadastro realizado com sucesso!'})
@@ -759,10 +3174,6 @@ def cadastro():
 @app.route('/api/login', methods=['POST'])
 def login():
     try:
-        # Verificar se o banco existe antes de tentar usar
-        if not os.path.exists(DATABASE):
-            return jsonify({'success': False, 'message': 'Banco de dados não encontrado! Coloque o arquivo banco.db na pasta do sistema.'})
-        
         data = request.get_json()
         email = data.get('email')
         senha = data.get('senha')
@@ -778,7 +3189,6 @@ def login():
         tabela_existe = cursor.fetchone()
         
         if not tabela_existe:
-            conn.close()
             print("❌ Tabela 'usuarios' não encontrada no banco!")
             return jsonify({'success': False, 'message': 'Estrutura do banco de dados incompleta'})
         
@@ -792,8 +3202,6 @@ def login():
             'SELECT id, nome, email, senha FROM usuarios WHERE email = ?', (email,)
         ).fetchone()
         
-        conn.close()
-        
         if usuario:
             print(f"✅ Usuário encontrado: {usuario['nome']} ({usuario['email']})")
             print(f"   Senha no banco: {usuario['senha']}")
@@ -816,7 +3224,6 @@ def login():
             # Listar todos os usuários para debug
             conn = get_db_connection()
             todos_usuarios = conn.execute('SELECT id, nome, email FROM usuarios').fetchall()
-            conn.close()
             
             if todos_usuarios:
                 print("📋 Usuários existentes no banco:")
@@ -873,13 +3280,21 @@ def verificar_banco():
             cursor.execute("SELECT id, nome, email FROM usuarios")
             usuarios = [dict(row) for row in cursor.fetchall()]
         
-        conn.close()
-        
         return jsonify({
             'existe': True,
             'tabelas': tabelas,
             'contagens': contagens,
             'usuarios': usuarios,
+            'pool': pool_conexoes.estatisticas(),
+            'cache': cache_respostas.estatisticas(),
+            'emails': fila_emails.estatisticas(conn),
+            'lembretes': lembretes.estatisticas(),
+            'smtp': conexoes_smtp.estatisticas(),
+            'imagens': miniaturas.estatisticas(),
+            'estaticos': estaticos.estatisticas(),
+            'eventos': canal_eventos.estatisticas(),
+            'armazenamento': ler_perfil_armazenamento(conn),
+            'versao_schema': versao_schema(conn),
             'sucesso': True
         })
         
@@ -890,30 +3305,64 @@ def verificar_banco():
             'sucesso': False
         })
 
+@app.route('/api/saude')
+def saude():
+    """
+    Verificação leve para monitoramento (sem login): banco, fila de emails
+    e estado do disjuntor do SMTP. Responde 503 só se o banco falhar.
+    """
+    try:
+        conn = get_db_connection()
+        na_fila = conn.execute(
+            "SELECT COUNT(*) FROM email_outbox WHERE estado IN ('pendente', 'enviando')"
+        ).fetchone()[0]
+    except Exception as e:
+        return jsonify({'status': 'erro', 'banco': False, 'mensagem': str(e)}), 503
+    
+    disjuntor = conexoes_smtp.disjuntor.estatisticas()
+    return jsonify({
+        'status': 'ok' if disjuntor['estado'] == 'fechado' else 'degradado',
+        'banco': True,
+        'emails_na_fila': na_fila,
+        'smtp': disjuntor
+    })
+
 # =====================
 # API - SERVIÇOS (CRUD COMPLETO)
 # =====================
 
+def validar_duracao_servico(valor):
+    """Duração em minutos (None = a duração do horário da agenda); levanta ValueError"""
+    if valor in (None, ''):
+        return None
+    try:
+        duracao = int(valor)
+    except (TypeError, ValueError):
+        raise ValueError('Duração deve ser um número inteiro de minutos')
+    if not 5 <= duracao <= AGENDAMENTO_DURACAO_MAXIMA_MINUTOS:
+        raise ValueError(f'Duração deve estar entre 5 e {AGENDAMENTO_DURACAO_MAXIMA_MINUTOS} minutos')
+    return duracao
+
 @app.route('/api/servicos', methods=['GET', 'POST'])
 def api_servicos():
     if 'usuario_id' not in session:
         return jsonify({'error': 'Não autorizado'}), 401
     
-    # Verificar se o banco existe
-    if not os.path.exists(DATABASE):
-        return jsonify({'error': 'Banco de dados não encontrado'}), 500
-    
     usuario_id = session['usuario_id']
     
     try:
         conn = get_db_connection()
         
         if request.method == 'GET':
+            etag, ultima_alteracao = versao_dados(conn, usuario_id, ('servicos',))
+            nao_modificada = resposta_nao_modificada(etag, ultima_alteracao)
+            if nao_modificada:
+                return nao_modificada
+            
             servicos = conn.execute(
                 'SELECT * FROM servicos WHERE usuario_id = ? ORDER BY nome', 
                 (usuario_id,)
             ).fetchall()
-            conn.close()
             
             servicos_list = []
             for servico in servicos:
@@ -921,10 +3370,13 @@ def api_servicos():
                     'id': servico['id'],
                     'nome': servico['nome'],
                     'descricao': servico['descricao'],
-                    'imagem': servico['imagem']
+                    'imagem': servico['imagem'],
+                    'duracao_minutos': servico['duracao_minutos'],
+                    # A listagem usa as miniaturas; o detalhe, a imagem original
+                    'miniaturas': miniaturas.variantes(servico['imagem'])
                 })
             
-            return jsonify(servicos_list)
+            return com_validadores(jsonify(servicos_list), etag, ultima_alteracao)
         
         elif request.method == 'POST':
             try:
@@ -936,17 +3388,24 @@ def api_servicos():
                 if not nome:
                     return jsonify({'success': False, 'message': 'Nome é obrigatório'})
                 
+                duracao = validar_duracao_servico(data.get('duracao_minutos'))
+                
+                # A imagem vai para o armazenamento em disco; o banco guarda só a URL
+                imagem = normalizar_imagem(imagem)
+                
                 conn.execute(
-                    'INSERT INTO servicos (nome, descricao, imagem, usuario_id) VALUES (?, ?, ?, ?)',
-                    (nome, descricao, imagem, usuario_id)
+                    'INSERT INTO servicos (nome, descricao, imagem, duracao_minutos, usuario_id) VALUES (?, ?, ?, ?, ?)',
+                    (nome, descricao, imagem, duracao, usuario_id)
                 )
                 conn.commit()
-                conn.close()
+                cache_respostas.invalidar(usuario_id)
+                publicar_alteracoes(usuario_id)
                 
                 return jsonify({'success': True, 'message': 'Serviço adicionado com sucesso!'})
             
+            except (ImagemInvalida, ValueError) as e:
+                return jsonify({'success': False, 'message': str(e)})
             except Exception as e:
-                conn.close()
                 return jsonify({'success': False, 'message': f'Erro ao adicionar serviço: {str(e)}'})
     
     except FileNotFoundError:
@@ -954,15 +3413,46 @@ def api_servicos():
     except Exception as e:
         return jsonify({'error': f'Erro no servidor: {str(e)}'}), 500
 
+@app.route('/api/servicos/imagem', methods=['POST'])
+def api_servicos_imagem():
+    """
+    Upload da foto do serviço em multipart/form-data (campo "imagem").
+
+    O arquivo é copiado em blocos para o armazenamento por hash (sem passar
+    por base64 nem JSON) e as miniaturas WebP são geradas em segundo plano.
+    Retorna a URL da original, para o POST/PUT de /api/servicos, e a de
+    cada miniatura.
+    """
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'Não autorizado'}), 401
+    
+    # Folga para os cabeçalhos do multipart
+    if request.content_length and request.content_length > IMAGEM_MAX_BYTES + BLOCO_IMAGEM:
+        return jsonify({
+            'success': False,
+            'message': f'Imagem maior que {IMAGEM_MAX_BYTES // (1024 * 1024)} MB'
+        }), 413
+    
+    arquivo = request.files.get('imagem')
+    if not arquivo:
+        return jsonify({'success': False, 'message': 'Envie o arquivo no campo "imagem"'}), 400
+    
+    try:
+        url = f'/imagens/{guardar_arquivo_imagem(arquivo.stream)}'
+    except ImagemInvalida as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    return jsonify({
+        'success': True,
+        'imagem': url,
+        'miniaturas': miniaturas.variantes(url)
+    }), 201
+
 @app.route('/api/servicos/<int:servico_id>', methods=['GET', 'PUT', 'DELETE'])
 def api_servico(servico_id):
     if 'usuario_id' not in session:
         return jsonify({'error': 'Não autorizado'}), 401
     
-    # Verificar se o banco existe
-    if not os.path.exists(DATABASE):
-        return jsonify({'error': 'Banco de dados não encontrado'}), 500
-    
     usuario_id = session['usuario_id']
     
     try:
@@ -974,14 +3464,13 @@ def api_servico(servico_id):
                 (servico_id, usuario_id)
             ).fetchone()
             
-            conn.close()
-            
             if servico:
                 return jsonify({
                     'id': servico['id'],
                     'nome': servico['nome'],
                     'descricao': servico['descricao'],
-                    'imagem': servico['imagem']
+                    'imagem': servico['imagem'],
+                    'duracao_minutos': servico['duracao_minutos']
                 })
             else:
                 return jsonify({'error': 'Serviço não encontrado'}), 404
@@ -996,52 +3485,45 @@ def api_servico(servico_id):
                 if not nome:
                     return jsonify({'success': False, 'message': 'Nome é obrigatório'})
                 
-                # Verificar se o serviço pertence ao usuário
-                servico = conn.execute(
-                    'SELECT * FROM servicos WHERE id = ? AND usuario_id = ?', 
-                    (servico_id, usuario_id)
-                ).fetchone()
-                
-                if not servico:
-                    conn.close()
-                    return jsonify({'success': False, 'message': 'Serviço não encontrado'})
+                duracao = validar_duracao_servico(data.get('duracao_minutos'))
+                imagem = normalizar_imagem(imagem)
                 
-                conn.execute(
-                    'UPDATE servicos SET nome = ?, descricao = ?, imagem = ? WHERE id = ? AND usuario_id = ?',
-                    (nome, descricao, imagem, servico_id, usuario_id)
+                # O WHERE por usuario_id já é a verificação de dono. A duração
+                # vale para os próximos agendamentos; os já marcados guardam a sua
+                cursor = conn.execute(
+                    'UPDATE servicos SET nome = ?, descricao = ?, imagem = ?, duracao_minutos = ? WHERE id = ? AND usuario_id = ?',
+                    (nome, descricao, imagem, duracao, servico_id, usuario_id)
                 )
+                if cursor.rowcount == 0:
+                    return jsonify({'success': False, 'message': 'Serviço não encontrado'})
                 conn.commit()
-                conn.close()
+                cache_respostas.invalidar(usuario_id)
+                if canal_eventos.interessado(usuario_id):
+                    canal_eventos.publicar(usuario_id, 'servico', {'id': servico_id, 'nome': nome})
+                publicar_alteracoes(usuario_id)
                 
                 return jsonify({'success': True, 'message': 'Serviço atualizado com sucesso!'})
             
+            except (ImagemInvalida, ValueError) as e:
+                return jsonify({'success': False, 'message': str(e)})
             except Exception as e:
-                conn.close()
                 return jsonify({'success': False, 'message': f'Erro ao atualizar serviço: {str(e)}'})
         
         elif request.method == 'DELETE':
             try:
-                # Verificar se o serviço pertence ao usuário
-                servico = conn.execute(
-                    'SELECT * FROM servicos WHERE id = ? AND usuario_id = ?', 
-                    (servico_id, usuario_id)
-                ).fetchone()
-                
-                if not servico:
-                    conn.close()
-                    return jsonify({'success': False, 'message': 'Serviço não encontrado'})
-                
-                conn.execute(
+                cursor = conn.execute(
                     'DELETE FROM servicos WHERE id = ? AND usuario_id = ?',
                     (servico_id, usuario_id)
                 )
+                if cursor.rowcount == 0:
+                    return jsonify({'success': False, 'message': 'Serviço não encontrado'})
                 conn.commit()
-                conn.close()
+                cache_respostas.invalidar(usuario_id)
+                publicar_alteracoes(usuario_id)
                 
                 return jsonify({'success': True, 'message': 'Serviço excluído com sucesso!'})
             
             except Exception as e:
-                conn.close()
                 return jsonify({'success': False, 'message': f'Erro ao excluir serviço: {str(e)}'})
     
     except FileNotFoundError:
@@ -1058,21 +3540,42 @@ def api_clientes():
     if 'usuario_id' not in session:
         return jsonify({'error': 'Não autorizado'}), 401
     
-    # Verificar se o banco existe
-    if not os.path.exists(DATABASE):
-        return jsonify({'error': 'Banco de dados não encontrado'}), 500
-    
     usuario_id = session['usuario_id']
     
     try:
         conn = get_db_connection()
         
         if request.method == 'GET':
-            clientes = conn.execute(
-                'SELECT * FROM clientes WHERE usuario_id = ? ORDER BY nome', 
-                (usuario_id,)
-            ).fetchall()
-            conn.close()
+            etag, ultima_alteracao = versao_dados(conn, usuario_id, ('clientes',))
+            nao_modificada = resposta_nao_modificada(etag, ultima_alteracao)
+            if nao_modificada:
+                return nao_modificada
+            
+            try:
+                limite, chave = parametros_paginacao(2)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            # Ordenação por (nome, id) segue o índice idx_clientes_usuario_nome
+            query = 'SELECT id, nome, telefone, email FROM clientes WHERE usuario_id = ?'
+            params = [usuario_id]
+            
+            if chave:
+                query += ' AND (nome, id) > (?, ?)'
+                params.extend(chave)
+            
+            query += ' ORDER BY nome, id'
+            
+            if limite:
+                query += ' LIMIT ?'
+                params.append(limite + 1)
+            
+            clientes = conn.execute(query, tuple(params)).fetchall()
+            
+            proximo_cursor = None
+            if limite and len(clientes) > limite:
+                clientes = clientes[:limite]
+                proximo_cursor = codificar_cursor([clientes[-1]['nome'], clientes[-1]['id']])
             
             clientes_list = []
             for cliente in clientes:
@@ -1083,7 +3586,8 @@ def api_clientes():
                     'email': cliente['email']
                 })
             
-            return jsonify(clientes_list)
+            resposta = com_proxima_pagina(jsonify(clientes_list), proximo_cursor)
+            return com_validadores(resposta, etag, ultima_alteracao)
         
         elif request.method == 'POST':
             try:
@@ -1100,12 +3604,12 @@ def api_clientes():
                     (nome, telefone, email, usuario_id)
                 )
                 conn.commit()
-                conn.close()
+                cache_respostas.invalidar(usuario_id)
+                publicar_alteracoes(usuario_id)
                 
                 return jsonify({'success': True, 'message': 'Cliente adicionado com sucesso!'})
             
             except Exception as e:
-                conn.close()
                 return jsonify({'success': False, 'message': f'Erro ao adicionar cliente: {str(e)}'})
     
     except FileNotFoundError:
@@ -1118,10 +3622,6 @@ def api_cliente(cliente_id):
     if 'usuario_id' not in session:
         return jsonify({'error': 'Não autorizado'}), 401
     
-    # Verificar se o banco existe
-    if not os.path.exists(DATABASE):
-        return jsonify({'error': 'Banco de dados não encontrado'}), 500
-    
     usuario_id = session['usuario_id']
     
     try:
@@ -1133,8 +3633,6 @@ def api_cliente(cliente_id):
                 (cliente_id, usuario_id)
             ).fetchone()
             
-            conn.close()
-            
             if cliente:
                 return jsonify({
                     'id': cliente['id'],
@@ -1155,52 +3653,41 @@ def api_cliente(cliente_id):
                 if not nome:
                     return jsonify({'success': False, 'message': 'Nome é obrigatório'})
                 
-                # Verificar se o cliente pertence ao usuário
-                cliente = conn.execute(
-                    'SELECT * FROM clientes WHERE id = ? AND usuario_id = ?', 
-                    (cliente_id, usuario_id)
-                ).fetchone()
-                
-                if not cliente:
-                    conn.close()
-                    return jsonify({'success': False, 'message': 'Cliente não encontrado'})
-                
-                conn.execute(
+                # O WHERE por usuario_id já é a verificação de dono
+                cursor = conn.execute(
                     'UPDATE clientes SET nome = ?, telefone = ?, email = ? WHERE id = ? AND usuario_id = ?',
                     (nome, telefone, email, cliente_id, usuario_id)
                 )
+                if cursor.rowcount == 0:
+                    return jsonify({'success': False, 'message': 'Cliente não encontrado'})
                 conn.commit()
-                conn.close()
+                cache_respostas.invalidar(usuario_id)
+                if canal_eventos.interessado(usuario_id):
+                    canal_eventos.publicar(usuario_id, 'cliente', {
+                        'id': cliente_id, 'nome': nome, 'telefone': telefone, 'email': email
+                    })
+                publicar_alteracoes(usuario_id)
                 
                 return jsonify({'success': True, 'message': 'Cliente atualizado com sucesso!'})
             
             except Exception as e:
-                conn.close()
                 return jsonify({'success': False, 'message': f'Erro ao atualizar cliente: {str(e)}'})
         
         elif request.method == 'DELETE':
             try:
-                # Verificar se o cliente pertence ao usuário
-                cliente = conn.execute(
-                    'SELECT * FROM clientes WHERE id = ? AND usuario_id = ?', 
-                    (cliente_id, usuario_id)
-                ).fetchone()
-                
-                if not cliente:
-                    conn.close()
-                    return jsonify({'success': False, 'message': 'Cliente não encontrado'})
-                
-                conn.execute(
+                cursor = conn.execute(
                     'DELETE FROM clientes WHERE id = ? AND usuario_id = ?',
                     (cliente_id, usuario_id)
                 )
+                if cursor.rowcount == 0:
+                    return jsonify({'success': False, 'message': 'Cliente não encontrado'})
                 conn.commit()
-                conn.close()
+                cache_respostas.invalidar(usuario_id)
+                publicar_alteracoes(usuario_id)
                 
                 return jsonify({'success': True, 'message': 'Cliente excluído com sucesso!'})
             
             except Exception as e:
-                conn.close()
                 return jsonify({'success': False, 'message': f'Erro ao excluir cliente: {str(e)}'})
     
     except FileNotFoundError:
@@ -1208,41 +3695,1047 @@ def api_cliente(cliente_id):
     except Exception as e:
         return jsonify({'error': f'Erro no servidor: {str(e)}'}), 500
 
+# =====================
+# API - IMPORTAÇÃO DE CLIENTES (CSV / NDJSON)
+# =====================
+
+# Nomes de coluna aceitos (em minúsculas) para cada campo
+COLUNAS_IMPORTACAO = {
+    'nome': ('nome', 'name', 'cliente'),
+    'telefone': ('telefone', 'celular', 'whatsapp', 'phone', 'fone'),
+    'email': ('email', 'e-mail', 'mail')
+}
+
+def normalizar_telefone(telefone):
+    """Só os dígitos (o + inicial de números internacionais é mantido)"""
+    telefone = (telefone or '').strip()
+    digitos = re.sub(r'\D', '', telefone)
+    return '+' + digitos if telefone.startswith('+') and digitos else digitos
+
+def ler_linhas_importacao(texto, formato):
+    """
+    Lê o corpo da importação linha a linha, sem carregá-lo inteiro.
+
+    Gera (número da linha, dicionário com as colunas em minúsculas) ou
+    (número da linha, mensagem de erro) quando a linha não pôde ser lida.
+    """
+    if formato == 'csv':
+        leitor = csv.DictReader(texto)
+        for registro in leitor:
+            yield leitor.line_num, {
+                (coluna or '').strip().lower(): valor for coluna, valor in registro.items()
+            }
+        return
+    
+    for numero, linha in enumerate(texto, start=1):
+        if not linha.strip():
+            continue
+        try:
+            registro = json.loads(linha)
+        except ValueError:
+            yield numero, 'JSON inválido'
+            continue
+        if not isinstance(registro, dict):
+            yield numero, 'Cada linha deve ser um objeto JSON'
+            continue
+        yield numero, {str(coluna).strip().lower(): valor for coluna, valor in registro.items()}
+
+def validar_cliente_importado(registro):
+    """Normaliza uma linha importada em (nome, telefone, email) ou levanta ValueError"""
+    campos = {}
+    for campo, nomes in COLUNAS_IMPORTACAO.items():
+        valor = next((registro[nome] for nome in nomes if registro.get(nome) not in (None, '')), '')
+        campos[campo] = ' '.join(str(valor).split())
+    
+    if not campos['nome']:
+        raise ValueError('Nome é obrigatório')
+    if len(campos['nome']) > 200:
+        raise ValueError('Nome muito longo')
+    
+    email = campos['email'].lower()
+    if email and not email_valido(email):
+        raise ValueError(f'Email inválido: {email}')
+    
+    telefone = normalizar_telefone(campos['telefone'])
+    if campos['telefone'] and not 8 <= len(telefone.lstrip('+')) <= 15:
+        raise ValueError(f"Telefone inválido: {campos['telefone']}")
+    
+    return campos['nome'], telefone or None, email or None
+
+@app.route('/api/clientes/importar', methods=['POST'])
+def api_clientes_importar():
+    """
+    Importa clientes em lote de um CSV ou NDJSON.
+
+    O corpo é lido em streaming: direto (Content-Type text/csv ou
+    application/x-ndjson, ou ?formato=csv|ndjson) ou como arquivo no campo
+    "arquivo" de um multipart. As linhas são validadas e normalizadas na
+    leitura, e quem repete telefone ou email (no arquivo ou já cadastrado)
+    é ignorado. Os inserts vão em executemany de IMPORTACAO_LOTE linhas,
+    um commit por lote, então 5.000 clientes são 10 commits e não 5.000.
+    """
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'Não autorizado'}), 401
+    
+    usuario_id = session['usuario_id']
+    
+    arquivo = request.files.get('arquivo') if request.mimetype == 'multipart/form-data' else None
+    formato = request.args.get('formato')
+    if not formato:
+        nome_arquivo = (arquivo.filename or '').lower() if arquivo else ''
+        if request.mimetype == 'text/csv' or nome_arquivo.endswith('.csv'):
+            formato = 'csv'
+        elif request.mimetype in ('application/x-ndjson', 'application/jsonl') or nome_arquivo.endswith(('.ndjson', '.jsonl')):
+            formato = 'ndjson'
+    if formato not in ('csv', 'ndjson'):
+        return jsonify({
+            'success': False,
+            'message': 'Formato não reconhecido. Envie text/csv ou application/x-ndjson (ou use ?formato=csv|ndjson)'
+        }), 415
+    
+    origem = arquivo.stream if arquivo else request.stream
+    # utf-8-sig: planilhas exportadas pelo Excel começam com BOM
+    texto = io.TextIOWrapper(io.BufferedReader(origem) if arquivo is None else origem,
+                             encoding='utf-8-sig', errors='replace', newline='')
+    
+    inicio = time.perf_counter()
+    erros = []
+    total_erros = 0
+    linhas = 0
+    importados = 0
+    duplicados = 0
+    conn = None
+    lote = []
+    
+    try:
+        conn = get_db_connection()
+        
+        # Telefones e emails já cadastrados, normalizados como os importados
+        telefones = set()
+        emails = set()
+        for cliente in conn.execute('SELECT telefone, email FROM clientes WHERE usuario_id = ?', (usuario_id,)):
+            if cliente['telefone']:
+                telefones.add(normalizar_telefone(cliente['telefone']))
+            if cliente['email']:
+                emails.add(cliente['email'].strip().lower())
+        
+        def gravar_lote():
+            conn.executemany(
+                'INSERT INTO clientes (nome, telefone, email, usuario_id) VALUES (?, ?, ?, ?)',
+                lote
+            )
+            conn.commit()
+            lote.clear()
+        
+        for numero, registro in ler_linhas_importacao(texto, formato):
+            linhas += 1
+            if linhas > IMPORTACAO_MAX_LINHAS:
+                total_erros += 1
+                erros.append({'linha': numero, 'erro': f'Limite de {IMPORTACAO_MAX_LINHAS} linhas atingido; o restante foi ignorado'})
+                break
+            
+            try:
+                if isinstance(registro, str):
+                    raise ValueError(registro)
+                nome, telefone, email = validar_cliente_importado(registro)
+            except ValueError as e:
+                total_erros += 1
+                if len(erros) < IMPORTACAO_MAX_ERROS:
+                    erros.append({'linha': numero, 'erro': str(e)})
+                continue
+            
+            if (telefone and telefone in telefones) or (email and email in emails):
+                duplicados += 1
+                continue
+            if telefone:
+                telefones.add(telefone)
+            if email:
+                emails.add(email)
+            
+            lote.append((nome, telefone, email, usuario_id))
+            importados += 1
+            if len(lote) >= IMPORTACAO_LOTE:
+                gravar_lote()
+        
+        if lote:
+            gravar_lote()
+    
+    except FileNotFoundError:
+        return jsonify({'error': 'Banco de dados não encontrado'}), 500
+    except Exception as e:
+        if conn is not None:
+            conn.rollback()
+        return jsonify({
+            'success': False,
+            'message': f'Erro na importação: {str(e)}',
+            # Os lotes anteriores ao erro já foram gravados
+            'importados': importados - len(lote)
+        }), 500
+    finally:
+        if importados:
+            cache_respostas.invalidar(usuario_id)
+            publicar_alteracoes(usuario_id)
+    
+    segundos = time.perf_counter() - inicio
+    return jsonify({
+        'success': True,
+        'message': f'{importados} cliente(s) importado(s)',
+        'linhas': linhas,
+        'importados': importados,
+        'duplicados': duplicados,
+        'total_erros': total_erros,
+        'erros': erros,
+        'segundos': round(segundos, 3),
+        'linhas_por_segundo': round(linhas / segundos) if segundos else linhas
+    })
+
+# =====================
+# DISPONIBILIDADE (HORÁRIOS LIVRES)
+# =====================
+
+DIAS_SEMANA = ['seg', 'ter', 'qua', 'qui', 'sex', 'sab', 'dom']
+
+# Expediente de quem ainda não configurou a agenda
+HORARIOS_PADRAO = {
+    'seg': [['09:00', '18:00']],
+    'ter': [['09:00', '18:00']],
+    'qua': [['09:00', '18:00']],
+    'qui': [['09:00', '18:00']],
+    'sex': [['09:00', '18:00']],
+    'sab': [['09:00', '13:00']],
+    'dom': []
+}
+DURACAO_SLOT_PADRAO = 30
+DISPONIBILIDADE_MAX_DIAS = 62
+PADRAO_HORA = re.compile(r'([01]\d|2[0-3]):([0-5]\d)(?::[0-5]\d)?')
+EPOCA_DIAS = date(1970, 1, 1)
+
+def hora_em_minutos(hora):
+    """'09:30' (ou '09:30:00') -> 570"""
+    correspondencia = PADRAO_HORA.fullmatch(hora or '')
+    if not correspondencia:
+        raise ValueError(f'Hora inválida: {hora}')
+    return int(correspondencia.group(1)) * 60 + int(correspondencia.group(2))
+
+def validar_data_iso(data):
+    """Aceita só 'AAAA-MM-DD' (o formato que dia_agendamento entende); levanta ValueError"""
+    try:
+        valida = date.fromisoformat(data).isoformat() == data
+    except (TypeError, ValueError):
+        valida = False
+    if not valida:
+        raise ValueError(f'Data inválida: {data} (use AAAA-MM-DD)')
+    return data
+
+def somar_dias(data, dias):
+    """data + dias, parando em date.min/date.max em vez de levantar OverflowError"""
+    try:
+        return data + timedelta(days=dias)
+    except OverflowError:
+        return date.max if dias > 0 else date.min
+
+def dia_em_numero(dia):
+    """date(2030, 1, 7) -> 21921, o mesmo valor de agendamentos.dia_agendamento"""
+    return (dia - EPOCA_DIAS).days
+
+def minutos_em_hora(minutos):
+    return f'{minutos // 60:02d}:{minutos % 60:02d}'
+
+def validar_configuracao_agenda(dados):
+    """Valida e normaliza {duracao_slot_minutos, horarios}; levanta ValueError"""
+    try:
+        duracao = int(dados.get('duracao_slot_minutos', DURACAO_SLOT_PADRAO))
+    except (TypeError, ValueError):
+        raise ValueError('duracao_slot_minutos deve ser um número inteiro')
+    if not 5 <= duracao <= 480:
+        raise ValueError('duracao_slot_minutos deve estar entre 5 e 480')
+    
+    horarios = dados.get('horarios', HORARIOS_PADRAO)
+    if not isinstance(horarios, dict) or set(horarios) - set(DIAS_SEMANA):
+        raise ValueError(f'horarios deve ter as chaves: {", ".join(DIAS_SEMANA)}')
+    
+    normalizados = {}
+    for dia in DIAS_SEMANA:
+        intervalos = []
+        for intervalo in horarios.get(dia) or []:
+            if not isinstance(intervalo, (list, tuple)) or len(intervalo) != 2:
+                raise ValueError(f'Intervalo inválido em {dia}: use ["09:00", "12:00"]')
+            inicio, fim = hora_em_minutos(intervalo[0]), hora_em_minutos(intervalo[1])
+            if inicio >= fim:
+                raise ValueError(f'Intervalo inválido em {dia}: {intervalo[0]} não é antes de {intervalo[1]}')
+            intervalos.append((inicio, fim))
+        intervalos.sort()
+        for anterior, atual in zip(intervalos, intervalos[1:]):
+            if atual[0] < anterior[1]:
+                raise ValueError(f'Intervalos sobrepostos em {dia}')
+        normalizados[dia] = [[minutos_em_hora(inicio), minutos_em_hora(fim)] for inicio, fim in intervalos]
+    
+    return {'duracao_slot_minutos': duracao, 'horarios': normalizados}
+
+def carregar_configuracao_agenda(conn, usuario_id):
+    """Configuração do usuário (ou a padrão), com o expediente em minutos por dia da semana"""
+    linha = conn.execute(
+        'SELECT duracao_slot_minutos, horarios FROM configuracao_agenda WHERE usuario_id = ?',
+        (usuario_id,)
+    ).fetchone()
+    if linha:
+        configuracao = {'duracao_slot_minutos': linha['duracao_slot_minutos'], 'horarios': json.loads(linha['horarios'])}
+    else:
+        configuracao = {'duracao_slot_minutos': DURACAO_SLOT_PADRAO, 'horarios': HORARIOS_PADRAO}
+    
+    configuracao['expediente'] = [
+        [(hora_em_minutos(inicio), hora_em_minutos(fim)) for inicio, fim in configuracao['horarios'].get(dia, [])]
+        for dia in DIAS_SEMANA
+    ]
+    return configuracao
+
+def juntar_intervalos(intervalos):
+    """Une intervalos (inicio, fim) já ordenados pelo início que se sobrepõem ou encostam"""
+    unidos = []
+    for inicio, fim in intervalos:
+        if unidos and inicio <= unidos[-1][1]:
+            if fim > unidos[-1][1]:
+                unidos[-1][1] = fim
+        else:
+            unidos.append([inicio, fim])
+    return unidos
+
+def slots_livres(expediente, ocupados, duracao_slot, duracao, a_partir_de=0):
+    """
+    Inícios (em minutos) dos horários livres de um dia.
+
+    expediente: intervalos de atendimento ordenados; ocupados: intervalos
+    já unidos e ordenados. Percorre as duas listas uma vez só (as lacunas
+    entre os ocupados), alinhando os inícios à grade de duracao_slot a
+    partir da abertura de cada intervalo do expediente.
+    """
+    livres = []
+    indice = 0
+    for abertura, fechamento in expediente:
+        cursor = abertura
+        # Pula os ocupados que terminam antes deste intervalo
+        while indice < len(ocupados) and ocupados[indice][1] <= abertura:
+            indice += 1
+        
+        proximo = indice
+        while cursor < fechamento:
+            fim_lacuna = fechamento
+            if proximo < len(ocupados) and ocupados[proximo][0] < fechamento:
+                fim_lacuna = ocupados[proximo][0]
+            
+            # Primeiro ponto da grade dentro da lacuna [cursor, fim_lacuna)
+            inicio = max(cursor, a_partir_de)
+            inicio = abertura + -(-(inicio - abertura) // duracao_slot) * duracao_slot
+            while inicio + duracao <= fim_lacuna:
+                livres.append(inicio)
+                inicio += duracao_slot
+            
+            if fim_lacuna >= fechamento:
+                break
+            cursor = ocupados[proximo][1]
+            proximo += 1
+        # Um ocupado que passa do fechamento ainda vale para o próximo intervalo
+        indice = proximo - 1 if cursor > fechamento else proximo
+    return livres
+
+def calcular_disponibilidade(conn, usuario_id, data_inicio, data_fim, agora=None,
+                             profissional=None, duracao=None):
+    """
+    Horários livres de cada dia entre data_inicio e data_fim (date).
+
+    Os agendamentos do período (menos os cancelados) na agenda do
+    profissional vêm de uma única leitura em ordem no índice, mais as
+    ocorrências das séries; cada um ocupa a própria duração (a do horário
+    da grade, nos antigos).
+    duracao é o tempo que o novo atendimento precisa livre.
+    """
+    configuracao = carregar_configuracao_agenda(conn, usuario_id)
+    duracao_slot = configuracao['duracao_slot_minutos']
+    duracao = duracao or duracao_slot
+    agora = agora or datetime.now()
+    
+    # Tuplas em vez de sqlite3.Row e dia/minuto já inteiros, direto do
+    # índice: com um mês cheio são milhares de linhas
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    ocupados_por_dia = {}
+    for dia_agendamento, inicio, ocupa in cursor.execute('''
+        SELECT dia_agendamento, minuto_agendamento, COALESCE(duracao_minutos, ?)
+        FROM agendamentos
+        WHERE usuario_id = ? AND dia_agendamento BETWEEN ? AND ? AND status != 'cancelado'
+          AND profissional IS ? AND minuto_agendamento IS NOT NULL
+        ORDER BY dia_agendamento, minuto_agendamento
+    ''', (duracao_slot, usuario_id, dia_em_numero(data_inicio) - 1, dia_em_numero(data_fim), profissional)):
+        ocupados_por_dia.setdefault(dia_agendamento, []).append((inicio, inicio + ocupa))
+        if inicio + ocupa > 1440:
+            # Passa da meia-noite: o resto ocupa o começo do dia seguinte,
+            # que vem logo depois na ordem da consulta
+            ocupados_por_dia.setdefault(dia_agendamento + 1, []).append((0, inicio + ocupa - 1440))
+    
+    # Ocorrências das séries que ainda não viraram linha também ocupam a agenda
+    dias_com_series = set()
+    for ocorrencia in ocorrencias_series(conn, usuario_id, data_inicio - timedelta(days=1), data_fim):
+        if ocorrencia['status'] == 'cancelado' or ocorrencia['profissional'] != profissional:
+            continue
+        inicio = hora_em_minutos(ocorrencia['hora_agendamento'])
+        ocupa = ocorrencia['duracao_minutos'] or duracao_slot
+        dia_agendamento = dia_em_numero(date.fromisoformat(ocorrencia['data_agendamento']))
+        ocupados_por_dia.setdefault(dia_agendamento, []).append((inicio, inicio + ocupa))
+        dias_com_series.add(dia_agendamento)
+        if inicio + ocupa > 1440:
+            ocupados_por_dia.setdefault(dia_agendamento + 1, []).append((0, inicio + ocupa - 1440))
+            dias_com_series.add(dia_agendamento + 1)
+    for dia_agendamento in dias_com_series:
+        ocupados_por_dia[dia_agendamento].sort()
+    
+    dias = []
+    proximo_livre = None
+    dia = data_inicio
+    while dia <= data_fim:
+        if dia < agora.date():
+            livres = []
+        else:
+            a_partir_de = agora.hour * 60 + agora.minute + 1 if dia == agora.date() else 0
+            livres = slots_livres(
+                configuracao['expediente'][dia.weekday()],
+                juntar_intervalos(ocupados_por_dia.get(dia_em_numero(dia), [])),
+                duracao_slot, duracao, a_partir_de
+            )
+        horas = [minutos_em_hora(inicio) for inicio in livres]
+        if horas and proximo_livre is None:
+            proximo_livre = {'data': dia.isoformat(), 'hora': horas[0]}
+        dias.append({'data': dia.isoformat(), 'livres': horas})
+        dia += timedelta(days=1)
+    
+    return {
+        'de': data_inicio.isoformat(),
+        'ate': data_fim.isoformat(),
+        'duracao_slot_minutos': duracao_slot,
+        'duracao_minutos': duracao,
+        'profissional': profissional,
+        'dias': dias,
+        'proximo_livre': proximo_livre
+    }
+
+@app.route('/api/disponibilidade')
+def api_disponibilidade():
+    """
+    Horários livres em um período: ?de=AAAA-MM-DD&ate=AAAA-MM-DD
+    (padrão: de hoje até 6 dias depois; no máximo DISPONIBILIDADE_MAX_DIAS).
+    Opcionais: servico_id (horários que cabem a duração do serviço) e
+    profissional (a agenda dele; sem ele, a agenda sem profissional).
+    """
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'Não autorizado'}), 401
+    
+    try:
+        hoje = date.today()
+        data_inicio = date.fromisoformat(request.args.get('de') or hoje.isoformat())
+        data_fim = date.fromisoformat(request.args.get('ate') or somar_dias(data_inicio, 6).isoformat())
+    except ValueError:
+        return jsonify({'error': 'Datas devem estar no formato AAAA-MM-DD'}), 400
+    
+    if data_fim < data_inicio:
+        return jsonify({'error': 'A data final deve ser depois da inicial'}), 400
+    if data_fim.year > ANO_MAXIMO:
+        return jsonify({'error': f'As datas devem ser até {ANO_MAXIMO}-12-31'}), 400
+    if (data_fim - data_inicio).days >= DISPONIBILIDADE_MAX_DIAS:
+        return jsonify({'error': f'Período máximo de {DISPONIBILIDADE_MAX_DIAS} dias'}), 400
+    
+    profissional = (request.args.get('profissional') or '').strip() or None
+    
+    try:
+        conn = get_db_connection()
+        duracao = None
+        servico_id = request.args.get('servico_id')
+        if servico_id:
+            servico = conn.execute(
+                'SELECT duracao_minutos FROM servicos WHERE id = ? AND usuario_id = ?',
+                (servico_id, session['usuario_id'])
+            ).fetchone()
+            if not servico:
+                return jsonify({'error': 'Serviço não encontrado'}), 404
+            duracao = servico['duracao_minutos']
+        
+        return jsonify(calcular_disponibilidade(
+            conn, session['usuario_id'], data_inicio, data_fim,
+            profissional=profissional, duracao=duracao
+        ))
+    except FileNotFoundError:
+        return jsonify({'error': 'Banco de dados não encontrado'}), 500
+    except Exception as e:
+        return jsonify({'error': f'Erro ao calcular disponibilidade: {str(e)}'}), 500
+
+@app.route('/api/disponibilidade/configuracao', methods=['GET', 'PUT'])
+def api_configuracao_agenda():
+    """Expediente por dia da semana e duração de cada horário"""
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'Não autorizado'}), 401
+    
+    usuario_id = session['usuario_id']
+    
+    try:
+        conn = get_db_connection()
+        
+        if request.method == 'GET':
+            configuracao = carregar_configuracao_agenda(conn, usuario_id)
+            return jsonify({
+                'duracao_slot_minutos': configuracao['duracao_slot_minutos'],
+                'horarios': configuracao['horarios']
+            })
+        
+        try:
+            configuracao = validar_configuracao_agenda(request.get_json() or {})
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        conn.execute('''
+            INSERT INTO configuracao_agenda (usuario_id, duracao_slot_minutos, horarios)
+            VALUES (?, ?, ?)
+            ON CONFLICT (usuario_id) DO UPDATE SET
+                duracao_slot_minutos = excluded.duracao_slot_minutos,
+                horarios = excluded.horarios,
+                atualizado_em = CURRENT_TIMESTAMP
+        ''', (usuario_id, configuracao['duracao_slot_minutos'], json.dumps(configuracao['horarios'])))
+        conn.commit()
+        
+        return jsonify({'success': True, 'message': 'Configuração da agenda salva!', **configuracao})
+    
+    except FileNotFoundError:
+        return jsonify({'error': 'Banco de dados não encontrado'}), 500
+    except Exception as e:
+        return jsonify({'error': f'Erro no servidor: {str(e)}'}), 500
+
+# =====================
+# SÉRIES DE AGENDAMENTOS (RECORRÊNCIA)
+# =====================
+
+FREQUENCIAS_SERIE = ('semanal', 'mensal')
+STATUS_SERIE = ('pendente', 'confirmado', 'cancelado')
+SERIES_MAX_OCORRENCIAS = 1000
+# Ao criar ou estender uma série, as datas conferidas contra a agenda
+SERIES_CONFLITOS_DIAS = 730
+DATA_SEM_FIM = date.max.isoformat()
+
+def somar_meses(data, meses):
+    """Mesmo dia `meses` depois; no mês sem esse dia (31, 29/02), o último dia"""
+    anos, mes = divmod(data.month - 1 + meses, 12)
+    ano = data.year + anos
+    if ano > date.max.year:
+        return date.max
+    return date(ano, mes + 1, min(data.day, calendar.monthrange(ano, mes + 1)[1]))
+
+def data_da_ocorrencia(serie, indice):
+    """Data da ocorrência número `indice` (0 = data_inicio)"""
+    inicio = date.fromisoformat(serie['data_inicio'])
+    if serie['frequencia'] == 'semanal':
+        return somar_dias(inicio, 7 * indice * serie['intervalo'])
+    return somar_meses(inicio, indice * serie['intervalo'])
+
+def calcular_data_limite(serie):
+    """Última data possível: data_fim, a última das `ocorrencias` ou DATA_SEM_FIM"""
+    limite = serie.get('data_fim') or DATA_SEM_FIM
+    if serie.get('ocorrencias'):
+        limite = min(limite, data_da_ocorrencia(serie, serie['ocorrencias'] - 1).isoformat())
+    return limite
+
+def datas_da_serie(serie, de, ate):
+    """
+    Datas (date) das ocorrências da série entre de e ate, inclusive.
+
+    Pula direto para a primeira ocorrência da janela, então o custo depende
+    só do tamanho da janela, não de há quanto tempo a série começou.
+    """
+    inicio = date.fromisoformat(serie['data_inicio'])
+    de = max(de, inicio)
+    # somar_meses/somar_dias param em date.max, que fica sempre depois de ate
+    ate = min(ate, date.fromisoformat(serie['data_limite']), date.max - timedelta(days=1))
+    if de > ate:
+        return []
+    
+    if serie['frequencia'] == 'semanal':
+        passo = 7 * serie['intervalo']
+        indice = -(-(de - inicio).days // passo)
+    else:
+        meses = (de.year - inicio.year) * 12 + de.month - inicio.month
+        indice = max(0, meses // serie['intervalo'])
+    
+    datas = []
+    while True:
+        dia = data_da_ocorrencia(serie, indice)
+        if dia > ate:
+            return datas
+        if dia >= de:
+            datas.append(dia)
+        indice += 1
+
+def validar_serie(dados):
+    """Valida e normaliza o corpo de POST /api/series; levanta ValueError"""
+    serie = {
+        'cliente_id': dados.get('cliente_id'),
+        'servico_id': dados.get('servico_id'),
+        'data_inicio': dados.get('data_inicio') or dados.get('data_agendamento'),
+        'hora_agendamento': dados.get('hora_agendamento'),
+        'profissional': (dados.get('profissional') or '').strip() or None,
+        'status': dados.get('status') or 'pendente',
+        'frequencia': dados.get('frequencia') or 'semanal',
+        'data_fim': dados.get('data_fim') or None,
+        'ocorrencias': dados.get('ocorrencias') or None
+    }
+    if not serie['cliente_id'] or not serie['servico_id'] or not serie['data_inicio'] or not serie['hora_agendamento']:
+        raise ValueError('Cliente, serviço, data de início e hora são obrigatórios')
+    if serie['frequencia'] not in FREQUENCIAS_SERIE:
+        raise ValueError(f'Frequência inválida. Use: {", ".join(FREQUENCIAS_SERIE)}')
+    if serie['status'] not in STATUS_SERIE:
+        raise ValueError(f'Status inválido. Use: {", ".join(STATUS_SERIE)}')
+    
+    hora_em_minutos(serie['hora_agendamento'])
+    try:
+        serie['intervalo'] = int(dados.get('intervalo') or 1)
+        inicio = date.fromisoformat(serie['data_inicio'])
+        if serie['data_fim']:
+            fim = date.fromisoformat(serie['data_fim'])
+        if serie['ocorrencias']:
+            serie['ocorrencias'] = int(serie['ocorrencias'])
+    except (TypeError, ValueError):
+        raise ValueError('Datas no formato AAAA-MM-DD; intervalo e ocorrencias inteiros')
+    
+    if inicio.year > ANO_MAXIMO or (serie['data_fim'] and fim.year > ANO_MAXIMO):
+        raise ValueError(f'As datas devem ser até {ANO_MAXIMO}-12-31')
+    if not 1 <= serie['intervalo'] <= 52:
+        raise ValueError('intervalo deve estar entre 1 e 52')
+    if serie['data_fim'] and fim < inicio:
+        raise ValueError('A data final deve ser depois da inicial')
+    if serie['ocorrencias'] is not None and not 1 <= serie['ocorrencias'] <= SERIES_MAX_OCORRENCIAS:
+        raise ValueError(f'ocorrencias deve estar entre 1 e {SERIES_MAX_OCORRENCIAS}')
+    
+    serie['data_inicio'] = inicio.isoformat()
+    serie['data_limite'] = calcular_data_limite(serie)
+    return serie
+
+def ocorrencias_series(conn, usuario_id, de, ate):
+    """
+    Ocorrências ainda não gravadas das séries do usuário entre de e ate
+    (date), no formato da listagem de agendamentos, com id None.
+
+    Só são lidas as séries cuja vigência cruza a janela (faixa no índice
+    usuario_id, data_limite) e as exceções da janela; as datas saem de
+    datas_da_serie. Nada é gravado: uma série de dois anos continua
+    sendo uma linha.
+    """
+    series = conn.execute('''
+        SELECT s.*, c.nome AS cliente_nome, c.telefone AS cliente_telefone,
+               c.email AS cliente_email, sv.nome AS servico_nome
+        FROM series_agendamento s
+        LEFT JOIN clientes c ON c.id = s.cliente_id
+        LEFT JOIN servicos sv ON sv.id = s.servico_id
+        WHERE s.usuario_id = ? AND s.data_limite >= ? AND s.data_inicio <= ?
+    ''', (usuario_id, de.isoformat(), ate.isoformat())).fetchall()
+    if not series:
+        return []
+    
+    excecoes = {
+        (serie_id, data_ocorrencia) for serie_id, data_ocorrencia in conn.execute('''
+            SELECT serie_id, data_ocorrencia FROM excecoes_serie
+            WHERE usuario_id = ? AND data_ocorrencia BETWEEN ? AND ?
+        ''', (usuario_id, de.isoformat(), ate.isoformat()))
+    }
+    
+    ocorrencias = []
+    for serie in series:
+        for dia in datas_da_serie(serie, de, ate):
+            data_agendamento = dia.isoformat()
+            if (serie['id'], data_agendamento) in excecoes:
+                continue
+            ocorrencias.append({
+                'id': None,
+                'serie_id': serie['id'],
+                'cliente_id': serie['cliente_id'],
+                'cliente_nome': serie['cliente_nome'],
+                'cliente_telefone': serie['cliente_telefone'],
+                'cliente_email': serie['cliente_email'],
+                'servico_id': serie['servico_id'],
+                'servico_nome': serie['servico_nome'],
+                'data_agendamento': data_agendamento,
+                'hora_agendamento': serie['hora_agendamento'],
+                'duracao_minutos': serie['duracao_minutos'],
+                'profissional': serie['profissional'],
+                'status': serie['status']
+            })
+    return ocorrencias
+
+def ocorrencias_da_lista(conn, usuario_id, de, ate, quantidade=None, dias_gravados=(), filtro=None):
+    """
+    Ocorrências entre de e ate para uma lista em ordem decrescente de data
+    (GET /api/agendamentos, recentes do dashboard), aceitas por filtro.
+
+    Com quantidade=None vêm todas. Com quantidade=n a expansão parte de
+    ate para trás, em janelas que dobram de tamanho, e para assim que as
+    ocorrências juntadas mais as linhas gravadas já lidas (dias_gravados,
+    em dia_agendamento) a partir do começo da janela somam n: nada mais
+    antigo entra na lista. O custo acompanha o tamanho da página, não a
+    idade das séries. Nunca começa antes da série mais antiga da janela.
+    """
+    mais_antiga = conn.execute(
+        'SELECT MIN(data_inicio) FROM series_agendamento WHERE usuario_id = ? AND data_limite >= ?',
+        (usuario_id, de.isoformat())
+    ).fetchone()[0]
+    if not mais_antiga:
+        return []
+    de = max(de, date.fromisoformat(mais_antiga))
+    
+    ocorrencias = []
+    fim, dias = ate, 31
+    while fim >= de:
+        comeco = de if quantidade is None else max(de, somar_dias(fim, 1 - dias))
+        ocorrencias.extend(
+            ocorrencia for ocorrencia in ocorrencias_series(conn, usuario_id, comeco, fim)
+            if filtro is None or filtro(ocorrencia)
+        )
+        if quantidade is not None:
+            inicio_janela = dia_em_numero(comeco)
+            gravados = sum(1 for dia in dias_gravados if dia >= inicio_janela)
+            if len(ocorrencias) + gravados >= quantidade:
+                break
+        if comeco == de:
+            break
+        fim, dias = comeco - timedelta(days=1), dias * 2
+    return ocorrencias
+
+def conflito_em_series(conn, usuario_id, data_agendamento, inicio, duracao, profissional,
+                       duracao_padrao, ignorar_serie=None):
+    """
+    Ocorrência ainda não gravada que se sobrepõe ao horário, ou None.
+    Olha também a véspera e o dia seguinte, por causa da meia-noite.
+    """
+    try:
+        dia = date.fromisoformat(data_agendamento)
+    except (TypeError, ValueError):
+        return None
+    
+    vespera, seguinte = somar_dias(dia, -1), somar_dias(dia, 1)
+    series = conn.execute('''
+        SELECT id, frequencia, intervalo, data_inicio, data_limite, hora_agendamento, duracao_minutos
+        FROM series_agendamento
+        WHERE usuario_id = ? AND data_limite >= ? AND data_inicio <= ?
+          AND profissional IS ? AND status != 'cancelado' AND id IS NOT ?
+    ''', (usuario_id, vespera.isoformat(), seguinte.isoformat(), profissional, ignorar_serie)).fetchall()
+    
+    for serie in series:
+        ocupa = serie['duracao_minutos'] or duracao_padrao
+        for deslocamento, dia_ocorrencia in ((-1, vespera), (0, dia), (1, seguinte)):
+            # Início da ocorrência em minutos desde a meia-noite de `dia`
+            comeco = hora_em_minutos(serie['hora_agendamento']) + deslocamento * 1440
+            if comeco >= inicio + duracao or inicio >= comeco + ocupa:
+                continue
+            if not datas_da_serie(serie, dia_ocorrencia, dia_ocorrencia):
+                continue
+            if conn.execute(
+                'SELECT 1 FROM excecoes_serie WHERE serie_id = ? AND data_ocorrencia = ?',
+                (serie['id'], dia_ocorrencia.isoformat())
+            ).fetchone():
+                continue
+            return {
+                'id': None,
+                'serie_id': serie['id'],
+                'data_agendamento': dia_ocorrencia.isoformat(),
+                'hora_agendamento': serie['hora_agendamento'],
+                'duracao_minutos': ocupa
+            }
+    return None
+
+def conflitos_da_serie(conn, usuario_id, serie, de, ate, duracao_padrao, ignorar_serie=None):
+    """Datas da série entre de e ate (no máximo SERIES_CONFLITOS_DIAS) que já estão ocupadas"""
+    ate = min(ate, somar_dias(de, SERIES_CONFLITOS_DIAS))
+    inicio = hora_em_minutos(serie['hora_agendamento'])
+    duracao = serie['duracao_minutos'] or duracao_padrao
+    # Datas que já saíram da série (removidas ou gravadas) não ocupam nada
+    excecoes = {
+        data_ocorrencia for (data_ocorrencia,) in conn.execute(
+            'SELECT data_ocorrencia FROM excecoes_serie WHERE serie_id = ? AND data_ocorrencia BETWEEN ? AND ?',
+            (ignorar_serie, de.isoformat(), ate.isoformat())
+        )
+    } if ignorar_serie else set()
+    conflitos = []
+    for dia in datas_da_serie(serie, de, ate):
+        if dia.isoformat() in excecoes:
+            continue
+        conflito = verificar_conflito(
+            conn, usuario_id, dia.isoformat(), inicio, duracao,
+            serie['profissional'], duracao_padrao, ignorar_serie=ignorar_serie
+        )
+        if conflito:
+            conflitos.append({'data': dia.isoformat(), **conflito})
+    return conflitos
+
+def materializar_ocorrencia(conn, serie, data_ocorrencia):
+    """
+    Grava a ocorrência da série como agendamento comum e registra a exceção
+    que a tira da expansão. Daí em diante ela é editada pelas rotas de
+    /api/agendamentos. Retorna o id do agendamento.
+    """
+    cursor = conn.execute('''
+        INSERT INTO agendamentos
+            (cliente_id, servico_id, data_agendamento, hora_agendamento, status,
+             duracao_minutos, profissional, serie_id, usuario_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (serie['cliente_id'], serie['servico_id'], data_ocorrencia, serie['hora_agendamento'],
+          serie['status'], serie['duracao_minutos'], serie['profissional'], serie['id'], serie['usuario_id']))
+    conn.execute(
+        'INSERT INTO excecoes_serie (serie_id, data_ocorrencia, usuario_id, agendamento_id) VALUES (?, ?, ?, ?)',
+        (serie['id'], data_ocorrencia, serie['usuario_id'], cursor.lastrowid)
+    )
+    return cursor.lastrowid
+
+def materializar_ocorrencias_do_dia(conn, dia, status):
+    """
+    Grava as ocorrências de `dia` (todos os usuários) com os status dados
+    e cliente com email: o lembrete do dia anterior precisa da linha.
+    """
+    marcadores = ', '.join('?' for _ in status)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        series = conn.execute(f'''
+            SELECT s.*
+            FROM series_agendamento s
+            JOIN clientes c ON c.id = s.cliente_id
+            WHERE s.data_limite >= ? AND s.data_inicio <= ? AND s.status IN ({marcadores})
+              AND c.email IS NOT NULL AND c.email != ''
+              AND NOT EXISTS (
+                  SELECT 1 FROM excecoes_serie e WHERE e.serie_id = s.id AND e.data_ocorrencia = ?
+              )
+        ''', (dia, dia, *status, dia)).fetchall()
+        
+        data = date.fromisoformat(dia)
+        gravadas = 0
+        for serie in series:
+            if datas_da_serie(serie, data, data):
+                materializar_ocorrencia(conn, serie, dia)
+                gravadas += 1
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return gravadas
+
 # =====================
 # API - AGENDAMENTOS (CRUD COMPLETO)
 # =====================
 
+def agendamentos_sem_data(conn, usuario_id, status_filtro=(), quantidade=None):
+    """
+    Agendamentos com data/hora que a migração 12 não conseguiu converter
+    (dia_agendamento ou minuto_agendamento NULL), do mais novo ao mais
+    antigo. Não têm lugar na ordem por data nem no cursor, então as listas
+    os mostram depois dos datados, até serem corrigidos.
+    """
+    query = '''
+        SELECT a.*, c.nome as cliente_nome, c.telefone as cliente_telefone,
+               c.email as cliente_email, s.nome as servico_nome,
+               c.id as cliente_id, s.id as servico_id
+        FROM agendamentos a
+        LEFT JOIN clientes c ON a.cliente_id = c.id
+        LEFT JOIN servicos s ON a.servico_id = s.id
+        WHERE a.usuario_id = ?
+          AND (a.dia_agendamento IS NULL OR a.minuto_agendamento IS NULL)'''
+    params = [usuario_id]
+    if status_filtro:
+        query += f" AND a.status IN ({', '.join('?' for _ in status_filtro)})"
+        params.extend(status_filtro)
+    query += ' ORDER BY a.id DESC'
+    if quantidade is not None:
+        query += ' LIMIT ?'
+        params.append(quantidade)
+    return conn.execute(query, tuple(params)).fetchall()
+
+def verificar_cliente_servico(conn, usuario_id, cliente_id, servico_id, agendamento_id=None):
+    """
+    Confere em uma consulta se cliente, serviço (e agendamento) são do usuário.
+
+    Sempre retorna uma linha, com tem_cliente/tem_servico/tem_agendamento,
+    os dados do cliente e do serviço usados no email e o que a checagem de
+    conflitos precisa: durações e o horário atual do agendamento.
+    """
+    return conn.execute('''
+        SELECT c.id IS NOT NULL AS tem_cliente,
+               s.id IS NOT NULL AS tem_servico,
+               a.id IS NOT NULL AS tem_agendamento,
+               c.nome AS cliente_nome, c.email AS cliente_email, s.nome AS servico_nome,
+               s.duracao_minutos AS servico_duracao,
+               a.data_agendamento, a.hora_agendamento, a.profissional, a.status,
+               a.duracao_minutos AS agendamento_duracao,
+               (SELECT duracao_slot_minutos FROM configuracao_agenda WHERE usuario_id = ?) AS duracao_slot
+        FROM (SELECT 1)
+        LEFT JOIN clientes c ON c.id = ? AND c.usuario_id = ?
+        LEFT JOIN servicos s ON s.id = ? AND s.usuario_id = ?
+        LEFT JOIN agendamentos a ON a.id = ? AND a.usuario_id = ?
+    ''', (usuario_id, cliente_id, usuario_id, servico_id, usuario_id, agendamento_id, usuario_id)).fetchone()
+
+def verificar_conflito(conn, usuario_id, data_agendamento, inicio, duracao, profissional=None,
+                       duracao_padrao=DURACAO_SLOT_PADRAO, ignorar_id=None, ignorar_serie=None):
+    """
+    Primeiro agendamento ativo da mesma agenda (usuário + profissional) que
+    se sobrepõe a [inicio, inicio + duracao), em minutos; None se o horário
+    está livre. Ocorrências de séries ainda não gravadas também contam.
+
+    Só quem começa até AGENDAMENTO_DURACAO_MAXIMA_MINUTOS antes do novo
+    horário pode alcançá-lo, então a busca é uma faixa de minuto_agendamento
+    no índice parcial idx_agendamentos_agenda_dia, sem ler o dia inteiro.
+    Os minutos contam a partir da meia-noite do dia pedido, então o fim da
+    véspera (atendimentos que passam da meia-noite) e o começo do dia
+    seguinte entram como faixas dos dias vizinhos.
+    Chame dentro de BEGIN IMMEDIATE, antes da escrita.
+    """
+    try:
+        dia = dia_em_numero(date.fromisoformat(data_agendamento))
+    except (TypeError, ValueError):
+        return None
+    
+    alcance = max(AGENDAMENTO_DURACAO_MAXIMA_MINUTOS, duracao_padrao)
+    desde, ate = inicio - alcance, inicio + duracao
+    # (dia, primeiro minuto, último minuto + 1) de cada faixa, no relógio
+    # daquele dia; as vizinhas só existem quando passam da meia-noite
+    faixas = [(dia, max(desde, 0), ate)]
+    if desde < 0:
+        faixas.insert(0, (dia - 1, desde + 1440, 1440))
+    if ate > 1440:
+        faixas.append((dia + 1, 0, ate - 1440))
+    
+    consultas, params = [], []
+    for dia_faixa, primeiro, ultimo in faixas:
+        consultas.append('''
+            SELECT id, data_agendamento, hora_agendamento, dia_agendamento, minuto_agendamento,
+                   COALESCE(duracao_minutos, ?) AS duracao_minutos
+            FROM agendamentos
+            WHERE usuario_id = ? AND dia_agendamento = ? AND profissional IS ?
+              AND status != 'cancelado'
+              AND minuto_agendamento >= ? AND minuto_agendamento < ?
+              AND id IS NOT ?
+              AND (dia_agendamento - ?) * 1440 + minuto_agendamento + COALESCE(duracao_minutos, ?) > ?
+        ''')
+        params.extend((duracao_padrao, usuario_id, dia_faixa, profissional, primeiro, ultimo,
+                       ignorar_id, dia, duracao_padrao, inicio))
+    
+    # Uma busca por faixa no índice (UNION ALL); um OR entre elas faria o
+    # SQLite ler todos os agendamentos do usuário
+    conflito = conn.execute(f'''
+        SELECT id, data_agendamento, hora_agendamento, duracao_minutos
+        FROM ({' UNION ALL '.join(consultas)})
+        ORDER BY dia_agendamento, minuto_agendamento
+        LIMIT 1
+    ''', params).fetchone()
+    if conflito:
+        return dict(conflito)
+    return conflito_em_series(
+        conn, usuario_id, data_agendamento, inicio, duracao, profissional, duracao_padrao, ignorar_serie
+    )
+
+def resposta_conflito(conflito):
+    """409 com o agendamento que já ocupa o horário"""
+    return jsonify({
+        'success': False,
+        'message': (f"Horário indisponível: já existe um agendamento às "
+                    f"{conflito['hora_agendamento'][:5]} ({conflito['duracao_minutos']} min)"),
+        'conflito': {
+            'id': conflito['id'],
+            'serie_id': conflito.get('serie_id'),
+            'data_agendamento': conflito['data_agendamento'],
+            'hora_agendamento': conflito['hora_agendamento'],
+            'duracao_minutos': conflito['duracao_minutos']
+        }
+    }), 409
+
 @app.route('/api/agendamentos', methods=['GET', 'POST'])
 def api_agendamentos():
     if 'usuario_id' not in session:
         return jsonify({'error': 'Não autorizado'}), 401
     
-    # Verificar se o banco existe
-    if not os.path.exists(DATABASE):
-        return jsonify({'error': 'Banco de dados não encontrado'}), 500
-    
     usuario_id = session['usuario_id']
     
     try:
         conn = get_db_connection()
         
         if request.method == 'GET':
-            agendamentos = conn.execute('''
+            try:
+                limite, chave = parametros_paginacao(3)
+                if chave and not all(isinstance(valor, int) for valor in chave):
+                    raise ValueError('Cursor inválido')
+                data_de = validar_data_filtro('de')
+                data_ate = validar_data_filtro('ate')
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            # Sem ?ate, as séries aparecem até SERIES_HORIZONTE_DIAS depois de
+            # hoje (ou de ?de); essa janela anda com a data, que entra no ETag
+            if data_ate:
+                ate_series = date.fromisoformat(data_ate)
+            else:
+                base_series = max(date.today(), date.fromisoformat(data_de)) if data_de else date.today()
+                ate_series = somar_dias(base_series, SERIES_HORIZONTE_DIAS)
+            # Sem limit as séries seriam expandidas até ?ate inteiro numa
+            # resposta só; depois do horizonte, a lista tem que ser paginada
+            if not limite and data_ate:
+                base_series = max(date.today(), date.fromisoformat(data_de)) if data_de else date.today()
+                horizonte = somar_dias(base_series, SERIES_HORIZONTE_DIAS)
+                if ate_series > horizonte:
+                    return jsonify({
+                        'error': f'Para ate depois de {horizonte.isoformat()}, use limit (lista paginada)'
+                    }), 400
+            
+            # A lista inclui nomes de clientes e serviços, então depende das três tabelas
+            etag, ultima_alteracao = versao_dados(
+                conn, usuario_id, ('agendamentos', 'clientes', 'servicos', 'series_agendamento'),
+                variante='' if data_ate else ate_series.isoformat()
+            )
+            nao_modificada = resposta_nao_modificada(etag, ultima_alteracao)
+            if nao_modificada:
+                return nao_modificada
+            
+            status_filtro = [s for s in request.args.get('status', '').split(',') if s]
+            
+            # Filtros e cursor são faixas de inteiros nos índices (usuario_id,
+            # dia, minuto) e (usuario_id, status, dia, minuto); o id desempata.
+            # Data/hora que a migração 12 não conseguiu converter (NULL) não
+            # têm lugar na ordem nem no cursor: vêm no fim da última página
+            query = '''
                 SELECT a.*, c.nome as cliente_nome, c.telefone as cliente_telefone, 
                        c.email as cliente_email, s.nome as servico_nome, 
                        c.id as cliente_id, s.id as servico_id
                 FROM agendamentos a 
                 LEFT JOIN clientes c ON a.cliente_id = c.id 
                 LEFT JOIN servicos s ON a.servico_id = s.id 
-                WHERE a.usuario_id = ? 
-                ORDER BY a.data_agendamento DESC, a.hora_agendamento DESC
-            ''', (usuario_id,)).fetchall()
-            conn.close()
+                WHERE a.usuario_id = ?
+                  AND a.dia_agendamento IS NOT NULL AND a.minuto_agendamento IS NOT NULL'''
+            params = [usuario_id]
             
-            agendamentos_list = []
-            for agendamento in agendamentos:
-                agendamentos_list.append({
+            if status_filtro:
+                query += f" AND a.status IN ({', '.join('?' for _ in status_filtro)})"
+                params.extend(status_filtro)
+            
+            if data_de:
+                query += ' AND a.dia_agendamento >= ?'
+                params.append(dia_em_numero(date.fromisoformat(data_de)))
+            
+            if data_ate:
+                query += ' AND a.dia_agendamento <= ?'
+                params.append(dia_em_numero(date.fromisoformat(data_ate)))
+            
+            if chave:
+                query += ' AND (a.dia_agendamento, a.minuto_agendamento, a.id) < (?, ?, ?)'
+                params.extend(chave)
+            
+            query += ' ORDER BY a.dia_agendamento DESC, a.minuto_agendamento DESC, a.id DESC'
+            
+            if limite:
+                query += ' LIMIT ?'
+                params.append(limite + 1)
+            
+            agendamentos = conn.execute(query, tuple(params)).fetchall()
+            
+            def descrever(agendamento):
+                return {
                     'id': agendamento['id'],
+                    'serie_id': agendamento['serie_id'],
                     'cliente_id': agendamento['cliente_id'],
                     'cliente_nome': agendamento['cliente_nome'],
                     'cliente_telefone': agendamento['cliente_telefone'],
@@ -1251,10 +4744,61 @@ def api_agendamentos():
                     'servico_nome': agendamento['servico_nome'],
                     'data_agendamento': agendamento['data_agendamento'],
                     'hora_agendamento': agendamento['hora_agendamento'],
+                    'duracao_minutos': agendamento['duracao_minutos'],
+                    'profissional': agendamento['profissional'],
                     'status': agendamento['status']
-                })
+                }
+            
+            agendamentos_list = []
+            ordem_gravados = {}
+            for agendamento in agendamentos:
+                ordem_gravados[agendamento['id']] = (
+                    agendamento['dia_agendamento'], agendamento['minuto_agendamento'], agendamento['id']
+                )
+                agendamentos_list.append(descrever(agendamento))
+            
+            # Ocorrências das séries intercaladas na mesma ordem. No cursor
+            # elas usam -serie_id no lugar do id (uma por dia)
+            def chave_ordem(item):
+                if item['id']:
+                    return ordem_gravados[item['id']]
+                return (dia_em_numero(date.fromisoformat(item['data_agendamento'])),
+                        hora_em_minutos(item['hora_agendamento']), -item['serie_id'])
             
-            return jsonify(agendamentos_list)
+            def aceita(ocorrencia):
+                return ((not status_filtro or ocorrencia['status'] in status_filtro)
+                        and (not chave or chave_ordem(ocorrencia) < tuple(chave)))
+            
+            # Só a janela da página: acima, até o cursor; abaixo, até a última
+            # linha gravada lida (nada mais antigo entra na página) ou, se as
+            # gravadas acabaram, até juntar o que falta para completá-la
+            de_series = date.fromisoformat(data_de) if data_de else date.min
+            if chave:
+                ate_series = min(ate_series, EPOCA_DIAS + timedelta(days=chave[0]))
+            if limite and len(agendamentos) > limite:
+                de_series = max(de_series, EPOCA_DIAS + timedelta(days=agendamentos[-1]['dia_agendamento']))
+            ocorrencias = ocorrencias_da_lista(
+                conn, usuario_id, de_series, ate_series, limite + 1 if limite else None,
+                [agendamento['dia_agendamento'] for agendamento in agendamentos], aceita
+            )
+            if ocorrencias:
+                agendamentos_list = sorted(agendamentos_list + ocorrencias, key=chave_ordem, reverse=True)
+            
+            proximo_cursor = None
+            if limite and len(agendamentos_list) > limite:
+                agendamentos_list = agendamentos_list[:limite]
+                proximo_cursor = codificar_cursor(list(chave_ordem(agendamentos_list[-1])))
+            
+            # Sem data válida: um bloco no fim da última página (só sobras da
+            # migração 12, já que as escritas validam data e hora); filtros
+            # de data não os alcançam
+            if not proximo_cursor and not data_de and not data_ate:
+                agendamentos_list.extend(
+                    descrever(agendamento) for agendamento in agendamentos_sem_data(conn, usuario_id, status_filtro)
+                )
+            
+            resposta = com_proxima_pagina(jsonify(agendamentos_list), proximo_cursor)
+            return com_validadores(resposta, etag, ultima_alteracao)
         
         elif request.method == 'POST':
             try:
@@ -1264,68 +4808,81 @@ def api_agendamentos():
                 data_agendamento = data.get('data_agendamento')
                 hora_agendamento = data.get('hora_agendamento')
                 status = data.get('status', 'pendente')
+                profissional = (data.get('profissional') or '').strip() or None
                 
                 if not cliente_id or not servico_id or not data_agendamento or not hora_agendamento:
                     return jsonify({'success': False, 'message': 'Todos os campos são obrigatórios'})
                 
-                # Verificar se cliente e serviço pertencem ao usuário
-                cliente = conn.execute(
-                    'SELECT * FROM clientes WHERE id = ? AND usuario_id = ?', 
-                    (cliente_id, usuario_id)
-                ).fetchone()
-                
-                servico = conn.execute(
-                    'SELECT * FROM servicos WHERE id = ? AND usuario_id = ?', 
-                    (servico_id, usuario_id)
-                ).fetchone()
-                
-                if not cliente:
-                    conn.close()
-                    return jsonify({'success': False, 'message': 'Cliente não encontrado'})
-                
-                if not servico:
-                    conn.close()
-                    return jsonify({'success': False, 'message': 'Serviço não encontrado'})
-                
-                # Inserir agendamento
-                conn.execute(
-                    'INSERT INTO agendamentos (cliente_id, servico_id, data_agendamento, hora_agendamento, status, usuario_id) VALUES (?, ?, ?, ?, ?, ?)',
-                    (int(cliente_id), int(servico_id), data_agendamento, hora_agendamento, status, usuario_id)
-                )
-                conn.commit()
-                
-                # ========== ENVIAR EMAIL PARA NOVO AGENDAMENTO ==========
-                email_enviado = False
-                mensagem_email = ""
+                try:
+                    validar_data_iso(data_agendamento)
+                    inicio = hora_em_minutos(hora_agendamento)
+                except ValueError as e:
+                    return jsonify({'success': False, 'message': str(e)})
                 
-                if cliente['email']:
-                    enviado, mensagem = enviar_email_gmail(
-                        cliente['email'],
-                        cliente['nome'],
-                        servico['nome'],
-                        data_agendamento,
-                        hora_agendamento,
-                        status
+                # Checagem e INSERT na mesma transação de escrita: o BEGIN IMMEDIATE
+                # pega o lock antes da leitura, então dois pedidos para o mesmo
+                # horário não passam juntos pela checagem
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    # Cliente e serviço do usuário em uma consulta (sempre volta uma linha)
+                    dono = verificar_cliente_servico(conn, usuario_id, cliente_id, servico_id)
+                    
+                    if not dono['tem_cliente']:
+                        return jsonify({'success': False, 'message': 'Cliente não encontrado'})
+                    
+                    if not dono['tem_servico']:
+                        return jsonify({'success': False, 'message': 'Serviço não encontrado'})
+                    
+                    duracao_slot = dono['duracao_slot'] or DURACAO_SLOT_PADRAO
+                    duracao = dono['servico_duracao'] or duracao_slot
+                    
+                    if status != 'cancelado':
+                        conflito = verificar_conflito(
+                            conn, usuario_id, data_agendamento, inicio, duracao, profissional, duracao_slot
+                        )
+                        if conflito:
+                            return resposta_conflito(conflito)
+                    
+                    # Inserir agendamento (com a duração do serviço neste momento)
+                    cursor = conn.execute(
+                        'INSERT INTO agendamentos (cliente_id, servico_id, data_agendamento, hora_agendamento, status, duracao_minutos, profissional, usuario_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (int(cliente_id), int(servico_id), data_agendamento, hora_agendamento, status, duracao, profissional, usuario_id)
                     )
+                    agendamento_id = cursor.lastrowid
                     
-                    if enviado:
-                        email_enviado = True
-                        mensagem_email = "Email enviado com sucesso!"
-                    else:
-                        mensagem_email = f"Email não enviado: {mensagem}"
-                else:
-                    mensagem_email = "Cliente não tem email cadastrado"
+                    # ========== EMAIL PARA NOVO AGENDAMENTO (OUTBOX) ==========
+                    email_id = None
+                    if dono['cliente_email']:
+                        email_id = enfileirar_email(
+                            conn, usuario_id, agendamento_id,
+                            dono['cliente_email'],
+                            dono['cliente_nome'],
+                            dono['servico_nome'],
+                            data_agendamento,
+                            hora_agendamento,
+                            status
+                        )
+                    
+                    conn.commit()
+                finally:
+                    # Retornos antecipados e erros soltam o lock de escrita na hora
+                    if conn.in_transaction:
+                        conn.rollback()
+                
+                cache_respostas.invalidar(usuario_id)
+                publicar_alteracoes(usuario_id, agendamento_id)
+                fila_emails.acordar()
                 
-                conn.close()
+                mensagem_email, dados_email = descrever_email(email_id)
                 
                 return jsonify({
                     'success': True, 
                     'message': f'Agendamento realizado com sucesso! {mensagem_email}',
-                    'email_enviado': email_enviado
+                    'id': agendamento_id,
+                    **dados_email
                 })
             
             except Exception as e:
-                conn.close()
                 return jsonify({'success': False, 'message': f'Erro ao criar agendamento: {str(e)}'})
     
     except FileNotFoundError:
@@ -1338,10 +4895,6 @@ def api_agendamento(agendamento_id):
     if 'usuario_id' not in session:
         return jsonify({'error': 'Não autorizado'}), 401
     
-    # Verificar se o banco existe
-    if not os.path.exists(DATABASE):
-        return jsonify({'error': 'Banco de dados não encontrado'}), 500
-    
     usuario_id = session['usuario_id']
     
     try:
@@ -1357,11 +4910,10 @@ def api_agendamento(agendamento_id):
                 WHERE a.id = ? AND a.usuario_id = ?
             ''', (agendamento_id, usuario_id)).fetchone()
             
-            conn.close()
-            
             if agendamento:
                 return jsonify({
                     'id': agendamento['id'],
+                    'serie_id': agendamento['serie_id'],
                     'cliente_id': agendamento['cliente_id'],
                     'cliente_nome': agendamento['cliente_nome'],
                     'cliente_telefone': agendamento['cliente_telefone'],
@@ -1370,6 +4922,8 @@ def api_agendamento(agendamento_id):
                     'servico_nome': agendamento['servico_nome'],
                     'data_agendamento': agendamento['data_agendamento'],
                     'hora_agendamento': agendamento['hora_agendamento'],
+                    'duracao_minutos': agendamento['duracao_minutos'],
+                    'profissional': agendamento['profissional'],
                     'status': agendamento['status']
                 })
             else:
@@ -1383,37 +4937,16 @@ def api_agendamento(agendamento_id):
                 data_agendamento = data.get('data_agendamento')
                 hora_agendamento = data.get('hora_agendamento')
                 status = data.get('status')
+                muda_profissional = 'profissional' in data
+                profissional = (data.get('profissional') or '').strip() or None
                 
-                # Verificar se o agendamento pertence ao usuário
-                agendamento = conn.execute(
-                    'SELECT * FROM agendamentos WHERE id = ? AND usuario_id = ?', 
-                    (agendamento_id, usuario_id)
-                ).fetchone()
-                
-                if not agendamento:
-                    conn.close()
-                    return jsonify({'success': False, 'message': 'Agendamento não encontrado'})
-                
-                # Verificar se cliente e serviço pertencem ao usuário (se for atualizar)
-                if cliente_id:
-                    cliente = conn.execute(
-                        'SELECT * FROM clientes WHERE id = ? AND usuario_id = ?', 
-                        (cliente_id, usuario_id)
-                    ).fetchone()
-                    
-                    if not cliente:
-                        conn.close()
-                        return jsonify({'success': False, 'message': 'Cliente não encontrado'})
-                
-                if servico_id:
-                    servico = conn.execute(
-                        'SELECT * FROM servicos WHERE id = ? AND usuario_id = ?', 
-                        (servico_id, usuario_id)
-                    ).fetchone()
-                    
-                    if not servico:
-                        conn.close()
-                        return jsonify({'success': False, 'message': 'Serviço não encontrado'})
+                try:
+                    if data_agendamento:
+                        validar_data_iso(data_agendamento)
+                    if hora_agendamento:
+                        hora_em_minutos(hora_agendamento)
+                except ValueError as e:
+                    return jsonify({'success': False, 'message': str(e)})
                 
                 # Atualizar agendamento
                 update_query = 'UPDATE agendamentos SET '
@@ -1439,45 +4972,100 @@ def api_agendamento(agendamento_id):
                     update_query += 'status = ?, '
                     params.append(status)
                 
-                # Remover última vírgula e espaço
-                update_query = update_query.rstrip(', ')
-                update_query += ' WHERE id = ? AND usuario_id = ?'
+                if muda_profissional:
+                    update_query += 'profissional = ?, '
+                    params.append(profissional)
                 
-                params.extend([agendamento_id, usuario_id])
+                if not params:
+                    return jsonify({'success': False, 'message': 'Nenhum campo para atualizar'})
                 
-                conn.execute(update_query, tuple(params))
-                conn.commit()
-                conn.close()
+                try:
+                    # Só o que pode ocupar outro horário passa pela checagem de
+                    # conflitos; trocar o cliente, ou o status entre estados
+                    # ativos, continua sendo um UPDATE só
+                    if status != 'cancelado' and (servico_id or data_agendamento or hora_agendamento
+                                                  or muda_profissional or status):
+                        conn.execute('BEGIN IMMEDIATE')
+                        atual = verificar_cliente_servico(conn, usuario_id, cliente_id, servico_id, agendamento_id)
+                        
+                        if atual['tem_agendamento'] and (atual['tem_servico'] or not servico_id):
+                            duracao_slot = atual['duracao_slot'] or DURACAO_SLOT_PADRAO
+                            if servico_id:
+                                duracao = atual['servico_duracao'] or duracao_slot
+                                update_query += 'duracao_minutos = ?, '
+                                params.append(duracao)
+                            else:
+                                duracao = atual['agendamento_duracao'] or duracao_slot
+                            
+                            muda_horario = (servico_id or data_agendamento or hora_agendamento
+                                            or muda_profissional or atual['status'] == 'cancelado')
+                            try:
+                                inicio = hora_em_minutos(hora_agendamento or atual['hora_agendamento'])
+                            except ValueError:
+                                # Hora antiga fora do formato HH:MM: não há como comparar
+                                inicio = None
+                            
+                            if (status or atual['status']) != 'cancelado' and muda_horario and inicio is not None:
+                                conflito = verificar_conflito(
+                                    conn, usuario_id,
+                                    data_agendamento or atual['data_agendamento'],
+                                    inicio, duracao,
+                                    profissional if muda_profissional else atual['profissional'],
+                                    duracao_slot, agendamento_id
+                                )
+                                if conflito:
+                                    return resposta_conflito(conflito)
+                    
+                    # Remover última vírgula e espaço
+                    update_query = update_query.rstrip(', ')
+                    
+                    # Dono do agendamento, do cliente e do serviço no próprio UPDATE
+                    update_query += ''' WHERE id = ? AND usuario_id = ?
+                        AND (? IS NULL OR EXISTS (SELECT 1 FROM clientes WHERE id = ? AND usuario_id = ?))
+                        AND (? IS NULL OR EXISTS (SELECT 1 FROM servicos WHERE id = ? AND usuario_id = ?))'''
+                    params.extend([agendamento_id, usuario_id])
+                    params.extend([cliente_id or None, cliente_id or None, usuario_id])
+                    params.extend([servico_id or None, servico_id or None, usuario_id])
+                    
+                    cursor = conn.execute(update_query, tuple(params))
+                    if cursor.rowcount == 0:
+                        # Só no caminho de erro: descobre qual dos três não é do usuário
+                        dono = verificar_cliente_servico(conn, usuario_id, cliente_id, servico_id, agendamento_id)
+                        if not dono['tem_agendamento']:
+                            mensagem = 'Agendamento não encontrado'
+                        elif cliente_id and not dono['tem_cliente']:
+                            mensagem = 'Cliente não encontrado'
+                        else:
+                            mensagem = 'Serviço não encontrado'
+                        return jsonify({'success': False, 'message': mensagem})
+                    conn.commit()
+                finally:
+                    if conn.in_transaction:
+                        conn.rollback()
+                
+                cache_respostas.invalidar(usuario_id)
+                publicar_alteracoes(usuario_id, agendamento_id)
                 
                 return jsonify({'success': True, 'message': 'Agendamento atualizado com sucesso!'})
             
             except Exception as e:
-                conn.close()
                 return jsonify({'success': False, 'message': f'Erro ao atualizar agendamento: {str(e)}'})
         
         elif request.method == 'DELETE':
             try:
-                # Verificar se o agendamento pertence ao usuário
-                agendamento = conn.execute(
-                    'SELECT * FROM agendamentos WHERE id = ? AND usuario_id = ?', 
-                    (agendamento_id, usuario_id)
-                ).fetchone()
-                
-                if not agendamento:
-                    conn.close()
-                    return jsonify({'success': False, 'message': 'Agendamento não encontrado'})
-                
-                conn.execute(
+                cursor = conn.execute(
                     'DELETE FROM agendamentos WHERE id = ? AND usuario_id = ?',
                     (agendamento_id, usuario_id)
                 )
+                if cursor.rowcount == 0:
+                    return jsonify({'success': False, 'message': 'Agendamento não encontrado'})
                 conn.commit()
-                conn.close()
+                cache_respostas.invalidar(usuario_id)
+                publicar_alteracoes(usuario_id, agendamento_id, removido=True)
                 
                 return jsonify({'success': True, 'message': 'Agendamento excluído com sucesso!'})
             
             except Exception as e:
-                conn.close()
                 return jsonify({'success': False, 'message': f'Erro ao excluir agendamento: {str(e)}'})
     
     except FileNotFoundError:
@@ -1497,10 +5085,6 @@ def atualizar_status_agendamento(agendamento_id):
     if 'usuario_id' not in session:
         return jsonify({'error': 'Não autorizado'}), 401
     
-    # Verificar se o banco existe
-    if not os.path.exists(DATABASE):
-        return jsonify({'error': 'Banco de dados não encontrado'}), 500
-    
     usuario_id = session['usuario_id']
     
     try:
@@ -1517,34 +5101,52 @@ def atualizar_status_agendamento(agendamento_id):
         
         conn = get_db_connection()
         
-        # Verificar se o agendamento pertence ao usuário
-        agendamento = conn.execute('''
-            SELECT a.*, c.nome as cliente_nome, c.email as cliente_email, s.nome as servico_nome
-            FROM agendamentos a
-            LEFT JOIN clientes c ON a.cliente_id = c.id
-            LEFT JOIN servicos s ON a.servico_id = s.id
-            WHERE a.id = ? AND a.usuario_id = ?
-        ''', (agendamento_id, usuario_id)).fetchone()
-        
-        if not agendamento:
-            conn.close()
-            return jsonify({'success': False, 'message': 'Agendamento não encontrado'})
-        
-        # Atualizar status
-        conn.execute('''
+        # Atualiza só se for do usuário e já devolve o que o email precisa
+        atualizar_status = '''
             UPDATE agendamentos 
             SET status = ? 
-            WHERE id = ? AND usuario_id = ?
-        ''', (novo_status, agendamento_id, usuario_id))
-        
-        conn.commit()
+            WHERE id = ? AND usuario_id = ?{filtro}
+            RETURNING data_agendamento, hora_agendamento,
+                (SELECT nome FROM clientes WHERE id = agendamentos.cliente_id) AS cliente_nome,
+                (SELECT email FROM clientes WHERE id = agendamentos.cliente_id) AS cliente_email,
+                (SELECT nome FROM servicos WHERE id = agendamentos.servico_id) AS servico_nome
+        '''
+        parametros = (novo_status, agendamento_id, usuario_id)
+        
+        if novo_status == 'cancelado':
+            agendamento = conn.execute(atualizar_status.format(filtro=''), parametros).fetchone()
+        else:
+            # Entre estados ativos a ocupação da agenda não muda: um UPDATE só
+            agendamento = conn.execute(
+                atualizar_status.format(filtro=" AND status != 'cancelado'"), parametros
+            ).fetchone()
+            if not agendamento:
+                # Não existe ou está cancelado. Reativar volta a ocupar o
+                # horário, então passa pela mesma checagem do POST
+                conn.rollback()
+                conn.execute('BEGIN IMMEDIATE')
+                atual = verificar_cliente_servico(conn, usuario_id, None, None, agendamento_id)
+                if atual['tem_agendamento'] and PADRAO_HORA.fullmatch(atual['hora_agendamento'] or ''):
+                    duracao_slot = atual['duracao_slot'] or DURACAO_SLOT_PADRAO
+                    conflito = verificar_conflito(
+                        conn, usuario_id, atual['data_agendamento'],
+                        hora_em_minutos(atual['hora_agendamento']),
+                        atual['agendamento_duracao'] or duracao_slot,
+                        atual['profissional'], duracao_slot, agendamento_id
+                    )
+                    if conflito:
+                        conn.rollback()
+                        return resposta_conflito(conflito)
+                agendamento = conn.execute(atualizar_status.format(filtro=''), parametros).fetchone()
         
-        # ========== ENVIAR EMAIL DE ATUALIZAÇÃO ==========
-        email_enviado = False
-        mensagem_email = ""
+        if not agendamento:
+            return jsonify({'success': False, 'message': 'Agendamento não encontrado'})
         
+        # ========== EMAIL DE ATUALIZAÇÃO (OUTBOX) ==========
+        email_id = None
         if agendamento['cliente_email']:
-            enviado, mensagem = enviar_email_gmail(
+            email_id = enfileirar_email(
+                conn, usuario_id, agendamento_id,
                 agendamento['cliente_email'],
                 agendamento['cliente_nome'],
                 agendamento['servico_nome'],
@@ -1552,37 +5154,440 @@ def atualizar_status_agendamento(agendamento_id):
                 agendamento['hora_agendamento'],
                 novo_status
             )
+        
+        conn.commit()
+        cache_respostas.invalidar(usuario_id)
+        publicar_alteracoes(usuario_id, agendamento_id)
+        fila_emails.acordar()
+        
+        mensagem_email, dados_email = descrever_email(email_id)
+        
+        return jsonify({
+            'success': True,
+            'message': f'Status atualizado para {novo_status}. {mensagem_email}',
+            **dados_email,
+            'agendamento': {
+                'id': agendamento_id,
+                'status': novo_status,
+                'cliente_nome': agendamento['cliente_nome'],
+                'servico_nome': agendamento['servico_nome'],
+                'data_agendamento': agendamento['data_agendamento'],
+                'hora_agendamento': agendamento['hora_agendamento']
+            }
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Erro ao atualizar status: {str(e)}'
+        }), 500
+
+# =====================
+# API - SÉRIES DE AGENDAMENTOS
+# =====================
+
+CONSULTA_SERIES = '''
+    SELECT s.*, c.nome AS cliente_nome, sv.nome AS servico_nome
+    FROM series_agendamento s
+    LEFT JOIN clientes c ON c.id = s.cliente_id
+    LEFT JOIN servicos sv ON sv.id = s.servico_id
+'''
+
+def descrever_serie(serie, proximas=()):
+    return {
+        'id': serie['id'],
+        'cliente_id': serie['cliente_id'],
+        'cliente_nome': serie['cliente_nome'],
+        'servico_id': serie['servico_id'],
+        'servico_nome': serie['servico_nome'],
+        'hora_agendamento': serie['hora_agendamento'],
+        'duracao_minutos': serie['duracao_minutos'],
+        'profissional': serie['profissional'],
+        'status': serie['status'],
+        'frequencia': serie['frequencia'],
+        'intervalo': serie['intervalo'],
+        'data_inicio': serie['data_inicio'],
+        'data_fim': serie['data_fim'],
+        'ocorrencias': serie['ocorrencias'],
+        'proximas': [dia.isoformat() for dia in proximas]
+    }
+
+def resposta_conflitos_serie(conflitos):
+    """409 com as datas ocupadas; pular_conflitos=true cria a série sem elas"""
+    return jsonify({
+        'success': False,
+        'message': (f'{len(conflitos)} data(s) da série já estão ocupadas. '
+                    'Envie pular_conflitos=true para criar a série sem elas.'),
+        'conflitos': conflitos[:50]
+    }), 409
+
+@app.route('/api/series', methods=['GET', 'POST'])
+def api_series():
+    """
+    Séries de agendamentos: uma linha por série. As ocorrências aparecem em
+    /api/agendamentos, /api/disponibilidade e no dashboard só para a janela
+    consultada.
+    """
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'Não autorizado'}), 401
+    
+    usuario_id = session['usuario_id']
+    
+    try:
+        conn = get_db_connection()
+        
+        if request.method == 'GET':
+            etag, ultima_alteracao = versao_dados(conn, usuario_id, ('series_agendamento', 'clientes', 'servicos'))
+            nao_modificada = resposta_nao_modificada(etag, ultima_alteracao)
+            if nao_modificada:
+                return nao_modificada
+            
+            series = conn.execute(
+                CONSULTA_SERIES + ' WHERE s.usuario_id = ? ORDER BY s.data_inicio DESC, s.id DESC',
+                (usuario_id,)
+            ).fetchall()
+            return com_validadores(jsonify([descrever_serie(serie) for serie in series]), etag, ultima_alteracao)
+        
+        data = request.get_json() or {}
+        try:
+            serie = validar_serie(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)})
+        
+        # Mesma transação de escrita da checagem de conflitos do POST avulso
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            dono = verificar_cliente_servico(conn, usuario_id, serie['cliente_id'], serie['servico_id'])
+            if not dono['tem_cliente']:
+                return jsonify({'success': False, 'message': 'Cliente não encontrado'})
+            if not dono['tem_servico']:
+                return jsonify({'success': False, 'message': 'Serviço não encontrado'})
+            
+            duracao_slot = dono['duracao_slot'] or DURACAO_SLOT_PADRAO
+            serie['duracao_minutos'] = dono['servico_duracao'] or duracao_slot
+            
+            conflitos = []
+            if serie['status'] != 'cancelado':
+                inicio = date.fromisoformat(serie['data_inicio'])
+                conflitos = conflitos_da_serie(conn, usuario_id, serie, inicio, date.max, duracao_slot)
+                if conflitos and not data.get('pular_conflitos'):
+                    return resposta_conflitos_serie(conflitos)
+            
+            cursor = conn.execute('''
+                INSERT INTO series_agendamento
+                    (cliente_id, servico_id, hora_agendamento, duracao_minutos, profissional, status,
+                     frequencia, intervalo, data_inicio, data_fim, ocorrencias, data_limite, usuario_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (int(serie['cliente_id']), int(serie['servico_id']), serie['hora_agendamento'],
+                  serie['duracao_minutos'], serie['profissional'], serie['status'],
+                  serie['frequencia'], serie['intervalo'], serie['data_inicio'], serie['data_fim'],
+                  serie['ocorrencias'], serie['data_limite'], usuario_id))
+            serie_id = cursor.lastrowid
+            
+            # Datas ocupadas viram exceções: a série simplesmente não passa nelas
+            conn.executemany(
+                'INSERT INTO excecoes_serie (serie_id, data_ocorrencia, usuario_id) VALUES (?, ?, ?)',
+                [(serie_id, conflito['data'], usuario_id) for conflito in conflitos]
+            )
+            conn.commit()
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+        
+        cache_respostas.invalidar(usuario_id)
+        publicar_alteracoes(usuario_id)
+        
+        hoje = max(date.today(), date.fromisoformat(serie['data_inicio']))
+        proximas = datas_da_serie(serie, hoje, hoje + timedelta(days=SERIES_HORIZONTE_DIAS))[:5]
+        
+        return jsonify({
+            'success': True,
+            'message': 'Série de agendamentos criada com sucesso!',
+            'id': serie_id,
+            'puladas': [conflito['data'] for conflito in conflitos],
+            'proximas': [dia.isoformat() for dia in proximas]
+        })
+    
+    except FileNotFoundError:
+        return jsonify({'error': 'Banco de dados não encontrado'}), 500
+    except Exception as e:
+        return jsonify({'error': f'Erro no servidor: {str(e)}'}), 500
+
+@app.route('/api/series/<int:serie_id>', methods=['GET', 'PUT', 'DELETE'])
+def api_serie(serie_id):
+    """
+    Detalhe, encerramento/extensão (data_fim, ocorrencias), status e exclusão
+    da série. Excluir mantém as ocorrências já gravadas como agendamentos.
+    """
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'Não autorizado'}), 401
+    
+    usuario_id = session['usuario_id']
+    
+    try:
+        conn = get_db_connection()
+        
+        if request.method == 'GET':
+            serie = conn.execute(
+                CONSULTA_SERIES + ' WHERE s.id = ? AND s.usuario_id = ?', (serie_id, usuario_id)
+            ).fetchone()
+            if not serie:
+                return jsonify({'error': 'Série não encontrada'}), 404
+            hoje = max(date.today(), date.fromisoformat(serie['data_inicio']))
+            proximas = datas_da_serie(serie, hoje, hoje + timedelta(days=SERIES_HORIZONTE_DIAS))[:10]
+            return jsonify(descrever_serie(serie, proximas))
+        
+        if request.method == 'DELETE':
+            cursor = conn.execute(
+                'DELETE FROM series_agendamento WHERE id = ? AND usuario_id = ?', (serie_id, usuario_id)
+            )
+            if cursor.rowcount == 0:
+                return jsonify({'success': False, 'message': 'Série não encontrada'})
+            conn.execute('DELETE FROM excecoes_serie WHERE serie_id = ?', (serie_id,))
+            conn.execute('UPDATE agendamentos SET serie_id = NULL WHERE serie_id = ? AND usuario_id = ?',
+                         (serie_id, usuario_id))
+            conn.commit()
+            cache_respostas.invalidar(usuario_id)
+            publicar_alteracoes(usuario_id)
+            return jsonify({'success': True, 'message': 'Série excluída com sucesso!'})
+        
+        data = request.get_json() or {}
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            atual = conn.execute(
+                'SELECT * FROM series_agendamento WHERE id = ? AND usuario_id = ?', (serie_id, usuario_id)
+            ).fetchone()
+            if not atual:
+                return jsonify({'success': False, 'message': 'Série não encontrada'})
+            
+            serie = dict(atual)
+            for campo in ('data_fim', 'ocorrencias', 'status'):
+                if campo in data:
+                    serie[campo] = data[campo] or None
+            serie['status'] = serie['status'] or atual['status']
+            try:
+                serie = {**serie, **validar_serie(serie)}
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e)})
+            
+            # Só as datas que passam a existir (extensão ou reativação) são conferidas
+            conflitos = []
+            if serie['status'] != 'cancelado':
+                if atual['status'] == 'cancelado':
+                    de = max(date.today(), date.fromisoformat(serie['data_inicio']))
+                else:
+                    de = date.fromisoformat(atual['data_limite']) + timedelta(days=1) \
+                        if atual['data_limite'] != DATA_SEM_FIM else date.max
+                if de < date.max:
+                    configuracao = conn.execute(
+                        'SELECT duracao_slot_minutos FROM configuracao_agenda WHERE usuario_id = ?', (usuario_id,)
+                    ).fetchone()
+                    duracao_slot = configuracao[0] if configuracao else DURACAO_SLOT_PADRAO
+                    conflitos = conflitos_da_serie(
+                        conn, usuario_id, serie, de, date.max, duracao_slot, ignorar_serie=serie_id
+                    )
+                    if conflitos and not data.get('pular_conflitos'):
+                        return resposta_conflitos_serie(conflitos)
+            
+            conn.execute('''
+                UPDATE series_agendamento
+                SET data_fim = ?, ocorrencias = ?, status = ?, data_limite = ?
+                WHERE id = ? AND usuario_id = ?
+            ''', (serie['data_fim'], serie['ocorrencias'], serie['status'], serie['data_limite'],
+                  serie_id, usuario_id))
+            conn.executemany(
+                'INSERT OR IGNORE INTO excecoes_serie (serie_id, data_ocorrencia, usuario_id) VALUES (?, ?, ?)',
+                [(serie_id, conflito['data'], usuario_id) for conflito in conflitos]
+            )
+            conn.commit()
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+        
+        cache_respostas.invalidar(usuario_id)
+        publicar_alteracoes(usuario_id)
+        return jsonify({
+            'success': True,
+            'message': 'Série atualizada com sucesso!',
+            'puladas': [conflito['data'] for conflito in conflitos]
+        })
+    
+    except FileNotFoundError:
+        return jsonify({'error': 'Banco de dados não encontrado'}), 500
+    except Exception as e:
+        return jsonify({'error': f'Erro no servidor: {str(e)}'}), 500
+
+@app.route('/api/series/<int:serie_id>/ocorrencias/<data_ocorrencia>', methods=['POST', 'DELETE'])
+def api_ocorrencia_serie(serie_id, data_ocorrencia):
+    """
+    Exceções de uma ocorrência. POST grava a ocorrência como agendamento
+    (para mudar status, hora etc. pelas rotas de /api/agendamentos) e
+    devolve o id; DELETE tira só essa data da série.
+    """
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'Não autorizado'}), 401
+    
+    usuario_id = session['usuario_id']
+    
+    try:
+        dia = date.fromisoformat(data_ocorrencia)
+    except ValueError:
+        return jsonify({'error': 'Data deve estar no formato AAAA-MM-DD'}), 400
+    
+    try:
+        conn = get_db_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            serie = conn.execute(
+                'SELECT * FROM series_agendamento WHERE id = ? AND usuario_id = ?', (serie_id, usuario_id)
+            ).fetchone()
+            if not serie or not datas_da_serie(serie, dia, dia):
+                return jsonify({'success': False, 'message': 'Ocorrência não encontrada'}), 404
+            
+            excecao = conn.execute('''
+                SELECT e.agendamento_id, a.id AS existe
+                FROM excecoes_serie e
+                LEFT JOIN agendamentos a ON a.id = e.agendamento_id
+                WHERE e.serie_id = ? AND e.data_ocorrencia = ?
+            ''', (serie_id, dia.isoformat())).fetchone()
             
-            if enviado:
-                email_enviado = True
-                mensagem_email = "Email enviado com sucesso!"
+            if request.method == 'POST':
+                if excecao:
+                    # Já gravada antes: devolve o mesmo agendamento
+                    if excecao['existe']:
+                        return jsonify({'success': True, 'message': 'Ocorrência já gravada', 'id': excecao['existe']})
+                    return jsonify({'success': False, 'message': 'Ocorrência removida da série'}), 404
+                agendamento_id = materializar_ocorrencia(conn, serie, dia.isoformat())
+                mensagem = 'Ocorrência gravada como agendamento'
             else:
-                mensagem_email = f"Email não enviado: {mensagem}"
-        else:
-            mensagem_email = "Cliente não tem email cadastrado"
+                if excecao:
+                    return jsonify({'success': False, 'message': 'Ocorrência já removida ou gravada como agendamento'})
+                conn.execute(
+                    'INSERT INTO excecoes_serie (serie_id, data_ocorrencia, usuario_id) VALUES (?, ?, ?)',
+                    (serie_id, dia.isoformat(), usuario_id)
+                )
+                agendamento_id = None
+                mensagem = 'Ocorrência removida da série'
+            conn.commit()
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+        
+        cache_respostas.invalidar(usuario_id)
+        publicar_alteracoes(usuario_id, agendamento_id)
+        return jsonify({'success': True, 'message': mensagem, 'id': agendamento_id})
+    
+    except FileNotFoundError:
+        return jsonify({'error': 'Banco de dados não encontrado'}), 500
+    except Exception as e:
+        return jsonify({'error': f'Erro no servidor: {str(e)}'}), 500
+
+# =====================
+# API - STATUS DOS EMAILS DO AGENDAMENTO
+# =====================
+
+@app.route('/api/agendamentos/<int:agendamento_id>/emails')
+def api_emails_agendamento(agendamento_id):
+    """
+    Lista os emails enfileirados para um agendamento e o estado de cada um
+    """
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'Não autorizado'}), 401
+    
+    usuario_id = session['usuario_id']
+    
+    try:
+        conn = get_db_connection()
         
-        conn.close()
+        emails = conn.execute('''
+            SELECT id, destinatario, status_agendamento, estado, tentativas,
+                   ultimo_erro, criado_em, enviado_em, proxima_tentativa
+            FROM email_outbox
+            WHERE usuario_id = ? AND agendamento_id = ?
+            ORDER BY id DESC
+        ''', (usuario_id, agendamento_id)).fetchall()
         
         return jsonify({
-            'success': True,
-            'message': f'Status atualizado para {novo_status}. {mensagem_email}',
-            'email_enviado': email_enviado,
-            'agendamento': {
-                'id': agendamento_id,
-                'status': novo_status,
-                'cliente_nome': agendamento['cliente_nome'],
-                'servico_nome': agendamento['servico_nome'],
-                'data_agendamento': agendamento['data_agendamento'],
-                'hora_agendamento': agendamento['hora_agendamento']
-            }
+            'sucesso': True,
+            'emails': [dict(email) for email in emails]
         })
         
     except Exception as e:
         return jsonify({
-            'success': False,
-            'message': f'Erro ao atualizar status: {str(e)}'
+            'sucesso': False,
+            'error': f'Erro ao consultar emails: {str(e)}'
         }), 500
 
+# =====================
+# ESTATÍSTICAS DO DASHBOARD (CONSULTA ÚNICA)
+# =====================
+
+# Valor médio por serviço usado na receita estimada (exemplo: R$ 50.00)
+VALOR_MEDIO_SERVICO = 50.00
+
+def calcular_estatisticas(conn, usuario_id):
+    """
+    Calcula todos os contadores do dashboard em uma única consulta.
+
+    Escopo: os contadores de agendamentos (hoje, mês e os de status) são
+    todos do mês atual, somando as linhas gravadas e as ocorrências das
+    séries ainda não gravadas do mesmo mês; serviços e clientes são o
+    total. Assim gravar uma ocorrência não muda nenhum contador, e na
+    virada do mês todos recomeçam juntos.
+
+    Cada contador é uma subconsulta COUNT(*) sobre uma faixa de índice:
+    hoje e o mês são faixas de dia_agendamento em (usuario_id, dia,
+    minuto), e cada status uma faixa em (usuario_id, status, dia, minuto),
+    sem ler a tabela nem calcular strftime() por linha.
+    """
+    agora = datetime.now()
+    hoje = agora.strftime('%Y-%m-%d')
+    primeiro_dia = agora.date().replace(day=1)
+    ultimo_dia = somar_meses(primeiro_dia, 1) - timedelta(days=1)
+    
+    linha = conn.execute('''
+        SELECT
+            (SELECT COUNT(*) FROM agendamentos
+             WHERE usuario_id = ? AND dia_agendamento = ?) AS agendamentos_hoje,
+            (SELECT COUNT(*) FROM agendamentos
+             WHERE usuario_id = ? AND dia_agendamento BETWEEN ? AND ?) AS agendamentos_mes,
+            (SELECT COUNT(*) FROM agendamentos
+             WHERE usuario_id = ? AND status = 'pendente'
+               AND dia_agendamento BETWEEN ? AND ?) AS agendamentos_pendentes,
+            (SELECT COUNT(*) FROM agendamentos
+             WHERE usuario_id = ? AND status = 'confirmado'
+               AND dia_agendamento BETWEEN ? AND ?) AS agendamentos_confirmados,
+            (SELECT COUNT(*) FROM agendamentos
+             WHERE usuario_id = ? AND status = 'realizado'
+               AND dia_agendamento BETWEEN ? AND ?) AS agendamentos_realizados,
+            (SELECT COUNT(*) FROM agendamentos
+             WHERE usuario_id = ? AND status = 'cancelado'
+               AND dia_agendamento BETWEEN ? AND ?) AS agendamentos_cancelados,
+            (SELECT COUNT(*) FROM servicos WHERE usuario_id = ?) AS total_servicos,
+            (SELECT COUNT(*) FROM clientes WHERE usuario_id = ?) AS total_clientes
+    ''', (
+        usuario_id, dia_em_numero(agora.date()),
+        *(usuario_id, dia_em_numero(primeiro_dia), dia_em_numero(ultimo_dia)) * 5,
+        usuario_id, usuario_id
+    )).fetchone()
+    
+    ocorrencias = ocorrencias_series(conn, usuario_id, primeiro_dia, ultimo_dia)
+    ocorrencias_hoje = sum(1 for ocorrencia in ocorrencias if ocorrencia['data_agendamento'] == hoje)
+    ocorrencias_por_status = {}
+    for ocorrencia in ocorrencias:
+        ocorrencias_por_status[ocorrencia['status']] = ocorrencias_por_status.get(ocorrencia['status'], 0) + 1
+    
+    return {
+        'agendamentos_hoje': linha['agendamentos_hoje'] + ocorrencias_hoje,
+        'agendamentos_mes': linha['agendamentos_mes'] + len(ocorrencias),
+        'total_servicos': linha['total_servicos'],
+        'total_clientes': linha['total_clientes'],
+        'agendamentos_pendentes': linha['agendamentos_pendentes'] + ocorrencias_por_status.get('pendente', 0),
+        'agendamentos_confirmados': linha['agendamentos_confirmados'] + ocorrencias_por_status.get('confirmado', 0),
+        'agendamentos_realizados': linha['agendamentos_realizados'] + ocorrencias_por_status.get('realizado', 0),
+        'agendamentos_cancelados': linha['agendamentos_cancelados'] + ocorrencias_por_status.get('cancelado', 0)
+    }
+
 # =====================
 # API - DASHBOARD COMPLETO
 # =====================
@@ -1592,77 +5597,22 @@ def api_dashboard_completo():
     if 'usuario_id' not in session:
         return jsonify({'error': 'Não autorizado'}), 401
     
-    # Verificar se o banco existe
-    if not os.path.exists(DATABASE):
-        return jsonify({'error': 'Banco de dados não encontrado'}), 500
-    
     usuario_id = session['usuario_id']
     
     try:
-        conn = get_db_connection()
+        # Resposta em cache enquanto não houver escritas do usuário
+        chave_cache = f"dashboard:{datetime.now().strftime('%Y-%m-%d')}"
+        resposta, token_cache = cache_respostas.obter(chave_cache, usuario_id)
+        if resposta is not None:
+            return jsonify(resposta)
         
-        hoje = datetime.now().strftime('%Y-%m-%d')
-        mes_atual = datetime.now().month
-        ano_atual = datetime.now().year
+        conn = get_db_connection()
         
         # =====================
-        # ESTATÍSTICAS
+        # ESTATÍSTICAS (CONSULTA ÚNICA)
         # =====================
         
-        # Agendamentos de hoje
-        agendamentos_hoje = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM agendamentos 
-            WHERE usuario_id = ? AND data_agendamento = ?
-        ''', (usuario_id, hoje)).fetchone()['total']
-        
-        # Agendamentos deste mês
-        agendamentos_mes = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM agendamentos 
-            WHERE usuario_id = ? 
-            AND strftime('%m', data_agendamento) = ?
-            AND strftime('%Y', data_agendamento) = ?
-        ''', (usuario_id, f'{mes_atual:02d}', str(ano_atual))).fetchone()['total']
-        
-        # Total de serviços
-        total_servicos = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM servicos 
-            WHERE usuario_id = ?
-        ''', (usuario_id,)).fetchone()['total']
-        
-        # Total de clientes
-        total_clientes = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM clientes 
-            WHERE usuario_id = ?
-        ''', (usuario_id,)).fetchone()['total']
-        
-        # Agendamentos por status
-        agendamentos_pendentes = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM agendamentos 
-            WHERE usuario_id = ? AND status = 'pendente'
-        ''', (usuario_id,)).fetchone()['total']
-        
-        agendamentos_confirmados = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM agendamentos 
-            WHERE usuario_id = ? AND status = 'confirmado'
-        ''', (usuario_id,)).fetchone()['total']
-        
-        agendamentos_realizados = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM agendamentos 
-            WHERE usuario_id = ? AND status = 'realizado'
-        ''', (usuario_id,)).fetchone()['total']
-        
-        agendamentos_cancelados = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM agendamentos 
-            WHERE usuario_id = ? AND status = 'cancelado'
-        ''', (usuario_id,)).fetchone()['total']
+        estatisticas = calcular_estatisticas(conn, usuario_id)
         
         # =====================
         # AGENDAMENTOS RECENTES (ÚLTIMOS 10)
@@ -1675,10 +5625,23 @@ def api_dashboard_completo():
             LEFT JOIN clientes c ON a.cliente_id = c.id 
             LEFT JOIN servicos s ON a.servico_id = s.id 
             WHERE a.usuario_id = ? 
-            ORDER BY a.data_agendamento DESC, a.hora_agendamento DESC
+              AND a.dia_agendamento IS NOT NULL AND a.minuto_agendamento IS NOT NULL
+            ORDER BY a.dia_agendamento DESC, a.minuto_agendamento DESC, a.id DESC
             LIMIT 10
         ''', (usuario_id,)).fetchall()
         
+        # Ocorrências das séries na mesma janela da GET /api/agendamentos sem
+        # filtros (até SERIES_HORIZONTE_DIAS depois de hoje), só o suficiente
+        # para disputar as 10 posições com as linhas gravadas
+        ate_series = date.today() + timedelta(days=SERIES_HORIZONTE_DIAS)
+        de_series = date.min
+        if len(agendamentos) == 10:
+            de_series = EPOCA_DIAS + timedelta(days=agendamentos[-1]['dia_agendamento'])
+        ocorrencias = ocorrencias_da_lista(
+            conn, usuario_id, de_series, ate_series, 10,
+            [agendamento['dia_agendamento'] for agendamento in agendamentos]
+        )
+        
         # =====================
         # SERVIÇOS POPULARES (TOP 5)
         # =====================
@@ -1707,28 +5670,33 @@ def api_dashboard_completo():
             LIMIT 5
         ''', (usuario_id,)).fetchall()
         
-        conn.close()
-        
         # =====================
         # FORMATAR RESPOSTA
         # =====================
         
-        estatisticas = {
-            'agendamentos_hoje': agendamentos_hoje,
-            'agendamentos_mes': agendamentos_mes,
-            'total_servicos': total_servicos,
-            'total_clientes': total_clientes,
-            'agendamentos_pendentes': agendamentos_pendentes,
-            'agendamentos_confirmados': agendamentos_confirmados,
-            'agendamentos_realizados': agendamentos_realizados,
-            'agendamentos_cancelados': agendamentos_cancelados,
-            'timestamp': datetime.now().isoformat()
-        }
+        estatisticas['timestamp'] = datetime.now().isoformat()
+        
+        recentes = [
+            ((agendamento['dia_agendamento'], agendamento['minuto_agendamento'], agendamento['id']), agendamento)
+            for agendamento in agendamentos
+        ] + [
+            ((dia_em_numero(date.fromisoformat(ocorrencia['data_agendamento'])),
+              hora_em_minutos(ocorrencia['hora_agendamento']), -ocorrencia['serie_id']), ocorrencia)
+            for ocorrencia in ocorrencias
+        ]
+        if ocorrencias:
+            recentes = sorted(recentes, key=lambda item: item[0], reverse=True)[:10]
+        # Os sem data válida (agendamentos_sem_data) completam a lista, no fim
+        if len(recentes) < 10:
+            recentes.extend(
+                (None, agendamento) for agendamento in agendamentos_sem_data(conn, usuario_id, quantidade=10 - len(recentes))
+            )
         
         agendamentos_list = []
-        for agendamento in agendamentos:
+        for _, agendamento in recentes:
             agendamentos_list.append({
                 'id': agendamento['id'],
+                'serie_id': agendamento['serie_id'],
                 'cliente_nome': agendamento['cliente_nome'],
                 'cliente_telefone': agendamento['cliente_telefone'],
                 'cliente_email': agendamento['cliente_email'],
@@ -1752,18 +5720,20 @@ def api_dashboard_completo():
                 'total_agendamentos': cliente['total_agendamentos']
             })
         
-        return jsonify({
+        resposta = {
             'estatisticas': estatisticas,
             'agendamentos_recentes': agendamentos_list,
             'servicos_populares': servicos_populares_list,
             'clientes_frequentes': clientes_frequentes_list,
             'sucesso': True
-        })
+        }
+        cache_respostas.guardar(chave_cache, usuario_id, token_cache, resposta)
+        
+        return jsonify(resposta)
         
     except FileNotFoundError:
         return jsonify({'error': 'Banco de dados não encontrado'}), 500
     except Exception as e:
-        conn.close()
         return jsonify({
             'error': f'Erro ao carregar dashboard: {str(e)}',
             'sucesso': False
@@ -1809,13 +5779,11 @@ def atualizar_usuario():
         ).fetchone()
         
         if not usuario:
-            conn.close()
             return jsonify({'success': False, 'message': 'Usuário não encontrado'})
         
         # Verificar senha atual se for alterar senha
         if nova_senha and senha_atual:
             if usuario['senha'] != senha_atual:
-                conn.close()
                 return jsonify({'success': False, 'message': 'Senha atual incorreta'})
         
         # Atualizar dados
@@ -1834,7 +5802,6 @@ def atualizar_usuario():
             ).fetchone()
             
             if usuario_existente:
-                conn.close()
                 return jsonify({'success': False, 'message': 'Email já está em uso por outro usuário'})
             
             conn.execute(
@@ -1850,7 +5817,7 @@ def atualizar_usuario():
             )
         
         conn.commit()
-        conn.close()
+        cache_respostas.invalidar(usuario_id)
         
         return jsonify({
             'success': True,
@@ -1885,93 +5852,15 @@ def api_dashboard_estatisticas():
     try:
         conn = get_db_connection()
         
-        hoje = datetime.now().strftime('%Y-%m-%d')
-        mes_atual = datetime.now().month
-        ano_atual = datetime.now().year
-        
-        # 1. Agendamentos de hoje
-        agendamentos_hoje = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM agendamentos 
-            WHERE usuario_id = ? AND data_agendamento = ?
-        ''', (usuario_id, hoje)).fetchone()['total']
-        
-        # 2. Agendamentos deste mês
-        agendamentos_mes = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM agendamentos 
-            WHERE usuario_id = ? 
-            AND strftime('%m', data_agendamento) = ?
-            AND strftime('%Y', data_agendamento) = ?
-        ''', (usuario_id, f'{mes_atual:02d}', str(ano_atual))).fetchone()['total']
-        
-        # 3. Total de serviços
-        total_servicos = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM servicos 
-            WHERE usuario_id = ?
-        ''', (usuario_id,)).fetchone()['total']
-        
-        # 4. Total de clientes
-        total_clientes = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM clientes 
-            WHERE usuario_id = ?
-        ''', (usuario_id,)).fetchone()['total']
-        
-        # 5. Agendamentos por status
-        agendamentos_pendentes = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM agendamentos 
-            WHERE usuario_id = ? AND status = 'pendente'
-        ''', (usuario_id,)).fetchone()['total']
-        
-        agendamentos_confirmados = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM agendamentos 
-            WHERE usuario_id = ? AND status = 'confirmado'
-        ''', (usuario_id,)).fetchone()['total']
-        
-        agendamentos_realizados = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM agendamentos 
-            WHERE usuario_id = ? AND status = 'realizado'
-        ''', (usuario_id,)).fetchone()['total']
-        
-        agendamentos_cancelados = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM agendamentos 
-            WHERE usuario_id = ? AND status = 'cancelado'
-        ''', (usuario_id,)).fetchone()['total']
-        
-        # 6. Receita total deste mês (exemplo)
-        receita_mes = conn.execute('''
-            SELECT COUNT(*) as total_agendamentos 
-            FROM agendamentos 
-            WHERE usuario_id = ? 
-            AND strftime('%m', data_agendamento) = ?
-            AND strftime('%Y', data_agendamento) = ?
-        ''', (usuario_id, f'{mes_atual:02d}', str(ano_atual))).fetchone()['total_agendamentos']
-        
-        # Valor médio por serviço (exemplo: R$ 50.00)
-        receita_mes = receita_mes * 50.00
+        estatisticas = calcular_estatisticas(conn, usuario_id)
         
-        conn.close()
+        # Receita estimada do mês (valor médio por serviço)
+        estatisticas['receita_mes'] = estatisticas['agendamentos_mes'] * VALOR_MEDIO_SERVICO
+        estatisticas['timestamp'] = datetime.now().isoformat()
         
         return jsonify({
             'sucesso': True,
-            'estatisticas': {
-                'agendamentos_hoje': agendamentos_hoje,
-                'agendamentos_mes': agendamentos_mes,
-                'total_servicos': total_servicos,
-                'total_clientes': total_clientes,
-                'agendamentos_pendentes': agendamentos_pendentes,
-                'agendamentos_confirmados': agendamentos_confirmados,
-                'agendamentos_realizados': agendamentos_realizados,
-                'agendamentos_cancelados': agendamentos_cancelados,
-                'receita_mes': receita_mes,
-                'timestamp': datetime.now().isoformat()
-            }
+            'estatisticas': estatisticas
         })
         
     except Exception as e:
@@ -1984,6 +5873,103 @@ def api_dashboard_estatisticas():
 # API - BUSCA RÁPIDA
 # =====================
 
+_busca_fts_criada = False
+
+def busca_fts_disponivel(conn):
+    """Verifica (uma vez por processo) se a migração da busca FTS5 criou o índice"""
+    global _busca_fts_criada
+    if not _busca_fts_criada:
+        _busca_fts_criada = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='busca_fts'"
+        ).fetchone() is not None
+    return _busca_fts_criada
+
+def consulta_fts(usuario_id, tipo, termo):
+    """
+    Monta a expressão MATCH: todas as palavras do termo como prefixo,
+    restritas ao token de usuário e tipo. Retorna None se não houver palavras.
+    """
+    palavras = re.findall(r'[^\W_]+', termo)
+    if not palavras:
+        return None
+    texto = ' AND '.join(f'"{palavra}"*' for palavra in palavras)
+    return f'chave:u{usuario_id}{tipo} AND texto:({texto})'
+
+def buscar_com_fts(conn, usuario_id, termo):
+    """
+    Busca no índice FTS5. Clientes e serviços vêm por relevância (bm25 na
+    coluna texto); agendamentos vêm dos mais recentes para os mais antigos,
+    percorrendo o índice por rowid, que para no 5º resultado.
+    """
+    consulta = consulta_fts(usuario_id, 'cliente', termo)
+    if consulta is None:
+        return [], [], []
+    
+    clientes = conn.execute('''
+        SELECT c.id, c.nome, c.telefone, c.email
+        FROM busca_fts f
+        JOIN clientes c ON c.id = f.rowid / 3
+        WHERE busca_fts MATCH ?
+        ORDER BY bm25(busca_fts, 0.0, 1.0)
+        LIMIT 5
+    ''', (consulta,)).fetchall()
+    
+    servicos = conn.execute('''
+        SELECT s.id, s.nome, s.descricao
+        FROM busca_fts f
+        JOIN servicos s ON s.id = f.rowid / 3
+        WHERE busca_fts MATCH ?
+        ORDER BY bm25(busca_fts, 0.0, 1.0)
+        LIMIT 5
+    ''', (consulta_fts(usuario_id, 'servico', termo),)).fetchall()
+    
+    agendamentos = conn.execute('''
+        SELECT a.*, c.nome as cliente_nome, s.nome as servico_nome
+        FROM busca_fts f
+        JOIN agendamentos a ON a.id = f.rowid / 3
+        LEFT JOIN clientes c ON a.cliente_id = c.id
+        LEFT JOIN servicos s ON a.servico_id = s.id
+        WHERE busca_fts MATCH ?
+        ORDER BY f.rowid DESC
+        LIMIT 5
+    ''', (consulta_fts(usuario_id, 'agendamento', termo),)).fetchall()
+    
+    return clientes, servicos, agendamentos
+
+def buscar_com_like(conn, usuario_id, termo):
+    """Busca antiga com LIKE (usada quando o SQLite não tem FTS5)"""
+    # Buscar clientes
+    clientes = conn.execute('''
+        SELECT id, nome, telefone, email
+        FROM clientes 
+        WHERE usuario_id = ? 
+        AND (nome LIKE ? OR email LIKE ? OR telefone LIKE ?)
+        LIMIT 5
+    ''', (usuario_id, f'%{termo}%', f'%{termo}%', f'%{termo}%')).fetchall()
+    
+    # Buscar serviços
+    servicos = conn.execute('''
+        SELECT id, nome, descricao
+        FROM servicos 
+        WHERE usuario_id = ? 
+        AND nome LIKE ?
+        LIMIT 5
+    ''', (usuario_id, f'%{termo}%')).fetchall()
+    
+    # Buscar agendamentos
+    agendamentos = conn.execute('''
+        SELECT a.*, c.nome as cliente_nome, s.nome as servico_nome
+        FROM agendamentos a
+        LEFT JOIN clientes c ON a.cliente_id = c.id
+        LEFT JOIN servicos s ON a.servico_id = s.id
+        WHERE a.usuario_id = ? 
+        AND (c.nome LIKE ? OR s.nome LIKE ? OR a.data_agendamento LIKE ?)
+        ORDER BY a.dia_agendamento DESC
+        LIMIT 5
+    ''', (usuario_id, f'%{termo}%', f'%{termo}%', f'%{termo}%')).fetchall()
+    
+    return clientes, servicos, agendamentos
+
 @app.route('/api/busca/<termo>')
 def api_busca(termo):
     """
@@ -1997,37 +5983,10 @@ def api_busca(termo):
     try:
         conn = get_db_connection()
         
-        # Buscar clientes
-        clientes = conn.execute('''
-            SELECT id, nome, telefone, email
-            FROM clientes 
-            WHERE usuario_id = ? 
-            AND (nome LIKE ? OR email LIKE ? OR telefone LIKE ?)
-            LIMIT 5
-        ''', (usuario_id, f'%{termo}%', f'%{termo}%', f'%{termo}%')).fetchall()
-        
-        # Buscar serviços
-        servicos = conn.execute('''
-            SELECT id, nome, descricao
-            FROM servicos 
-            WHERE usuario_id = ? 
-            AND nome LIKE ?
-            LIMIT 5
-        ''', (usuario_id, f'%{termo}%')).fetchall()
-        
-        # Buscar agendamentos
-        agendamentos = conn.execute('''
-            SELECT a.*, c.nome as cliente_nome, s.nome as servico_nome
-            FROM agendamentos a
-            LEFT JOIN clientes c ON a.cliente_id = c.id
-            LEFT JOIN servicos s ON a.servico_id = s.id
-            WHERE a.usuario_id = ? 
-            AND (c.nome LIKE ? OR s.nome LIKE ? OR a.data_agendamento LIKE ?)
-            ORDER BY a.data_agendamento DESC
-            LIMIT 5
-        ''', (usuario_id, f'%{termo}%', f'%{termo}%', f'%{termo}%')).fetchall()
-        
-        conn.close()
+        if busca_fts_disponivel(conn):
+            clientes, servicos, agendamentos = buscar_com_fts(conn, usuario_id, termo)
+        else:
+            clientes, servicos, agendamentos = buscar_com_like(conn, usuario_id, termo)
         
         resultados = {
             'clientes': [dict(cliente) for cliente in clientes],
@@ -2060,6 +6019,30 @@ def api_busca(termo):
 # API - NOTIFICAÇÕES
 # =====================
 
+def montar_notificacoes(estatisticas):
+    """Notificações derivadas dos contadores (rota e eventos em tempo real)"""
+    notificacoes = []
+    
+    if estatisticas['agendamentos_hoje'] > 0:
+        notificacoes.append({
+            'id': 1,
+            'titulo': 'Agendamentos hoje',
+            'mensagem': f"Você tem {estatisticas['agendamentos_hoje']} agendamento(s) para hoje",
+            'tipo': 'info',
+            'icone': 'calendar-day'
+        })
+    
+    if estatisticas['agendamentos_pendentes'] > 0:
+        notificacoes.append({
+            'id': 2,
+            'titulo': 'Agendamentos pendentes',
+            'mensagem': f"Você tem {estatisticas['agendamentos_pendentes']} agendamento(s) pendentes neste mês",
+            'tipo': 'warning',
+            'icone': 'clock'
+        })
+    
+    return notificacoes
+
 @app.route('/api/notificacoes')
 def api_notificacoes():
     """
@@ -2071,50 +6054,22 @@ def api_notificacoes():
     usuario_id = session['usuario_id']
     
     try:
-        conn = get_db_connection()
-        
-        hoje = datetime.now().strftime('%Y-%m-%d')
-        
-        # Agendamentos de hoje
-        agendamentos_hoje = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM agendamentos 
-            WHERE usuario_id = ? AND data_agendamento = ?
-        ''', (usuario_id, hoje)).fetchone()['total']
+        chave_cache = f"notificacoes:{datetime.now().strftime('%Y-%m-%d')}"
+        resposta, token_cache = cache_respostas.obter(chave_cache, usuario_id)
+        if resposta is not None:
+            return jsonify(resposta)
         
-        # Agendamentos pendentes
-        agendamentos_pendentes = conn.execute('''
-            SELECT COUNT(*) as total 
-            FROM agendamentos 
-            WHERE usuario_id = ? AND status = 'pendente'
-        ''', (usuario_id,)).fetchone()['total']
-        
-        conn.close()
-        
-        notificacoes = []
-        
-        if agendamentos_hoje > 0:
-            notificacoes.append({
-                'id': 1,
-                'titulo': 'Agendamentos hoje',
-                'mensagem': f'Você tem {agendamentos_hoje} agendamento(s) para hoje',
-                'tipo': 'info',
-                'icone': 'calendar-day'
-            })
+        conn = get_db_connection()
         
-        if agendamentos_pendentes > 0:
-            notificacoes.append({
-                'id': 2,
-                'titulo': 'Agendamentos pendentes',
-                'mensagem': f'Você tem {agendamentos_pendentes} agendamento(s) pendentes',
-                'tipo': 'warning',
-                'icone': 'clock'
-            })
+        estatisticas = calcular_estatisticas(conn, usuario_id)
         
-        return jsonify({
+        resposta = {
             'sucesso': True,
-            'notificacoes': notificacoes
-        })
+            'notificacoes': montar_notificacoes(estatisticas)
+        }
+        cache_respostas.guardar(chave_cache, usuario_id, token_cache, resposta)
+        
+        return jsonify(resposta)
         
     except Exception as e:
         return jsonify({
@@ -2122,6 +6077,372 @@ def api_notificacoes():
             'error': f'Erro ao carregar notificações: {str(e)}'
         }), 500
 
+# =====================
+# EVENTOS EM TEMPO REAL (SSE)
+# =====================
+
+EventoSSE = namedtuple('EventoSSE', 'seq texto')
+
+def formatar_evento_sse(tipo, dados, evento_id=None):
+    """Um evento no formato text/event-stream (o JSON cabe sempre em uma linha)"""
+    linhas = [f'id: {evento_id}'] if evento_id else []
+    linhas.append(f'event: {tipo}')
+    linhas.append(f"data: {json.dumps(dados, ensure_ascii=False, separators=(',', ':'))}")
+    return '\n'.join(linhas) + '\n\n'
+
+class AssinaturaEventos:
+    """Uma conexão aberta em /api/eventos, com fila limitada"""
+    
+    def __init__(self, usuario_id, tamanho_fila):
+        self.usuario_id = usuario_id
+        self.fila = queue.Queue(maxsize=tamanho_fila)
+        self.ultimo_seq = 0
+        self.transbordou = False
+    
+    def entregar(self, evento):
+        try:
+            self.fila.put_nowait(evento)
+        except queue.Full:
+            # Cliente lento: em vez de crescer sem limite, ele recarrega tudo
+            self.transbordou = True
+    
+    def proximo(self, timeout):
+        """Próximo evento ainda não enviado, ou None após timeout"""
+        limite = time.monotonic() + timeout
+        while True:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                return None
+            try:
+                evento = self.fila.get(timeout=restante)
+            except queue.Empty:
+                return None
+            if evento.seq > self.ultimo_seq:
+                self.ultimo_seq = evento.seq
+                return evento
+    
+    def descartar_fila(self):
+        while True:
+            try:
+                self.fila.get_nowait()
+            except queue.Empty:
+                break
+        self.transbordou = False
+
+class CanalEventos:
+    """
+    Distribui os eventos de cada usuário para as conexões abertas dele.
+
+    Cada usuário tem um histórico curto (para reconexões com Last-Event-ID)
+    e o último estado publicado de contadores e notificações, para mandar
+    só o que mudou. Usuários sem conexão há mais de `retencao` segundos
+    são esquecidos e as rotas de escrita deixam de publicar para eles.
+
+    Os ids são "<instância>-<sequência>": um id de outro processo (ou de
+    antes de reiniciar) não pode ser retomado e vira um evento recarregar.
+    """
+    
+    def __init__(self, max_conexoes=100, tamanho_fila=100, historico=200, retencao=300):
+        self.max_conexoes = max_conexoes
+        self.tamanho_fila = tamanho_fila
+        self.historico = historico
+        self.retencao = retencao
+        self.instancia = format(int(time.time() * 1000), 'x')
+        self._lock = threading.Lock()
+        self._sequencia = 0
+        self._assinaturas = {}
+        self._usuarios = {}
+        self.conexoes = 0
+        self.publicados = 0
+        self.recusadas = 0
+        self.transbordos = 0
+    
+    def _estado(self, usuario_id):
+        # Chamado com self._lock adquirido
+        estado = self._usuarios.get(usuario_id)
+        if estado is None:
+            estado = self._usuarios[usuario_id] = {
+                'historico': deque(maxlen=self.historico),
+                'descartado_ate': 0,
+                'ultimos': {},
+                'versao': None,
+                'desconectado_em': None
+            }
+        return estado
+    
+    def _esquecer_inativos(self):
+        # Chamado com self._lock adquirido
+        limite = time.monotonic() - self.retencao
+        for usuario_id in [
+            usuario_id for usuario_id, estado in self._usuarios.items()
+            if not self._assinaturas.get(usuario_id)
+            and estado['desconectado_em'] is not None and estado['desconectado_em'] < limite
+        ]:
+            del self._usuarios[usuario_id]
+    
+    def interessado(self, usuario_id):
+        """Há alguém ouvindo (ou que pode reconectar) os eventos do usuário?"""
+        with self._lock:
+            self._esquecer_inativos()
+            return usuario_id in self._usuarios
+    
+    def assinar(self, usuario_id):
+        """Nova conexão do usuário, ou None se o limite de conexões foi atingido"""
+        with self._lock:
+            if self.conexoes >= self.max_conexoes:
+                self.recusadas += 1
+                return None
+            self._esquecer_inativos()
+            estado = self._estado(usuario_id)
+            estado['desconectado_em'] = None
+            assinatura = AssinaturaEventos(usuario_id, self.tamanho_fila)
+            assinatura.ultimo_seq = self._sequencia
+            self._assinaturas.setdefault(usuario_id, set()).add(assinatura)
+            self.conexoes += 1
+            return assinatura
+    
+    def cancelar(self, assinatura):
+        with self._lock:
+            assinaturas = self._assinaturas.get(assinatura.usuario_id)
+            if assinaturas is None or assinatura not in assinaturas:
+                return
+            assinaturas.discard(assinatura)
+            self.conexoes -= 1
+            if not assinaturas:
+                del self._assinaturas[assinatura.usuario_id]
+                if assinatura.usuario_id in self._usuarios:
+                    self._usuarios[assinatura.usuario_id]['desconectado_em'] = time.monotonic()
+    
+    def perdidos(self, assinatura, ultimo_id):
+        """
+        Eventos publicados depois de ultimo_id (Last-Event-ID), ou None quando
+        não dá para saber o que se perdeu e o cliente precisa recarregar.
+        """
+        instancia, _, seq = (ultimo_id or '').partition('-')
+        if instancia != self.instancia or not seq.isdigit():
+            return None
+        seq = int(seq)
+        with self._lock:
+            estado = self._usuarios.get(assinatura.usuario_id)
+            if estado is None or seq < estado['descartado_ate'] or seq > self._sequencia:
+                return None
+            eventos = [evento for evento in estado['historico'] if evento.seq > seq]
+        # A fila da conexão pode já ter alguns destes: não repetir
+        if eventos:
+            assinatura.ultimo_seq = max(assinatura.ultimo_seq, eventos[-1].seq)
+        return eventos
+    
+    def publicar(self, usuario_id, tipo, dados):
+        """Envia um evento para todas as conexões do usuário"""
+        with self._lock:
+            estado = self._usuarios.get(usuario_id)
+            if estado is None:
+                return
+            self._sequencia += 1
+            evento = EventoSSE(self._sequencia, formatar_evento_sse(tipo, dados, f'{self.instancia}-{self._sequencia}'))
+            historico = estado['historico']
+            if len(historico) == historico.maxlen:
+                estado['descartado_ate'] = historico[0].seq
+            historico.append(evento)
+            assinaturas = list(self._assinaturas.get(usuario_id, ()))
+            self.publicados += 1
+        
+        for assinatura in assinaturas:
+            if not assinatura.transbordou:
+                assinatura.entregar(evento)
+                if assinatura.transbordou:
+                    self.transbordos += 1
+    
+    def publicar_diferenca(self, usuario_id, tipo, valores):
+        """Publica só as chaves de `valores` que mudaram desde a última publicação"""
+        with self._lock:
+            estado = self._usuarios.get(usuario_id)
+            if estado is None:
+                return
+            anteriores = estado['ultimos'].get(tipo, {})
+            diferenca = {chave: valor for chave, valor in valores.items() if anteriores.get(chave) != valor}
+            estado['ultimos'][tipo] = dict(valores)
+        if diferenca:
+            self.publicar(usuario_id, tipo, diferenca)
+    
+    def publicar_se_mudou(self, usuario_id, tipo, valor):
+        """Publica `valor` inteiro, mas só se for diferente do último publicado"""
+        with self._lock:
+            estado = self._usuarios.get(usuario_id)
+            if estado is None or estado['ultimos'].get(tipo) == valor:
+                return
+            estado['ultimos'][tipo] = valor
+        self.publicar(usuario_id, tipo, valor)
+    
+    def conferir_versao(self, usuario_id, versao):
+        """
+        Registra a versão dos dados do usuário. Retorna True quando ela mudou
+        sem passar por este processo (outro worker, script ou CLI).
+        """
+        with self._lock:
+            estado = self._usuarios.get(usuario_id)
+            if estado is None:
+                return False
+            anterior = estado['versao']
+            estado['versao'] = versao
+            return anterior is not None and versao != anterior
+    
+    def registrar_versao(self, usuario_id, versao):
+        with self._lock:
+            estado = self._usuarios.get(usuario_id)
+            if estado is not None:
+                estado['versao'] = versao
+    
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'conexoes': self.conexoes,
+                'max_conexoes': self.max_conexoes,
+                'usuarios': len(self._usuarios),
+                'publicados': self.publicados,
+                'recusadas': self.recusadas,
+                'transbordos': self.transbordos
+            }
+
+canal_eventos = CanalEventos(
+    max_conexoes=EVENTOS_MAX_CONEXOES,
+    tamanho_fila=EVENTOS_FILA_MAX,
+    historico=EVENTOS_HISTORICO,
+    retencao=EVENTOS_RETENCAO_SEGUNDOS
+)
+
+def versao_usuario(conn, usuario_id):
+    """Soma das versões das tabelas do usuário (os triggers só a fazem crescer)"""
+    return conn.execute(
+        'SELECT COALESCE(SUM(versao), 0) FROM versoes_tabela WHERE usuario_id = ?',
+        (usuario_id,)
+    ).fetchone()[0]
+
+def publicar_alteracoes(usuario_id, agendamento_id=None, removido=False):
+    """
+    Publica em /api/eventos o que uma escrita mudou (chamar após o commit).
+
+    Manda o agendamento alterado (ou removido) e só os contadores e
+    notificações que mudaram. Sem ninguém ouvindo o usuário, não faz nem
+    as consultas. Falhas aqui nunca derrubam a escrita.
+    """
+    if not canal_eventos.interessado(usuario_id):
+        return
+    
+    try:
+        conn = get_db_connection()
+        
+        if agendamento_id is not None and removido:
+            canal_eventos.publicar(usuario_id, 'agendamento_removido', {'id': agendamento_id})
+        elif agendamento_id is not None:
+            agendamento = conn.execute('''
+                SELECT a.*, c.nome as cliente_nome, c.telefone as cliente_telefone, 
+                       c.email as cliente_email, s.nome as servico_nome
+                FROM agendamentos a 
+                LEFT JOIN clientes c ON a.cliente_id = c.id 
+                LEFT JOIN servicos s ON a.servico_id = s.id 
+                WHERE a.id = ? AND a.usuario_id = ?
+            ''', (agendamento_id, usuario_id)).fetchone()
+            if agendamento:
+                canal_eventos.publicar(usuario_id, 'agendamento', {
+                    'id': agendamento['id'],
+                    'serie_id': agendamento['serie_id'],
+                    'cliente_id': agendamento['cliente_id'],
+                    'cliente_nome': agendamento['cliente_nome'],
+                    'cliente_telefone': agendamento['cliente_telefone'],
+                    'cliente_email': agendamento['cliente_email'],
+                    'servico_id': agendamento['servico_id'],
+                    'servico_nome': agendamento['servico_nome'],
+                    'data_agendamento': agendamento['data_agendamento'],
+                    'hora_agendamento': agendamento['hora_agendamento'],
+                    'duracao_minutos': agendamento['duracao_minutos'],
+                    'profissional': agendamento['profissional'],
+                    'status': agendamento['status']
+                })
+        
+        estatisticas = calcular_estatisticas(conn, usuario_id)
+        canal_eventos.publicar_diferenca(usuario_id, 'contadores', estatisticas)
+        canal_eventos.publicar_se_mudou(usuario_id, 'notificacoes', montar_notificacoes(estatisticas))
+        canal_eventos.registrar_versao(usuario_id, versao_usuario(conn, usuario_id))
+    
+    except Exception as e:
+        print(f"⚠️ Falha ao publicar eventos do usuário {usuario_id}: {e}")
+
+def gerar_eventos(assinatura, ultimo_id):
+    """
+    Corpo do stream SSE de uma conexão.
+
+    Não segura conexão do banco nem o contexto da requisição enquanto
+    espera: só pega uma do pool a cada heartbeat, para notar escritas de
+    outros processos. Depois de EVENTOS_DURACAO_MAXIMA_SEGUNDOS o stream
+    termina e o navegador reconecta sozinho com o Last-Event-ID.
+    """
+    usuario_id = assinatura.usuario_id
+    recarregar = formatar_evento_sse('recarregar', {})
+    try:
+        # Espera do navegador antes de reconectar (ms)
+        yield 'retry: 3000\n\n'
+        
+        if ultimo_id:
+            perdidos = canal_eventos.perdidos(assinatura, ultimo_id)
+            if perdidos is None:
+                yield recarregar
+            else:
+                for evento in perdidos:
+                    yield evento.texto
+        
+        fim = time.monotonic() + EVENTOS_DURACAO_MAXIMA_SEGUNDOS
+        while True:
+            restante = fim - time.monotonic()
+            if restante <= 0:
+                break
+            
+            evento = assinatura.proximo(min(EVENTOS_HEARTBEAT_SEGUNDOS, restante))
+            if assinatura.transbordou:
+                assinatura.descartar_fila()
+                yield recarregar
+            elif evento is not None:
+                yield evento.texto
+            else:
+                conn = pool_conexoes.obter()
+                try:
+                    externo = canal_eventos.conferir_versao(usuario_id, versao_usuario(conn, usuario_id))
+                finally:
+                    pool_conexoes.devolver(conn)
+                if externo:
+                    canal_eventos.publicar(usuario_id, 'recarregar', {})
+                # Heartbeat: mantém proxies abertos e detecta clientes que sumiram
+                yield ': ping\n\n'
+    finally:
+        canal_eventos.cancelar(assinatura)
+
+@app.route('/api/eventos')
+def api_eventos():
+    """
+    Stream SSE (text/event-stream) com as mudanças do usuário logado.
+
+    Eventos: agendamento, agendamento_removido, cliente, servico,
+    contadores (só os que mudaram), notificacoes e recarregar (quando o
+    cliente perdeu eventos e deve buscar tudo de novo). Reconexões mandam
+    Last-Event-ID (ou ?ultimo_id=) e recebem o que perderam.
+    """
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'Não autorizado'}), 401
+    
+    assinatura = canal_eventos.assinar(session['usuario_id'])
+    if assinatura is None:
+        # O dashboard volta ao polling quando o stream é recusado
+        resposta = jsonify({'error': 'Muitas conexões de eventos abertas'})
+        resposta.status_code = 503
+        resposta.headers['Retry-After'] = str(int(EVENTOS_DURACAO_MAXIMA_SEGUNDOS))
+        return resposta
+    
+    ultimo_id = request.headers.get('Last-Event-ID') or request.args.get('ultimo_id')
+    resposta = Response(gerar_eventos(assinatura, ultimo_id), mimetype='text/event-stream')
+    resposta.headers['Cache-Control'] = 'no-cache'
+    resposta.headers['X-Accel-Buffering'] = 'no'
+    return resposta
+
 # =====================
 # API - ATIVIDADE RECENTE
 # =====================
@@ -2137,6 +6458,10 @@ def api_atividade_recente():
     usuario_id = session['usuario_id']
     
     try:
+        resposta, token_cache = cache_respostas.obter('atividade', usuario_id)
+        if resposta is not None:
+            return jsonify(resposta)
+        
         conn = get_db_connection()
         
         # Últimos agendamentos criados
@@ -2159,13 +6484,11 @@ def api_atividade_recente():
             LIMIT 5
         ''', (usuario_id,)).fetchall()
         
-        conn.close()
-        
         atividades = []
         
         # Adicionar agendamentos como atividades
         for agendamento in agendamentos[:5]:
-            data_formatada = datetime.strptime(agendamento['data_agendamento'], '%Y-%m-%d').strftime('%d/%m/%Y')
+            data_formatada = formatar_data_br(agendamento['data_agendamento'])
             atividades.append({
                 'tipo': 'agendamento',
                 'descricao': f'Agendamento para {agendamento["cliente_nome"]} - {agendamento["servico_nome"]}',
@@ -2186,10 +6509,13 @@ def api_atividade_recente():
         # Ordenar por data (mais recente primeiro)
         atividades.sort(key=lambda x: x['data'], reverse=True)
         
-        return jsonify({
+        resposta = {
             'sucesso': True,
             'atividades': atividades[:10]  # Limitar a 10 atividades
-        })
+        }
+        cache_respostas.guardar('atividade', usuario_id, token_cache, resposta)
+        
+        return jsonify(resposta)
         
     except Exception as e:
         return jsonify({
@@ -2197,16 +6523,193 @@ def api_atividade_recente():
             'error': f'Erro ao carregar atividade: {str(e)}'
         }), 500
 
+# =====================
+# API - EXPORTAÇÃO (NDJSON / CSV EM STREAMING)
+# =====================
+
+# Consultas de exportação: sempre por id crescente, para permitir retomar com ?desde_id=
+EXPORTACOES = {
+    'agendamentos': {
+        'query': '''
+            SELECT a.id, a.data_agendamento, a.hora_agendamento, a.status,
+                   a.cliente_id, c.nome as cliente_nome, c.telefone as cliente_telefone,
+                   c.email as cliente_email, a.servico_id, s.nome as servico_nome,
+                   a.data_criacao
+            FROM agendamentos a
+            LEFT JOIN clientes c ON a.cliente_id = c.id
+            LEFT JOIN servicos s ON a.servico_id = s.id
+            WHERE a.usuario_id = ? AND a.id > ?
+            ORDER BY a.id
+        ''',
+        'colunas': ['id', 'data_agendamento', 'hora_agendamento', 'status', 'cliente_id',
+                    'cliente_nome', 'cliente_telefone', 'cliente_email', 'servico_id',
+                    'servico_nome', 'data_criacao']
+    },
+    'clientes': {
+        'query': '''
+            SELECT id, nome, telefone, email, data_criacao
+            FROM clientes
+            WHERE usuario_id = ? AND id > ?
+            ORDER BY id
+        ''',
+        'colunas': ['id', 'nome', 'telefone', 'email', 'data_criacao']
+    },
+    'servicos': {
+        'query': '''
+            SELECT id, nome, descricao, imagem, data_criacao
+            FROM servicos
+            WHERE usuario_id = ? AND id > ?
+            ORDER BY id
+        ''',
+        'colunas': ['id', 'nome', 'descricao', 'imagem', 'data_criacao']
+    }
+}
+
+EXPORTACAO_LOTE = 500
+
+def gerar_linhas_exportacao(cursor, colunas, formato):
+    """
+    Gera a exportação em pedaços de texto, lendo EXPORTACAO_LOTE linhas
+    por vez do cursor, então a memória não cresce com o total de linhas.
+    """
+    buffer = io.StringIO()
+    escritor_csv = csv.writer(buffer) if formato == 'csv' else None
+    
+    if escritor_csv:
+        escritor_csv.writerow(colunas)
+    
+    while True:
+        linhas = cursor.fetchmany(EXPORTACAO_LOTE)
+        if not linhas:
+            break
+        
+        for linha in linhas:
+            if escritor_csv:
+                escritor_csv.writerow(tuple(linha))
+            else:
+                buffer.write(json.dumps(dict(zip(colunas, linha)), ensure_ascii=False))
+                buffer.write('\n')
+        
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def compactar_gzip(pedacos):
+    """Compacta um gerador de texto em gzip, pedaço por pedaço"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for pedaco in pedacos:
+        dados = compressor.compress(pedaco.encode('utf-8'))
+        if dados:
+            yield dados
+    yield compressor.flush()
+
+@app.route('/api/export/<tipo>')
+def api_exportar(tipo):
+    """
+    Exporta todos os registros do usuário em NDJSON (padrão) ou CSV.
+
+    Parâmetros: ?formato=ndjson|csv, ?gzip=1 para baixar compactado e
+    ?desde_id=N para retomar uma exportação interrompida.
+    """
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'Não autorizado'}), 401
+    
+    if tipo not in EXPORTACOES:
+        return jsonify({'error': f'Exportação inválida. Use: {", ".join(EXPORTACOES)}'}), 404
+    
+    formato = request.args.get('formato', 'ndjson')
+    if formato not in ('ndjson', 'csv'):
+        return jsonify({'error': 'Formato inválido. Use: ndjson, csv'}), 400
+    
+    try:
+        desde_id = int(request.args.get('desde_id', 0))
+    except ValueError:
+        return jsonify({'error': 'desde_id deve ser um número inteiro'}), 400
+    
+    usuario_id = session['usuario_id']
+    compactar = request.args.get('gzip') in ('1', 'true')
+    
+    try:
+        conn = get_db_connection()
+        exportacao = EXPORTACOES[tipo]
+        cursor = conn.execute(exportacao['query'], (usuario_id, desde_id))
+        
+        pedacos = gerar_linhas_exportacao(cursor, exportacao['colunas'], formato)
+        nome_arquivo = f'{tipo}.{formato}'
+        
+        if formato == 'csv':
+            # O Werkzeug já acrescenta o charset aos tipos text/*
+            mimetype = 'text/csv'
+        else:
+            mimetype = 'application/x-ndjson; charset=utf-8'
+        
+        if compactar:
+            pedacos = compactar_gzip(pedacos)
+            nome_arquivo += '.gz'
+            mimetype = 'application/gzip'
+        
+        resposta = Response(stream_with_context(pedacos), mimetype=mimetype)
+        resposta.headers['Content-Disposition'] = f'attachment; filename="{nome_arquivo}"'
+        resposta.headers['Cache-Control'] = 'no-store'
+        return resposta
+    
+    except FileNotFoundError:
+        return jsonify({'error': 'Banco de dados não encontrado'}), 500
+    except Exception as e:
+        return jsonify({'error': f'Erro na exportação: {str(e)}'}), 500
+
 # =====================
 # ROTA PARA SERVIR ARQUIVOS
 # =====================
 
+@app.route('/imagens/<nome>')
+def servir_imagem(nome):
+    """
+    Imagens do armazenamento por hash. O nome muda quando o conteúdo muda,
+    então o navegador pode guardá-las por um ano sem revalidar.
+    """
+    arquivo = PADRAO_NOME_IMAGEM.fullmatch(nome)
+    if not arquivo:
+        return "Arquivo não encontrado", 404
+    
+    hash_imagem, largura, extensao = arquivo.groups()
+    if largura and int(largura) not in miniaturas.larguras:
+        return "Arquivo não encontrado", 404
+    
+    etag = nome.rsplit('.', 1)[0]
+    if etag in request.if_none_match:
+        resposta = Response(status=304)
+    elif largura and not os.path.exists(caminho_imagem(nome)):
+        # Miniatura ainda não gerada (ou sem Pillow): manda para a original
+        # sem cache, e pede a geração para as próximas visitas
+        for extensao_original in MIME_IMAGENS:
+            original = f'{hash_imagem}.{extensao_original}'
+            if os.path.exists(caminho_imagem(original)):
+                miniaturas.agendar(original)
+                resposta = redirect(f'/imagens/{original}')
+                resposta.headers['Cache-Control'] = 'no-store'
+                return resposta
+        return "Arquivo não encontrado", 404
+    else:
+        try:
+            resposta = send_from_directory(
+                os.path.abspath(os.path.dirname(caminho_imagem(nome))), nome,
+                mimetype=MIME_IMAGENS[extensao], etag=False
+            )
+        except NotFound:
+            return "Arquivo não encontrado", 404
+    resposta.set_etag(etag)
+    resposta.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    resposta.headers['X-Content-Type-Options'] = 'nosniff'
+    return resposta
+
 @app.route('/<path:filename>')
 def serve_files(filename):
-    try:
-        return send_from_directory('.', filename)
-    except:
-        return "Arquivo não encontrado", 404
+    """Só o que está no índice de ArquivosEstaticos (páginas, CSS, JS, ícones)"""
+    return estaticos.responder(filename)
 
 # =====================
 # INICIALIZAÇÃO
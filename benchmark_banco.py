@@ -0,0 +1,563 @@
+"""
+Benchmarks do banco SQLite do Agendamento+.
+
+concorrencia: compara o modo padrão (rollback journal, sem busy_timeout
+    explícito) com o perfil de armazenamento usado pelo app.py (WAL +
+    synchronous=NORMAL + ...). Leitores simulam o dashboard (COUNTs por
+    usuário) e escritores simulam o POST /api/agendamentos (INSERT + commit),
+    cada um com a sua conexão.
+
+busca: compara a busca antiga com LIKE '%termo%' com o índice FTS5 criado
+    pelas migrações do app.py, num banco temporário com muitas linhas.
+
+templates: renderiza muitos emails de agendamento com os templates
+    pré-compilados do app.py e compara com a montagem via EmailMessage
+    (set_content/add_alternative + serialização), como era feito antes.
+
+disponibilidade: calcula os horários livres de um mês com
+    calcular_disponibilidade do app.py, num banco com muitos agendamentos.
+
+escritas: conta os comandos SQL que cada rota de escrita executa (via
+    set_trace_callback), incluindo os casos de "não encontrado".
+
+series: cria séries semanais de dois anos e mede a expansão de um mês
+    (ocorrencias_series do app.py), mostrando quantas linhas cada série
+    ocupa e o plano das consultas da janela.
+
+estatisticas: compara os contadores do dashboard feitos com uma passada
+    por todas as linhas do usuário (strftime por linha, como era antes) com
+    calcular_estatisticas do app.py, que conta faixas de dia_agendamento e
+    de status nos índices.
+
+Uso:
+    python benchmark_banco.py concorrencia [--segundos 5] [--leitores 8] [--escritores 2]
+    python benchmark_banco.py busca [--linhas 100000]
+    python benchmark_banco.py templates [--mensagens 10000]
+    python benchmark_banco.py disponibilidade [--linhas 50000]
+    python benchmark_banco.py escritas
+    python benchmark_banco.py series [--series 500]
+    python benchmark_banco.py estatisticas [--linhas 200000]
+"""
+import argparse
+import contextlib
+import io
+import sys
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+PERFIS = {
+    'antes (rollback journal)': {
+        'journal_mode': 'DELETE',
+        'pragmas': []
+    },
+    'depois (WAL + perfil)': {
+        'journal_mode': 'WAL',
+        'pragmas': [
+            'PRAGMA synchronous = NORMAL',
+            'PRAGMA busy_timeout = 5000',
+            'PRAGMA cache_size = -16000',
+            'PRAGMA mmap_size = 67108864',
+            'PRAGMA temp_store = MEMORY'
+        ]
+    }
+}
+
+def criar_banco(caminho, journal_mode, total_linhas):
+    conn = sqlite3.connect(caminho)
+    conn.execute(f'PRAGMA journal_mode = {journal_mode}')
+    conn.execute('''
+        CREATE TABLE agendamentos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cliente_id INTEGER,
+            servico_id INTEGER,
+            data_agendamento DATE NOT NULL,
+            hora_agendamento TIME NOT NULL,
+            status TEXT DEFAULT 'pendente',
+            usuario_id INTEGER,
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    status = ['pendente', 'confirmado', 'realizado', 'cancelado']
+    conn.executemany(
+        'INSERT INTO agendamentos (cliente_id, servico_id, data_agendamento, hora_agendamento, status, usuario_id) VALUES (?, ?, ?, ?, ?, ?)',
+        [
+            (i % 500, i % 20, f'2025-{1 + i % 12:02d}-{1 + i % 28:02d}', f'{8 + i % 10:02d}:00', status[i % 4], 1 + i % 10)
+            for i in range(total_linhas)
+        ]
+    )
+    conn.commit()
+    conn.close()
+
+def conectar(caminho, perfil):
+    conn = sqlite3.connect(caminho, check_same_thread=False)
+    for pragma in perfil['pragmas']:
+        conn.execute(pragma)
+    return conn
+
+def leitor(caminho, perfil, parar, resultado):
+    conn = conectar(caminho, perfil)
+    while not parar.is_set():
+        usuario_id = random.randint(1, 10)
+        inicio = time.perf_counter()
+        try:
+            for status in ('pendente', 'confirmado', 'realizado', 'cancelado'):
+                conn.execute(
+                    'SELECT COUNT(*) FROM agendamentos WHERE usuario_id = ? AND status = ?',
+                    (usuario_id, status)
+                ).fetchone()
+            resultado['leituras'].append(time.perf_counter() - inicio)
+        except sqlite3.OperationalError:
+            resultado['erros_leitura'] += 1
+    conn.close()
+
+def escritor(caminho, perfil, parar, resultado):
+    conn = conectar(caminho, perfil)
+    while not parar.is_set():
+        inicio = time.perf_counter()
+        try:
+            conn.execute(
+                'INSERT INTO agendamentos (cliente_id, servico_id, data_agendamento, hora_agendamento, status, usuario_id) VALUES (?, ?, ?, ?, ?, ?)',
+                (1, 1, '2025-06-15', '10:00', 'pendente', random.randint(1, 10))
+            )
+            conn.commit()
+            resultado['escritas'].append(time.perf_counter() - inicio)
+        except sqlite3.OperationalError:
+            conn.rollback()
+            resultado['erros_escrita'] += 1
+    conn.close()
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+def executar(nome, perfil, args):
+    pasta = tempfile.mkdtemp()
+    caminho = os.path.join(pasta, 'benchmark.db')
+    criar_banco(caminho, perfil['journal_mode'], args.linhas)
+
+    resultado = {'leituras': [], 'escritas': [], 'erros_leitura': 0, 'erros_escrita': 0}
+    parar = threading.Event()
+    threads = [threading.Thread(target=leitor, args=(caminho, perfil, parar, resultado)) for _ in range(args.leitores)]
+    threads += [threading.Thread(target=escritor, args=(caminho, perfil, parar, resultado)) for _ in range(args.escritores)]
+
+    for t in threads:
+        t.start()
+    time.sleep(args.segundos)
+    parar.set()
+    for t in threads:
+        t.join()
+
+    print(f"\n📊 {nome}")
+    print(f"   Leituras/s: {len(resultado['leituras']) / args.segundos:,.0f}  "
+          f"(p95 {percentil(resultado['leituras'], 0.95) * 1000:.2f} ms, erros {resultado['erros_leitura']})")
+    print(f"   Escritas/s: {len(resultado['escritas']) / args.segundos:,.0f}  "
+          f"(p95 {percentil(resultado['escritas'], 0.95) * 1000:.2f} ms, erros {resultado['erros_escrita']})")
+
+NOMES = ['João', 'José', 'Maria', 'Ana', 'Antônio', 'Francisco', 'Conceição', 'Sebastião',
+         'Luíza', 'Márcia', 'Cláudio', 'Patrícia', 'Vinícius', 'Letícia', 'Thaís', 'Paulo']
+SOBRENOMES = ['Silva', 'Araújo', 'Gonçalves', 'Conceição', 'Simões', 'Brandão', 'Magalhães',
+              'Damião', 'Assunção', 'Guimarães', 'Falcão', 'Peixoto', 'Tomaz', 'Oliveira']
+SERVICOS = ['Corte de cabelo', 'Escova progressiva', 'Manicure', 'Pedicure', 'Coloração',
+            'Hidratação', 'Barba', 'Sobrancelha', 'Depilação', 'Massagem']
+
+def criar_tabelas_base(caminho):
+    """Cria as tabelas que o app.py espera encontrar (as migrações fazem o resto)"""
+    conn = sqlite3.connect(caminho)
+    conn.executescript('''
+        CREATE TABLE usuarios (id INTEGER PRIMARY KEY AUTOINCREMENT, nome TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL, senha TEXT NOT NULL,
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE clientes (id INTEGER PRIMARY KEY AUTOINCREMENT, nome TEXT NOT NULL,
+            telefone TEXT, email TEXT, usuario_id INTEGER,
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE servicos (id INTEGER PRIMARY KEY AUTOINCREMENT, nome TEXT NOT NULL,
+            descricao TEXT, imagem TEXT, usuario_id INTEGER,
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE agendamentos (id INTEGER PRIMARY KEY AUTOINCREMENT, cliente_id INTEGER,
+            servico_id INTEGER, data_agendamento DATE NOT NULL, hora_agendamento TIME NOT NULL,
+            status TEXT DEFAULT 'pendente', usuario_id INTEGER,
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+    ''')
+    conn.close()
+
+def criar_banco_app(caminho):
+    """Cria as tabelas base do app e aplica as migrações importando o app.py"""
+    criar_tabelas_base(caminho)
+    os.environ['DATABASE'] = caminho
+    os.environ.setdefault('EMAIL_WORKERS', '0')
+    os.environ.setdefault('LEMBRETES_INTERVALO_SEGUNDOS', '0')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+    return app
+
+def benchmark_busca(args):
+    pasta = tempfile.mkdtemp()
+    caminho = os.path.join(pasta, 'busca.db')
+    app = criar_banco_app(caminho)
+
+    if not app.busca_fts_disponivel(sqlite3.connect(caminho)):
+        print("⚠️ SQLite sem FTS5: nada a comparar")
+        return
+
+    print(f"\n⏳ Populando {args.linhas:,} agendamentos...")
+    conn = sqlite3.connect(caminho)
+    total_clientes = max(1, args.linhas // 5)
+    conn.executemany(
+        'INSERT INTO servicos (nome, usuario_id) VALUES (?, 1)',
+        [(nome,) for nome in SERVICOS]
+    )
+    conn.executemany(
+        'INSERT INTO clientes (nome, telefone, email, usuario_id) VALUES (?, ?, ?, 1)',
+        [
+            (f'{random.choice(NOMES)} {random.choice(SOBRENOMES)} {random.choice(SOBRENOMES)}',
+             f'619{random.randint(10000000, 99999999)}', f'cliente{i}@exemplo.com')
+            for i in range(total_clientes)
+        ]
+    )
+    conn.executemany(
+        'INSERT INTO agendamentos (cliente_id, servico_id, data_agendamento, hora_agendamento, usuario_id) VALUES (?, ?, ?, ?, 1)',
+        [
+            (random.randint(1, total_clientes), random.randint(1, len(SERVICOS)),
+             f'{random.randint(2020, 2025)}-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}', '10:00')
+            for _ in range(args.linhas)
+        ]
+    )
+    conn.commit()
+    conn.row_factory = sqlite3.Row
+
+    termos = ['joao', 'Araújo', 'conceicao silva', 'escova', 'cliente123', 'magalh']
+    for nome, funcao in (('LIKE', app.buscar_com_like), ('FTS5', app.buscar_com_fts)):
+        inicio = time.perf_counter()
+        for _ in range(args.repeticoes):
+            for termo in termos:
+                funcao(conn, 1, termo)
+        media = (time.perf_counter() - inicio) / (args.repeticoes * len(termos))
+        print(f"📊 {nome}: {media * 1000:.2f} ms por busca")
+
+    resultado = app.buscar_com_fts(conn, 1, 'joao')[0]
+    print(f"   Exemplo FTS5 para 'joao': {[linha['nome'] for linha in resultado[:3]]}")
+    conn.close()
+
+def benchmark_templates(args):
+    pasta = tempfile.mkdtemp()
+    app = criar_banco_app(os.path.join(pasta, 'templates.db'))
+    from email.message import EmailMessage
+
+    status = ['pendente', 'confirmado', 'realizado', 'cancelado']
+    agendamentos = [
+        (f'cliente{i}@exemplo.com', f'{random.choice(NOMES)} {random.choice(SOBRENOMES)}',
+         random.choice(SERVICOS), f'2025-{1 + i % 12:02d}-{1 + i % 28:02d}', f'{8 + i % 10:02d}:00',
+         status[i % 4])
+        for i in range(args.mensagens)
+    ]
+
+    def via_email_message(email, nome, servico, data, hora, st):
+        assunto, texto, html = app.renderizar_email(nome, servico, data, hora, st)
+        msg = EmailMessage()
+        msg['Subject'] = assunto
+        msg['From'] = f'Agendamento+ <{app.EMAIL_REMETENTE}>'
+        msg['To'] = email
+        msg.set_content(texto)
+        msg.add_alternative(html, subtype='html')
+        return msg.as_bytes()
+
+    casos = (
+        ('EmailMessage (antes)', via_email_message),
+        ('renderizar_email (texto + HTML)', lambda email, *campos: app.renderizar_email(*campos)),
+        ('montar_email (MIME pronto)', app.montar_email)
+    )
+    for nome, funcao in casos:
+        inicio = time.perf_counter()
+        for agendamento in agendamentos:
+            funcao(*agendamento)
+        total = time.perf_counter() - inicio
+        print(f"📊 {nome}: {total:.2f} s para {args.mensagens:,} emails "
+              f"({total / args.mensagens * 1e6:,.0f} µs por email)")
+
+def benchmark_disponibilidade(args):
+    from datetime import date, datetime, timedelta
+    pasta = tempfile.mkdtemp()
+    caminho = os.path.join(pasta, 'disponibilidade.db')
+    app = criar_banco_app(caminho)
+
+    print(f"\n⏳ Populando {args.linhas:,} agendamentos em um ano...")
+    conn = sqlite3.connect(caminho)
+    inicio_ano = date(2030, 1, 1)
+    horas = [f'{h:02d}:{m:02d}' for h in range(9, 18) for m in (0, 30)]
+    conn.executemany(
+        'INSERT INTO agendamentos (cliente_id, servico_id, data_agendamento, hora_agendamento, status, usuario_id) VALUES (1, 1, ?, ?, ?, 1)',
+        [
+            ((inicio_ano + timedelta(days=random.randint(0, 364))).isoformat(), random.choice(horas),
+             random.choice(['pendente', 'confirmado', 'cancelado']))
+            for _ in range(args.linhas)
+        ]
+    )
+    conn.commit()
+    conn.row_factory = sqlite3.Row
+
+    agora = datetime(2029, 12, 31, 12, 0)
+    meses = [(date(2030, mes, 1), date(2030, mes, 28)) for mes in range(1, 13)]
+    inicio = time.perf_counter()
+    for _ in range(args.repeticoes):
+        for de, ate in meses:
+            resultado = app.calcular_disponibilidade(conn, 1, de, ate, agora)
+    media = (time.perf_counter() - inicio) / (args.repeticoes * len(meses))
+    livres = sum(len(dia['livres']) for dia in resultado['dias'])
+    print(f"📊 Disponibilidade de um mês: {media * 1000:.2f} ms ({livres} horários livres em dez/2030)")
+    conn.close()
+
+def benchmark_series(args):
+    from datetime import date, timedelta
+    pasta = tempfile.mkdtemp()
+    caminho = os.path.join(pasta, 'series.db')
+    app = criar_banco_app(caminho)
+
+    print(f"\n⏳ Criando {args.series:,} séries semanais de dois anos...")
+    conn = sqlite3.connect(caminho)
+    conn.row_factory = sqlite3.Row
+    inicio_series = date(2030, 1, 7)
+    linhas = []
+    for _ in range(args.series):
+        serie = {
+            'frequencia': 'semanal',
+            'intervalo': random.choice([1, 1, 2]),
+            'data_inicio': (inicio_series + timedelta(days=random.randint(0, 6))).isoformat(),
+            'data_fim': (inicio_series + timedelta(days=730)).isoformat(),
+            'ocorrencias': None
+        }
+        linhas.append((random.choice(['09:00', '10:00', '14:00', '16:30']), serie['frequencia'], serie['intervalo'],
+                       serie['data_inicio'], serie['data_fim'], app.calcular_data_limite(serie)))
+    conn.executemany('''
+        INSERT INTO series_agendamento
+            (cliente_id, servico_id, hora_agendamento, frequencia, intervalo, data_inicio, data_fim, data_limite, usuario_id)
+        VALUES (1, 1, ?, ?, ?, ?, ?, ?, 1)
+    ''', linhas)
+    conn.commit()
+
+    total_linhas = conn.execute('SELECT COUNT(*) FROM series_agendamento').fetchone()[0]
+    total_agendamentos = conn.execute('SELECT COUNT(*) FROM agendamentos').fetchone()[0]
+    print(f"📊 Linhas gravadas: {total_linhas:,} em series_agendamento, {total_agendamentos:,} em agendamentos")
+
+    de, ate = date(2031, 3, 1), date(2031, 3, 31)
+    inicio = time.perf_counter()
+    for _ in range(args.repeticoes):
+        ocorrencias = app.ocorrencias_series(conn, 1, de, ate)
+    media = (time.perf_counter() - inicio) / args.repeticoes
+    print(f"📊 Expansão de um mês: {media * 1000:.2f} ms ({len(ocorrencias):,} ocorrências em mar/2031)")
+
+    for consulta in (
+        "SELECT * FROM series_agendamento WHERE usuario_id = 1 AND data_limite >= '2031-03-01' AND data_inicio <= '2031-03-31'",
+        "SELECT serie_id, data_ocorrencia FROM excecoes_serie WHERE usuario_id = 1 AND data_ocorrencia BETWEEN '2031-03-01' AND '2031-03-31'",
+    ):
+        plano = conn.execute('EXPLAIN QUERY PLAN ' + consulta).fetchall()
+        print(f"🔎 {' | '.join(linha[3] for linha in plano)}")
+    conn.close()
+
+# Contadores do dashboard como eram antes: uma passada por todas as linhas do usuário
+ESTATISTICAS_ANTES = '''
+    SELECT
+        COALESCE(SUM(data_agendamento = ?), 0),
+        COALESCE(SUM(strftime('%Y-%m', data_agendamento) = ?), 0),
+        COALESCE(SUM(status = 'pendente'), 0),
+        COALESCE(SUM(status = 'confirmado'), 0),
+        COALESCE(SUM(status = 'realizado'), 0),
+        COALESCE(SUM(status = 'cancelado'), 0)
+    FROM agendamentos
+    WHERE usuario_id = ?
+'''
+
+def benchmark_estatisticas(args):
+    from datetime import date, datetime, timedelta
+    pasta = tempfile.mkdtemp()
+    caminho = os.path.join(pasta, 'estatisticas.db')
+    app = criar_banco_app(caminho)
+
+    print(f"\n⏳ Populando {args.linhas:,} agendamentos em cinco anos...")
+    conn = sqlite3.connect(caminho)
+    hoje = date.today()
+    horas = [f'{h:02d}:{m:02d}' for h in range(9, 18) for m in (0, 30)]
+    conn.executemany(
+        'INSERT INTO agendamentos (cliente_id, servico_id, data_agendamento, hora_agendamento, status, usuario_id) VALUES (1, 1, ?, ?, ?, 1)',
+        [
+            ((hoje - timedelta(days=random.randint(-365, 1460))).isoformat(), random.choice(horas),
+             random.choice(['pendente', 'confirmado', 'realizado', 'cancelado']))
+            for _ in range(args.linhas)
+        ]
+    )
+    conn.commit()
+    conn.row_factory = sqlite3.Row
+
+    agora = datetime.now()
+    parametros_antes = (agora.strftime('%Y-%m-%d'), agora.strftime('%Y-%m'), 1)
+    casos = (
+        ('Uma passada com strftime (antes)', lambda: conn.execute(ESTATISTICAS_ANTES, parametros_antes).fetchone()),
+        ('calcular_estatisticas (faixas de índice)', lambda: app.calcular_estatisticas(conn, 1)),
+    )
+    for nome, funcao in casos:
+        inicio = time.perf_counter()
+        for _ in range(args.repeticoes):
+            funcao()
+        media = (time.perf_counter() - inicio) / args.repeticoes
+        print(f"📊 {nome}: {media * 1000:.2f} ms")
+
+    antes = conn.execute(ESTATISTICAS_ANTES, parametros_antes).fetchone()
+    depois = app.calcular_estatisticas(conn, 1)
+    print(f"   Hoje/mês: {antes[0]}/{antes[1]} antes, "
+          f"{depois['agendamentos_hoje']}/{depois['agendamentos_mes']} agora")
+
+    primeiro_dia = hoje.replace(day=1)
+    for consulta in (
+        ESTATISTICAS_ANTES.replace('?', "'x'"),
+        f"SELECT COUNT(*) FROM agendamentos WHERE usuario_id = 1 AND dia_agendamento "
+        f"BETWEEN {app.dia_em_numero(primeiro_dia)} AND {app.dia_em_numero(primeiro_dia + timedelta(days=30))}",
+        f"SELECT COUNT(*) FROM agendamentos WHERE usuario_id = 1 AND status = 'pendente' AND dia_agendamento "
+        f"BETWEEN {app.dia_em_numero(primeiro_dia)} AND {app.dia_em_numero(primeiro_dia + timedelta(days=30))}",
+        "SELECT id FROM agendamentos WHERE usuario_id = 1 ORDER BY dia_agendamento DESC, minuto_agendamento DESC LIMIT 10",
+    ):
+        plano = conn.execute('EXPLAIN QUERY PLAN ' + consulta).fetchall()
+        print(f"🔎 {' | '.join(linha[3] for linha in plano)}")
+    conn.close()
+
+# Casos de benchmark_escritas, em ordem (cada um parte do estado deixado
+# pelo anterior): (nome, método, url, corpo JSON)
+CASOS_ESCRITAS = (
+    ('POST /api/agendamentos', 'post', '/api/agendamentos',
+     {'cliente_id': 1, 'servico_id': 1, 'data_agendamento': '2030-01-10', 'hora_agendamento': '10:00'}),
+    ('POST /api/agendamentos (cliente de outro)', 'post', '/api/agendamentos',
+     {'cliente_id': 2, 'servico_id': 1, 'data_agendamento': '2030-01-10', 'hora_agendamento': '10:00'}),
+    ('PUT /api/agendamentos/1', 'put', '/api/agendamentos/1', {'hora_agendamento': '11:00', 'servico_id': 1}),
+    ('PUT /api/agendamentos/1 (cliente de outro)', 'put', '/api/agendamentos/1', {'cliente_id': 2}),
+    ('PUT /api/agendamentos/1/status', 'put', '/api/agendamentos/1/status', {'status': 'confirmado'}),
+    ('POST /api/agendamentos (horário ocupado)', 'post', '/api/agendamentos',
+     {'cliente_id': 1, 'servico_id': 1, 'data_agendamento': '2030-01-10', 'hora_agendamento': '11:15'}),
+    ('PUT /api/servicos/1', 'put', '/api/servicos/1', {'nome': 'Corte masculino'}),
+    ('PUT /api/clientes/1', 'put', '/api/clientes/1', {'nome': 'Ana Maria'}),
+    ('PUT /api/clientes/2 (de outro)', 'put', '/api/clientes/2', {'nome': 'Invasor'}),
+    ('DELETE /api/agendamentos/1', 'delete', '/api/agendamentos/1', None),
+    ('DELETE /api/agendamentos/1 (já excluído)', 'delete', '/api/agendamentos/1', None),
+    ('DELETE /api/servicos/1', 'delete', '/api/servicos/1', None),
+    ('DELETE /api/clientes/1', 'delete', '/api/clientes/1', None),
+)
+
+def medir_escritas(caminho):
+    """
+    Roda CASOS_ESCRITAS num banco novo em caminho e retorna, para cada
+    caso, (nome, resposta JSON, comandos SQL executados).
+    """
+    app = criar_banco_app(caminho)
+
+    conn = sqlite3.connect(app.DATABASE)
+    conn.execute("INSERT INTO usuarios (nome, email, senha) VALUES ('Dono', 'dono@exemplo.com', 'x')")
+    conn.execute("INSERT INTO usuarios (nome, email, senha) VALUES ('Outro', 'outro@exemplo.com', 'x')")
+    conn.commit()
+    conn.close()
+
+    comandos = []
+
+    def contar(sql):
+        # Cada passo de trigger repete o SQL do comando que o disparou;
+        # BEGIN/COMMIT não contam
+        primeira = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+        if primeira in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH') and (not comandos or comandos[-1] != sql):
+            comandos.append(sql)
+
+    # Só as conexões das chamadas abaixo são rastreadas. Nada de
+    # before_request: o app pode já ter atendido requisições (testes)
+    obter_conexao = app.get_db_connection
+    rastreadas = []
+
+    def conexao_rastreada():
+        conn = obter_conexao()
+        conn.set_trace_callback(contar)
+        rastreadas.append(conn)
+        return conn
+
+    cliente = app.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['usuario_id'] = 1
+
+    def chamar(metodo, url, dados=None):
+        comandos.clear()
+        app.get_db_connection = conexao_rastreada
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                resposta = getattr(cliente, metodo)(url, json=dados)
+        finally:
+            app.get_db_connection = obter_conexao
+            for conn in rastreadas:
+                conn.set_trace_callback(None)
+            rastreadas.clear()
+        return resposta.get_json(), len(comandos)
+
+    chamar('post', '/api/servicos', {'nome': 'Corte'})
+    chamar('post', '/api/clientes', {'nome': 'Ana', 'telefone': '61999990000'})
+    with sqlite3.connect(app.DATABASE) as conn:
+        conn.execute("INSERT INTO clientes (nome, usuario_id) VALUES ('De outro usuário', 2)")
+
+    return [(nome, *chamar(metodo, url, dados)) for nome, metodo, url, dados in CASOS_ESCRITAS]
+
+def benchmark_escritas(args):
+    pasta = tempfile.mkdtemp()
+    for nome, resposta, total in medir_escritas(os.path.join(pasta, 'escritas.db')):
+        situacao = '✅' if resposta.get('success') else f"❌ {resposta.get('message')}"
+        print(f"📊 {nome}: {total} comando(s) SQL  {situacao}")
+
+def benchmark_concorrencia(args):
+    for nome, perfil in PERFIS.items():
+        executar(nome, perfil, args)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks do banco SQLite')
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    concorrencia = subparsers.add_parser('concorrencia', help='leitura/escrita concorrentes')
+    concorrencia.add_argument('--segundos', type=float, default=5)
+    concorrencia.add_argument('--leitores', type=int, default=8)
+    concorrencia.add_argument('--escritores', type=int, default=2)
+    concorrencia.add_argument('--linhas', type=int, default=20000)
+    concorrencia.set_defaults(funcao=benchmark_concorrencia)
+
+    busca = subparsers.add_parser('busca', help='LIKE x FTS5 na /api/busca')
+    busca.add_argument('--linhas', type=int, default=100000)
+    busca.add_argument('--repeticoes', type=int, default=5)
+    busca.set_defaults(funcao=benchmark_busca)
+
+    templates = subparsers.add_parser('templates', help='renderização dos emails de agendamento')
+    templates.add_argument('--mensagens', type=int, default=10000)
+    templates.set_defaults(funcao=benchmark_templates)
+
+    disponibilidade = subparsers.add_parser('disponibilidade', help='horários livres de um mês')
+    disponibilidade.add_argument('--linhas', type=int, default=50000)
+    disponibilidade.add_argument('--repeticoes', type=int, default=10)
+    disponibilidade.set_defaults(funcao=benchmark_disponibilidade)
+
+    escritas = subparsers.add_parser('escritas', help='comandos SQL por rota de escrita')
+    escritas.set_defaults(funcao=benchmark_escritas)
+
+    series = subparsers.add_parser('series', help='expansão das séries recorrentes')
+    series.add_argument('--series', type=int, default=500)
+    series.add_argument('--repeticoes', type=int, default=20)
+    series.set_defaults(funcao=benchmark_series)
+
+    estatisticas = subparsers.add_parser('estatisticas', help='contadores do dashboard')
+    estatisticas.add_argument('--linhas', type=int, default=200000)
+    estatisticas.add_argument('--repeticoes', type=int, default=20)
+    estatisticas.set_defaults(funcao=benchmark_estatisticas)
+
+    args = parser.parse_args()
+    if not args.benchmark:
+        parser.print_help()
+        sys.exit(1)
+
+    print("=" * 60)
+    print(f"BENCHMARK - {args.benchmark.upper()}")
+    print("=" * 60)
+    args.funcao(args)
+    print("=" * 60)
@@ -0,0 +1,30 @@
+"""
+O app.py só é importado uma vez por processo e guarda o caminho do banco
+no import. Os testes que escrevem dados usam app_isolado, que aponta o
+app para um banco novo só deles, sem mexer no banco dos outros testes.
+"""
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark_banco
+
+@pytest.fixture
+def app_isolado(tmp_path, monkeypatch):
+    app = benchmark_banco.criar_banco_app(str(tmp_path / 'importacao.db'))
+    
+    caminho = str(tmp_path / 'banco.db')
+    benchmark_banco.criar_tabelas_base(caminho)
+    monkeypatch.setattr(app, 'DATABASE', caminho)
+    with contextlib.redirect_stdout(io.StringIO()):
+        app.aplicar_migracoes()
+    monkeypatch.setattr(app, 'pool_conexoes', app.PoolConexoes(caminho, 4))
+    monkeypatch.setattr(app, 'cache_respostas', app.CacheRespostas(caminho))
+    
+    yield app
+    app.pool_conexoes.fechar_todas()
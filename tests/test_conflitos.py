@@ -0,0 +1,70 @@
+"""
+Checagem de sobreposição de horários em POST /api/agendamentos: um
+agendamento que passa da meia-noite ocupa o começo do dia seguinte, e
+POSTs simultâneos no mesmo horário deixam passar só um.
+"""
+import contextlib
+import io
+import sqlite3
+import threading
+
+import pytest
+
+@pytest.fixture
+def app_conflitos(app_isolado):
+    conn = sqlite3.connect(app_isolado.DATABASE)
+    conn.execute("INSERT INTO usuarios (nome, email, senha) VALUES ('Dono', 'dono@exemplo.com', 'x')")
+    conn.execute("INSERT INTO clientes (nome, usuario_id) VALUES ('Ana', 1)")
+    conn.execute("INSERT INTO servicos (nome, duracao_minutos, usuario_id) VALUES ('Corte', 30, 1)")
+    conn.commit()
+    conn.close()
+    return app_isolado
+
+def novo_cliente(app):
+    cliente = app.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['usuario_id'] = 1
+    return cliente
+
+def agendar(cliente, data_agendamento, hora_agendamento):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return cliente.post('/api/agendamentos', json={
+            'cliente_id': 1, 'servico_id': 1,
+            'data_agendamento': data_agendamento, 'hora_agendamento': hora_agendamento
+        })
+
+def test_conflito_depois_da_meia_noite(app_conflitos):
+    cliente = novo_cliente(app_conflitos)
+    assert agendar(cliente, '2030-03-10', '23:50').get_json()['success'] is True
+    
+    # 23:50 + 30 min ocupa até 00:20 do dia 11
+    resposta = agendar(cliente, '2030-03-11', '00:05')
+    assert resposta.status_code == 409
+    assert resposta.get_json()['conflito']['data_agendamento'] == '2030-03-10'
+    
+    assert agendar(cliente, '2030-03-11', '00:20').get_json()['success'] is True
+
+def test_posts_simultaneos_no_mesmo_horario(app_conflitos):
+    clientes = [novo_cliente(app_conflitos) for _ in range(8)]
+    barreira = threading.Barrier(len(clientes))
+    respostas = []
+    
+    def tentar(cliente):
+        barreira.wait()
+        resposta = agendar(cliente, '2030-03-12', '14:00')
+        respostas.append((resposta.status_code, resposta.get_json()))
+    
+    threads = [threading.Thread(target=tentar, args=(cliente,)) for cliente in clientes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    sucessos = [corpo for _, corpo in respostas if corpo.get('success')]
+    assert len(sucessos) == 1, respostas
+    assert sorted(status for status, _ in respostas) == [200] + [409] * (len(clientes) - 1)
+    
+    conn = sqlite3.connect(app_conflitos.DATABASE)
+    total = conn.execute("SELECT COUNT(*) FROM agendamentos WHERE data_agendamento = '2030-03-12'").fetchone()[0]
+    conn.close()
+    assert total == 1
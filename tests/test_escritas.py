@@ -0,0 +1,47 @@
+"""
+Número máximo de comandos SQL que cada rota de escrita pode executar.
+
+Usa os mesmos casos de `python benchmark_banco.py escritas`; se uma rota
+voltar a fazer SELECTs extras (checagem de dono separada, releitura após
+o UPDATE...), o teste falha.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark_banco
+
+# nome do caso: (máximo de comandos SQL, resposta com success)
+MAXIMOS = {
+    'POST /api/agendamentos': (4, True),
+    'POST /api/agendamentos (cliente de outro)': (1, False),
+    'PUT /api/agendamentos/1': (4, True),
+    'PUT /api/agendamentos/1 (cliente de outro)': (2, False),
+    'PUT /api/agendamentos/1/status': (1, True),
+    'POST /api/agendamentos (horário ocupado)': (2, False),
+    'PUT /api/servicos/1': (1, True),
+    'PUT /api/clientes/1': (1, True),
+    'PUT /api/clientes/2 (de outro)': (1, False),
+    'DELETE /api/agendamentos/1': (1, True),
+    'DELETE /api/agendamentos/1 (já excluído)': (1, False),
+    'DELETE /api/servicos/1': (1, True),
+    'DELETE /api/clientes/1': (1, True),
+}
+
+@pytest.fixture(scope='module')
+def resultados(tmp_path_factory):
+    caminho = tmp_path_factory.mktemp('escritas') / 'escritas.db'
+    return {nome: (resposta, total) for nome, resposta, total in benchmark_banco.medir_escritas(str(caminho))}
+
+def test_todos_os_casos_tem_maximo():
+    assert set(MAXIMOS) == {caso[0] for caso in benchmark_banco.CASOS_ESCRITAS}
+
+@pytest.mark.parametrize('nome', list(MAXIMOS))
+def test_comandos_por_rota(resultados, nome):
+    maximo, sucesso = MAXIMOS[nome]
+    resposta, total = resultados[nome]
+    assert bool(resposta.get('success')) is sucesso, resposta
+    assert total <= maximo, f'{nome}: {total} comandos SQL (máximo {maximo})'
@@ -0,0 +1,89 @@
+"""
+Lembretes do dia anterior contra um servidor SMTP local (socketserver),
+no modo SMTP_SEGURANCA=nenhuma: a segunda rodada do mesmo dia não manda
+nada de novo, e a primeira usa uma sessão só.
+"""
+import socketserver
+import sqlite3
+import threading
+
+import pytest
+
+DIA = '2031-05-20'
+
+class ServidorSMTP(socketserver.ThreadingTCPServer):
+    """O mínimo de SMTP para o smtplib: guarda as mensagens e conta as sessões"""
+    allow_reuse_address = True
+    daemon_threads = True
+    
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SessaoSMTP)
+        self.mensagens = []
+        self.sessoes = 0
+
+class SessaoSMTP(socketserver.StreamRequestHandler):
+    def responder(self, linha):
+        self.wfile.write(linha.encode() + b'\r\n')
+    
+    def handle(self):
+        self.server.sessoes += 1
+        self.responder('220 teste')
+        while True:
+            linha = self.rfile.readline()
+            if not linha:
+                return
+            comando = linha.decode(errors='replace').strip().upper()
+            if comando.startswith(('EHLO', 'HELO')):
+                self.responder('250 teste')
+            elif comando == 'DATA':
+                self.responder('354 fim com .')
+                dados = []
+                for corpo in iter(self.rfile.readline, b''):
+                    if corpo in (b'.\r\n', b'.\n'):
+                        break
+                    dados.append(corpo)
+                self.server.mensagens.append(b''.join(dados))
+                self.responder('250 ok')
+            elif comando == 'QUIT':
+                self.responder('221 tchau')
+                return
+            else:
+                # MAIL, RCPT, RSET, NOOP
+                self.responder('250 ok')
+
+@pytest.fixture
+def servidor_smtp():
+    servidor = ServidorSMTP()
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    yield servidor
+    servidor.shutdown()
+    servidor.server_close()
+
+def test_rodada_repetida_nao_reenvia(app_isolado, servidor_smtp):
+    conn = sqlite3.connect(app_isolado.DATABASE)
+    conn.row_factory = sqlite3.Row
+    conn.execute("INSERT INTO clientes (nome, email, usuario_id) VALUES ('Ana', 'ana@exemplo.com', 1)")
+    conn.execute("INSERT INTO servicos (nome, usuario_id) VALUES ('Corte', 1)")
+    conn.execute(
+        "INSERT INTO agendamentos (cliente_id, servico_id, data_agendamento, hora_agendamento, usuario_id) "
+        "VALUES (1, 1, ?, '10:00', 1)", (DIA,)
+    )
+    conn.commit()
+    
+    conexoes = app_isolado.ConexoesSMTP(
+        'agenda@exemplo.com', '', host='127.0.0.1', porta=servidor_smtp.server_address[1],
+        seguranca='nenhuma', timeout_conexao=5, timeout_envio=5
+    )
+    try:
+        primeira = app_isolado.lembretes.executar_rodada(conn, DIA, conexoes)
+        segunda = app_isolado.lembretes.executar_rodada(conn, DIA, conexoes)
+    finally:
+        conexoes.fechar_todas()
+        conn.close()
+    
+    assert (primeira['enviados'], primeira['falhas'], primeira['erro']) == (1, 0, None)
+    assert (segunda['enviados'], segunda['falhas']) == (0, 0)
+    assert len(servidor_smtp.mensagens) == 1
+    assert b'ana@exemplo.com' in servidor_smtp.mensagens[0]
+    assert conexoes.conexoes_abertas == 1
+    assert servidor_smtp.sessoes == 1